@@ -0,0 +1,134 @@
+"""Before/after benchmark for the loan provider analytics endpoint.
+
+Seeds N loans for one provider in a scratch database and compares the legacy
+per-bucket ``count_documents`` implementation against the single $facet pass
+and the rollup-document read in ``core.analytics``. Reports round-trips and
+latency for each size.
+
+    python -m benchmarks.analytics_bench --sizes 10000 100000 1000000
+"""
+import argparse
+import statistics
+
+from core.analytics import build_rollups, compute_provider_analytics, summarize_counters
+
+from .common import CommandCounter, bench_db, seed_loans, timed
+
+PROVIDER_ID = "LOANP-BENCH"
+
+
+def legacy_provider_analytics(col, provider_id):
+    """The pre-$facet implementation, kept verbatim for comparison."""
+    base_query = {"loan_provider_id": provider_id}
+
+    total_apps = col.count_documents(base_query)
+    approved_apps = col.count_documents({**base_query, "status": "Approved"})
+    rejected_apps = col.count_documents({**base_query, "status": "Rejected"})
+    pending_apps = col.count_documents({**base_query, "status": "Pending"})
+    approval_rate = (approved_apps / total_apps * 100) if total_apps > 0 else 0
+
+    risk_dist = {
+        "low": col.count_documents({**base_query, "risk": "LOW"}),
+        "medium": col.count_documents({**base_query, "risk": "MEDIUM"}),
+        "high": col.count_documents({**base_query, "risk": "HIGH"}),
+    }
+    residence_dist = {
+        "urban": col.count_documents({**base_query, "hospital_location": "Urban"}),
+        "rural": col.count_documents({**base_query, "hospital_location": "Rural"}),
+    }
+    portfolio_health = []
+    for risk in ["LOW", "MEDIUM", "HIGH"]:
+        portfolio_health.append({
+            "_id": risk.capitalize(),
+            "approved": col.count_documents({**base_query, "risk": risk, "status": "Approved"}),
+            "pending": col.count_documents({**base_query, "risk": risk, "status": "Pending"}),
+            "rejected": col.count_documents({**base_query, "risk": risk, "status": "Rejected"}),
+        })
+    tenure_counts = col.aggregate([
+        {"$match": base_query},
+        {"$group": {"_id": "$preferred_tenure", "count": {"$sum": 1}}},
+        {"$sort": {"_id": 1}}
+    ])
+    tenure_dist = [{"tenure": str(t["_id"]) + " M", "count": t["count"]} for t in tenure_counts]
+    trend_counts = col.aggregate([
+        {"$match": base_query},
+        {"$group": {
+            "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}},
+            "count": {"$sum": 1}
+        }},
+        {"$sort": {"_id": 1}},
+        {"$limit": 7}
+    ])
+    submission_trend = [{"date": t["_id"], "count": t["count"]} for t in trend_counts]
+    demographics = [
+        {"range": "18-30", "count": col.count_documents({**base_query, "age": {"$gte": 18, "$lte": 30}})},
+        {"range": "31-45", "count": col.count_documents({**base_query, "age": {"$gte": 31, "$lte": 45}})},
+        {"range": "46-60", "count": col.count_documents({**base_query, "age": {"$gte": 46, "$lte": 60}})},
+        {"range": "60+", "count": col.count_documents({**base_query, "age": {"$gt": 60}})},
+    ]
+    return {
+        "total": total_apps,
+        "approved": approved_apps,
+        "rejected": rejected_apps,
+        "pending": pending_apps,
+        "approval_rate": round(approval_rate, 1),
+        "risk_dist": risk_dist,
+        "residence_dist": residence_dist,
+        "portfolio_health": portfolio_health,
+        "tenure_dist": tenure_dist,
+        "submission_trend": submission_trend,
+        "demographics": demographics,
+    }
+
+
+def run(sizes, repeat, db_name):
+    counter = CommandCounter()
+    client, db = bench_db(db_name, [counter])
+    col = db.loan_requests_analytics_bench
+    rollups = db.loan_provider_analytics_bench
+
+    print(f"{'loans':>9} | {'impl':<7} | {'round-trips':>11} | {'median ms':>10} | {'min ms':>8}")
+    try:
+        for n in sizes:
+            col.drop()
+            seed_loans(col, n, PROVIDER_ID)
+            col.create_index([("loan_provider_id", 1), ("status", 1)])
+            rollups.drop()
+            for provider_id, counters in build_rollups(col.find({"loan_provider_id": PROVIDER_ID})).items():
+                rollups.insert_one({"loan_provider_id": provider_id, **counters})
+
+            results = {}
+            for name, fn in (
+                ("legacy", lambda: legacy_provider_analytics(col, PROVIDER_ID)),
+                ("facet", lambda: compute_provider_analytics(PROVIDER_ID, col)),
+                ("rollup", lambda: summarize_counters(rollups.find_one({"loan_provider_id": PROVIDER_ID}))),
+            ):
+                counter.reset()
+                fn()
+                trips = counter.count
+                results[name], timings = timed(fn, repeat)
+                print(
+                    f"{n:>9} | {name:<7} | {trips:>11} | "
+                    f"{statistics.median(timings) * 1000:>10.1f} | {min(timings) * 1000:>8.1f}"
+                )
+
+            for name in ("facet", "rollup"):
+                if results[name] != results["legacy"]:
+                    print(f"!! {name} response differs from legacy at n={n}")
+    finally:
+        col.drop()
+        rollups.drop()
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--db", default=None, help="scratch database name")
+    args = parser.parse_args()
+    run(args.sizes, args.repeat, args.db)
+
+
+if __name__ == "__main__":
+    main()
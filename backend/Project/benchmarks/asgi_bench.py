@@ -0,0 +1,168 @@
+"""Concurrency benchmark: sync views under WSGI vs async views under ASGI.
+
+Seeds a scratch database with one loan provider's loans and rollup, then
+drives the same request mix through Django's WSGI handler (sync views, one
+thread per in-flight request) and its ASGI handler (ASYNC_VIEWS=true, one
+event loop) at several concurrency levels. Each mode runs in a fresh child
+process. Reported: requests/s and p50/p95/p99 latency.
+
+The handlers are driven in-process (django.test Client / AsyncClient), so the
+numbers exclude the HTTP server itself; they isolate how each path overlaps
+its Mongo round-trips.
+
+    python -m benchmarks.asgi_bench --loans 20000 --concurrency 1 8 32 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .common import BASE_DIR, bench_db, percentile, seed_loans
+
+PROVIDER_ID = "LOANP-BENCH"
+USER_ID = 987654321
+MODES = ["wsgi", "asgi"]
+PATHS = [
+    "/api/recipients/",
+    "/api/loan/provider/analytics/",
+    "/api/loan/provider/requests/?limit=50",
+]
+
+
+def _bench_db_name(db_name):
+    return db_name or f"{os.getenv('MONGO_DB_NAME', 'healthcare')}_bench"
+
+
+def seed(db_name, loans):
+    from .common import setup_django
+
+    setup_django()
+    from core.analytics import build_rollups
+
+    client, db = bench_db(db_name)
+    for name in ("loan_requests", "loan_provider_analytics", "loan_providers", "directory_versions"):
+        db[name].drop()
+    seed_loans(db.loan_requests, loans, PROVIDER_ID)
+    db.loan_requests.create_index([("loan_provider_id", 1), ("created_at", -1), ("_id", -1)])
+    db.loan_providers.insert_one({"loan_provider_id": PROVIDER_ID, "name": "Bench Lender", "email": "lender@bench.test"})
+    rollup = build_rollups(db.loan_requests.find({"loan_provider_id": PROVIDER_ID}))[PROVIDER_ID]
+    db.loan_provider_analytics.insert_one({"loan_provider_id": PROVIDER_ID, **rollup})
+    client.close()
+
+
+def _token():
+    from types import SimpleNamespace
+
+    from django.core.cache import cache
+
+    from core.authentication import _version_key, tokens_for
+
+    user = SimpleNamespace(id=USER_ID, pk=USER_ID, is_active=True, email="lender@bench.test",
+                           role="loan_provider", token_version=0)
+    # No SQL user row in the scratch setup: pin the token version in the cache
+    cache.set(_version_key(USER_ID), 0, None)
+    return str(tokens_for(user, {"loan_provider_id": PROVIDER_ID}).access_token)
+
+
+def _summary(latencies, elapsed):
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50) * 1000,
+        "p95": percentile(latencies, 95) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+    }
+
+
+def run_wsgi(token, concurrency, requests):
+    from django.test import Client
+
+    def worker(n):
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {token}")
+        out = []
+        for i in range(n):
+            start = time.perf_counter()
+            response = client.get(PATHS[i % len(PATHS)])
+            out.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.content
+        return out
+
+    per_worker = requests // concurrency
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = [t for chunk in pool.map(worker, [per_worker] * concurrency) for t in chunk]
+    return _summary(latencies, time.perf_counter() - start)
+
+
+def run_asgi(token, concurrency, requests):
+    from django.test import AsyncClient
+
+    async def worker(n, latencies):
+        client = AsyncClient(AUTHORIZATION=f"Bearer {token}")
+        for i in range(n):
+            start = time.perf_counter()
+            response = await client.get(PATHS[i % len(PATHS)])
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.content
+
+    async def main():
+        latencies = []
+        per_worker = requests // concurrency
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(per_worker, latencies) for _ in range(concurrency)))
+        return _summary(latencies, time.perf_counter() - start)
+
+    return asyncio.run(main())
+
+
+def child(mode, db_name, concurrency, requests):
+    os.environ["MONGO_DB_NAME"] = _bench_db_name(db_name)
+    os.environ["ASYNC_VIEWS"] = "true" if mode == "asgi" else "false"
+    from .common import setup_django
+
+    setup_django()
+    from django.conf import settings
+
+    settings.ALLOWED_HOSTS.append("testserver")
+    token = _token()
+    run = run_asgi if mode == "asgi" else run_wsgi
+    run(token, 1, len(PATHS) * 3)   # warm up clients, pools and the directory cache
+    print(json.dumps(run(token, concurrency, requests)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loans", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--requests", type=int, default=2000, help="requests per run")
+    parser.add_argument("--db", default=None, help="scratch database name")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.db, args.concurrency[0], args.requests)
+        return
+
+    seed(args.db, args.loans)
+    print(f"{'mode':<5} | {'conc':>4} | {'req/s':>8} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8}")
+    for concurrency in args.concurrency:
+        for mode in MODES:
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.asgi_bench", "--child", mode,
+                 "--concurrency", str(concurrency), "--requests", str(args.requests)]
+                + (["--db", args.db] if args.db else []),
+                cwd=BASE_DIR, capture_output=True, text=True, check=True,
+            )
+            stats = json.loads(out.stdout.strip().splitlines()[-1])
+            print(
+                f"{mode:<5} | {concurrency:>4} | {stats['rps']:>8.0f} | {stats['p50']:>8.2f} | "
+                f"{stats['p95']:>8.2f} | {stats['p99']:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
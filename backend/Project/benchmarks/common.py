@@ -0,0 +1,155 @@
+"""Shared helpers for the benchmark scripts in this package.
+
+Benchmarks run against a scratch database on the MongoDB server configured by
+MONGO_URI (``<MONGO_DB_NAME>_bench`` unless --db is given) and never touch the
+application database.
+"""
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, monitoring
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+load_dotenv(BASE_DIR / ".env")
+
+TREATMENTS = ["Surgery", "Dialysis", "Emergency care", "Chemotherapy", "Physiotherapy", "Consultation"]
+LOCATIONS = ["Urban", "Rural"]
+TENURES = [6, 12, 18, 24, 36, 48]
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts the commands (round-trips) a client sends to the server."""
+
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        self.commands.append(event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def reset(self):
+        self.commands = []
+
+    @property
+    def count(self):
+        return len(self.commands)
+
+
+def setup_django():
+    """For benchmarks that exercise views, renderers or management commands."""
+    import sys
+
+    import django
+
+    if str(BASE_DIR) not in sys.path:
+        sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    django.setup()
+
+
+def bench_db(name=None, listeners=None):
+    client = MongoClient(os.getenv("MONGO_URI"), event_listeners=listeners or [])
+    return client, client[name or f"{os.getenv('MONGO_DB_NAME', 'healthcare')}_bench"]
+
+
+def make_loan(i, provider_id, rng=None, now=None):
+    rng = rng or random
+    now = now or datetime.utcnow()
+    risk = rng.choice(["LOW", "MEDIUM", "HIGH"])
+    status = {"LOW": "Approved", "HIGH": "Rejected"}.get(risk, rng.choice(["Pending", "Approved", "Rejected"]))
+    return {
+        "loan_id": f"LOAN-B{i:08d}",
+        "patient_id": f"PAT-BENCH-{i % 50000}",
+        "patient_name": f"Bench Patient{i}",
+        "age": rng.randint(18, 80),
+        "loan_purpose": "Treatment",
+        "medical_reason": "Synthetic benchmark row",
+        "treatment_type": rng.choice(TREATMENTS),
+        "phone": "9000000000",
+        "preferred_tenure": rng.choice(TENURES),
+        "hospital_name": "Bench Hospital",
+        "hospital_location": rng.choice(LOCATIONS),
+        "required_amount": rng.randrange(10000, 1000000, 1000),
+        "monthly_income": rng.randrange(10000, 200000, 500),
+        "insurance_available": rng.choice(["yes", "no"]),
+        "existing_loans": rng.choice(["yes", "no"]),
+        "loan_provider_id": provider_id,
+        "risk": risk,
+        "risk_score": rng.randint(0, 110),
+        "status": status,
+        "created_at": now - timedelta(days=rng.randint(0, 90), seconds=rng.randint(0, 86400)),
+    }
+
+
+def seed_loans(col, n, provider_id, chunk=10000, seed=42):
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    for start in range(0, n, chunk):
+        col.insert_many(
+            [make_loan(i, provider_id, rng, now) for i in range(start, min(start + chunk, n))],
+            ordered=False,
+        )
+
+
+def timed(fn, repeat=5):
+    """Run fn ``repeat`` times, return (last result, list of seconds)."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return result, timings
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def make_patient(i, rng=None):
+    rng = rng or random
+    return {
+        "email": f"bench.patient{i}@example.com",
+        "first_name": f"Patient{i}",
+        "last_name": rng.choice(["Rao", "Shetty", "Iyer", "Khan", "Das", "Nair"]),
+        "role": "patient",
+        "patient_id": f"PAT-BENCH-{i}",
+        "gender": rng.choice(["male", "female"]),
+        "dob": f"{rng.randint(1940, 2005)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "phone": f"9{rng.randint(100000000, 999999999)}",
+        "address": f"{i} Bench Road",
+        "city": rng.choice(["Bengaluru", "Mysuru", "Mangaluru", "Hubballi"]),
+        "state": "Karnataka",
+        "zip": f"560{rng.randint(100, 999)}",
+        "blood_group": rng.choice(["A+", "B+", "O+", "AB-"]),
+        "allergies": rng.choice(["", "penicillin", "peanuts, dust"]),
+        "profile_completed": True,
+    }
+
+
+def make_fhir_doc(i, organization_id, rng=None, now=None):
+    """A stored FHIR document shaped like the ones share_profile writes."""
+    from core.views import build_fhir_patient
+
+    rng = rng or random
+    patient = make_patient(i, rng)
+    return {
+        "shared_id": f"SHARE-B{i:08d}",
+        "patient_id": patient["patient_id"],
+        "organization_id": organization_id,
+        "fhir_resource": build_fhir_patient(patient, None, None, "Routine follow-up after surgery"),
+        "created_at": now or datetime.utcnow(),
+    }
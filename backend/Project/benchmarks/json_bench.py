@@ -0,0 +1,60 @@
+"""Serialization benchmark: DRF's JSONRenderer/JSONParser vs the orjson pair.
+
+Runs entirely in memory over payloads shaped like the API's responses: a page
+of stored FHIR documents (fhir_patients rows with datetimes), a full FHIR list
+response, and a page of loan requests. Reports render and parse time per
+payload and checks that both renderers produce identical bytes.
+
+    python -m benchmarks.json_bench --docs 500 --repeat 50
+"""
+import argparse
+import io
+import random
+from datetime import datetime
+
+from .common import make_fhir_doc, make_loan, percentile, setup_django, timed
+
+
+def payloads(n):
+    rng = random.Random(17)
+    now = datetime.utcnow()
+    fhir = [make_fhir_doc(i, "HOSP-B000001", rng, now) for i in range(n)]
+    loans = [make_loan(i, "LOANP-BENCH", rng, now) for i in range(n)]
+    return [
+        ("fhir page (50)", {"results": fhir[:50], "next_cursor": "eyJ2IjoxfQ", "has_more": True}),
+        (f"fhir list ({n})", fhir),
+        (f"loan list ({n})", loans),
+    ]
+
+
+def run(n, repeat):
+    setup_django()
+    from rest_framework.parsers import JSONParser
+    from rest_framework.renderers import JSONRenderer
+
+    from core.renderers import ORJSONParser, ORJSONRenderer
+
+    pairs = [("drf", JSONRenderer(), JSONParser()), ("orjson", ORJSONRenderer(), ORJSONParser())]
+    print(f"{'payload':<18} | {'impl':<6} | {'KiB':>7} | {'render ms':>9} | {'parse ms':>9} | {'same':>4}")
+    for label, data in payloads(n):
+        expected = JSONRenderer().render(data)
+        for impl, renderer, parser in pairs:
+            body, render_times = timed(lambda: renderer.render(data), repeat)
+            _, parse_times = timed(lambda: parser.parse(io.BytesIO(body)), repeat)
+            print(
+                f"{label:<18} | {impl:<6} | {len(body) / 1024:>7.1f} | "
+                f"{percentile(render_times, 50) * 1000:>9.3f} | {percentile(parse_times, 50) * 1000:>9.3f} | "
+                f"{'yes' if body == expected else 'NO':>4}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    run(args.docs, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,598 @@
+"""End-to-end HTTP load test: seeded dataset, role journeys, per-endpoint percentiles.
+
+1. Seed a dedicated MongoDB database and SQLite file with synthetic users,
+   shares, FHIR bundles and loans (both are wiped first), and write a dataset
+   manifest the runner reads:
+
+       python -m benchmarks.load_test seed --patients 2000 --doctors 100 --hospitals 20 \\
+           --providers 10 --shares 5000 --loans 20000
+
+2. Start the server against that dataset, the way it runs in production
+   (the seed step prints the environment to use), e.g.
+
+       MONGO_DB_NAME=healthcare_load SQLITE_PATH=load_test.sqlite3 \\
+           gunicorn config.wsgi -w 4 --threads 8
+
+3. Replay role journeys over HTTP keep-alive connections, one virtual user per
+   thread, each picking journeys by weight until the duration is up:
+
+       python -m benchmarks.load_test run --base-url http://127.0.0.1:8000 \\
+           --concurrency 32 --duration 120 --out load_test_results/run.json
+
+   patient    login -> profile -> recipients -> share profile -> FHIR list
+   applicant  login -> recipients -> apply for loan -> own loans
+   provider   login -> loan requests -> loan detail -> approve/reject -> analytics
+   hospital   login -> shared profiles -> FHIR list -> FHIR Patient search
+   doctor     login -> shared profiles -> FHIR list
+
+4. Compare two result files (requests/s and p95 per endpoint):
+
+       python -m benchmarks.load_test compare old.json new.json
+
+Requests made during --warmup are not counted. Every login verifies a real
+password hash, as in production.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from urllib.parse import quote, urlsplit
+
+from dotenv import load_dotenv
+
+from .common import BASE_DIR, make_loan, make_patient, percentile
+
+PASSWORD = "load-test-password"
+DEFAULT_DATASET = BASE_DIR / "load_test_dataset.json"
+DEFAULT_SQLITE = BASE_DIR / "load_test.sqlite3"
+CHUNK = 5000
+SPECIALIZATIONS = ["Cardiology", "Nephrology", "Oncology", "Orthopedics", "General Medicine"]
+ILLNESSES = ["Routine follow-up after surgery", "Dialysis planning", "Chest pain", "Fracture review"]
+DEFAULT_MIX = "patient=4,applicant=2,provider=2,hospital=1,doctor=1"
+
+
+def email(role, i):
+    return f"bench.{role}{i}@example.com"
+
+
+def organization_id(i):
+    return f"ORG-BENCH-{i}"
+
+
+def practitioner_id(i):
+    return f"PRAC-BENCH-{i}"
+
+
+def loan_provider_id(i):
+    return f"LOANP-BENCH-{i}"
+
+
+# -----------------------
+# Seeding
+# -----------------------
+
+def _setup(db_name, sqlite_path):
+    os.environ["MONGO_DB_NAME"] = db_name
+    os.environ["SQLITE_PATH"] = str(sqlite_path)
+    from .common import setup_django
+
+    setup_django()
+
+
+def _chunked(items, size=CHUNK):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def seed(args):
+    if args.db == os.getenv("MONGO_DB_NAME"):
+        sys.exit(f"Refusing to wipe the application database {args.db!r}; pass another --db")
+    if os.path.exists(args.sqlite):
+        os.remove(args.sqlite)
+    _setup(args.db, args.sqlite)
+
+    from django.contrib.auth.hashers import make_password
+    from django.core.management import call_command
+
+    from core import db
+    from core.analytics import build_rollups
+    from core.fhir import build_fhir_patient, fhir_document
+    from core.indexes import ensure_indexes
+    from core.models import User
+    from core.views import build_shared_doc
+
+    started = time.perf_counter()
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    password = make_password(PASSWORD)   # one hash for everyone; logins still verify it
+
+    call_command("migrate", verbosity=0)
+    db.get_client().drop_database(args.db)
+
+    hospitals = [
+        {"email": email("hospital", i), "name": f"Bench Hospital {i}", "role": "hospital",
+         "organization_id": organization_id(i), "created_at": now}
+        for i in range(args.hospitals)
+    ]
+    doctors = [
+        {"email": email("doctor", i), "first_name": f"Doctor{i}", "last_name": rng.choice(["Rao", "Iyer", "Khan"]),
+         "specialization": rng.choice(SPECIALIZATIONS), "organization_id": organization_id(i % args.hospitals),
+         "role": "doctor", "practitioner_id": practitioner_id(i), "created_at": now}
+        for i in range(args.doctors)
+    ]
+    providers = [
+        {"email": email("lender", i), "name": f"Bench Lender {i}", "role": "loan_provider",
+         "loan_provider_id": loan_provider_id(i), "created_at": now}
+        for i in range(args.providers)
+    ]
+    patients = [make_patient(i, rng) for i in range(args.patients)]
+
+    for col, role, docs in (
+        (db.organizations_col, "hospital", hospitals),
+        (db.practitioners_col, "doctor", doctors),
+        (db.loan_providers_col, "loan_provider", providers),
+        (db.patients_col, "patient", patients),
+    ):
+        for chunk in _chunked(docs):
+            col.insert_many([{**doc, "password": password} for doc in chunk])
+            # Passwords live in Mongo; the User rows only carry identity and role
+            User.objects.bulk_create([
+                User(email=doc["email"], role=role, first_name=doc.get("first_name", ""),
+                     last_name=doc.get("last_name", ""), password=make_password(None))
+                for doc in chunk
+            ])
+
+    def shares():
+        for i in range(args.shares):
+            patient = patients[i % args.patients]
+            doctor = doctors[rng.randrange(args.doctors)]
+            hospital = hospitals[rng.randrange(args.hospitals)]
+            data = {
+                "blood_group": patient["blood_group"],
+                "allergies": patient["allergies"],
+                "illness_reason": rng.choice(ILLNESSES),
+                "organization_id": hospital["organization_id"],
+                "practitioner_id": doctor["practitioner_id"],
+            }
+            share = build_shared_doc(patient, patient["email"], data, f"SHARE-B{i:08d}")
+            share.update(fhir_converted=True, shared_at=now)
+            yield share, fhir_document(share, build_fhir_patient(patient, doctor, hospital, data["illness_reason"]))
+
+    for chunk in _chunked(shares()):
+        db.shared_profiles_col.insert_many([share for share, _ in chunk])
+        db.fhir_patients_col.insert_many([doc for _, doc in chunk])
+
+    def loans():
+        for i in range(args.loans):
+            patient = patients[i % args.patients]
+            loan = make_loan(i, loan_provider_id(i % args.providers), rng, now)
+            loan.update(
+                patient_id=patient["patient_id"],
+                patient_name=f"{patient['first_name']} {patient['last_name']}",
+                hospital_name=hospitals[i % args.hospitals]["name"],
+            )
+            yield loan
+
+    rollups = {}
+    for chunk in _chunked(loans()):
+        db.loan_requests_col.insert_many(chunk)
+        for provider, counters in build_rollups(chunk).items():
+            _merge(rollups.setdefault(provider, {}), counters)
+    if rollups:
+        db.loan_analytics_col.insert_many([{"loan_provider_id": p, **c} for p, c in rollups.items()])
+
+    ensure_indexes()
+
+    dataset = {
+        "seed": args.seed,
+        "mongo_db": args.db,
+        "sqlite": str(args.sqlite),
+        "password": PASSWORD,
+        "patients": args.patients,
+        "doctors": args.doctors,
+        "hospitals": args.hospitals,
+        "providers": args.providers,
+        "shares": args.shares,
+        "loans": args.loans,
+        "seeded_at": now.isoformat(timespec="seconds") + "Z",
+    }
+    with open(args.dataset, "w") as out:
+        json.dump(dataset, out, indent=2)
+    print(f"Seeded in {time.perf_counter() - started:.1f}s; dataset written to {args.dataset}")
+    print(f"Start the server with: MONGO_DB_NAME={args.db} SQLITE_PATH={args.sqlite}")
+
+
+def _merge(into, counters):
+    """Add nested rollup counters (build_rollups output) into `into`."""
+    for key, value in counters.items():
+        if isinstance(value, dict):
+            _merge(into.setdefault(key, {}), value)
+        else:
+            into[key] = into.get(key, 0) + value
+
+
+# -----------------------
+# HTTP Client
+# -----------------------
+
+class JourneyFailed(Exception):
+    pass
+
+
+class Recorder:
+    """One virtual user's latencies and errors per endpoint (merged after the run)."""
+
+    def __init__(self, measure_from):
+        self.measure_from = measure_from
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+
+    def add(self, label, seconds, error=None):
+        if time.perf_counter() < self.measure_from:
+            return
+        self.latencies[label].append(seconds)
+        if error:
+            self.errors[label][error] += 1
+
+
+class Session:
+    """A keep-alive connection plus the state a browser session would hold."""
+
+    def __init__(self, base_url, recorder, timeout):
+        url = urlsplit(base_url)
+        connection = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        self.connection = connection(url.hostname, url.port, timeout=timeout)
+        self.prefix = url.path.rstrip("/")
+        self.recorder = recorder
+        self.token = None
+        self.etags = {}   # path -> (etag, body), for conditional GETs like the frontend's
+
+    def request(self, method, path, label, body=None, expect=(200,)):
+        headers = {"Accept": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+            body = json.dumps(body)
+        cached = self.etags.get(path) if method == "GET" else None
+        if cached:
+            headers["If-None-Match"] = cached[0]
+
+        start = time.perf_counter()
+        try:
+            self.connection.request(method, self.prefix + path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException) as exc:
+            self.connection.close()   # reconnects on the next request
+            self.recorder.add(label, time.perf_counter() - start, type(exc).__name__)
+            raise JourneyFailed(label)
+        elapsed = time.perf_counter() - start
+
+        if response.status == 304 and cached:
+            self.recorder.add(label, elapsed)
+            return cached[1]
+        if response.status not in expect:
+            self.recorder.add(label, elapsed, f"HTTP {response.status}")
+            raise JourneyFailed(label)
+        self.recorder.add(label, elapsed)
+        payload = json.loads(data) if data else None
+        if method == "GET" and response.getheader("ETag"):
+            self.etags[path] = (response.getheader("ETag"), payload)
+        return payload
+
+    def get(self, path, label=None):
+        return self.request("GET", path, label or f"GET {path.split('?')[0]}")
+
+    def post(self, path, body, expect=(200,)):
+        return self.request("POST", path, f"POST {path}", body, expect)
+
+    def login(self, address):
+        self.token = None
+        self.token = self.post("/api/auth/login/", {"email": address, "password": PASSWORD})["access"]
+
+
+# -----------------------
+# Journeys
+# -----------------------
+
+def _page(payload):
+    return payload["results"] if isinstance(payload, dict) else payload
+
+
+def patient_journey(session, rng, dataset):
+    session.login(email("patient", rng.randrange(dataset["patients"])))
+    profile = session.get("/api/profile/")
+    directory = session.get("/api/recipients/")
+    doctor = rng.choice(directory["doctors"])
+    hospital = rng.choice(directory["hospitals"])
+    session.post("/api/share-profile/", {
+        "blood_group": profile.get("blood_group"),
+        "allergies": profile.get("allergies"),
+        "illness_reason": rng.choice(ILLNESSES),
+        "practitioner_id": doctor["practitioner_id"],
+        "organization_id": hospital["organization_id"],
+    }, expect=(201,))
+    session.get("/api/patient/fhir-profiles/?limit=20")
+
+
+def applicant_journey(session, rng, dataset):
+    session.login(email("patient", rng.randrange(dataset["patients"])))
+    directory = session.get("/api/recipients/")
+    session.post("/api/loan/apply/", {
+        "age": rng.randint(18, 80),
+        "loan_purpose": "Treatment",
+        "medical_reason": rng.choice(ILLNESSES),
+        "treatment_type": rng.choice(["Surgery", "Dialysis", "Consultation"]),
+        "phone": "9000000000",
+        "preferred_tenure": rng.choice([6, 12, 24, 36]),
+        "hospital_name": rng.choice(directory["hospitals"])["name"],
+        "hospital_location": rng.choice(["Urban", "Rural"]),
+        "required_amount": rng.randrange(10000, 1000000, 1000),
+        "monthly_income": rng.randrange(10000, 200000, 500),
+        "insurance_available": rng.choice(["yes", "no"]),
+        "existing_loans": rng.choice(["yes", "no"]),
+        "loan_provider_id": rng.choice(directory["loan_providers"])["loan_provider_id"],
+    }, expect=(201,))
+    session.get("/api/loan/patient/?limit=20")
+
+
+def provider_journey(session, rng, dataset):
+    session.login(email("lender", rng.randrange(dataset["providers"])))
+    loans = _page(session.get("/api/loan/provider/requests/?limit=50"))
+    if loans:
+        pending = [loan for loan in loans if loan["status"] == "Pending"]
+        loan = session.get(f"/api/loan/provider/{rng.choice(pending or loans)['loan_id']}/",
+                           "GET /api/loan/provider/<loan_id>/")
+        if loan["status"] == "Pending":
+            amount = min(loan["suggested_amount"], loan["required_amount"])
+            if amount > 0:
+                decision = {"status": "Approved", "approved_amount": amount}
+            else:
+                decision = {"status": "Rejected"}
+            session.post("/api/loan/provider/update/", {"loan_id": loan["loan_id"], **decision})
+    session.get("/api/loan/provider/analytics/")
+
+
+def hospital_journey(session, rng, dataset):
+    session.login(email("hospital", rng.randrange(dataset["hospitals"])))
+    session.get("/api/hospital/shared-profiles/?limit=50")
+    session.get("/api/patient/fhir-profiles/?limit=20")
+    name = rng.choice(["rao", "shetty", "iyer", "khan", "das", "nair"])
+    session.get(f"/api/fhir/Patient/?name={quote(name)}&_count=20")
+
+
+def doctor_journey(session, rng, dataset):
+    session.login(email("doctor", rng.randrange(dataset["doctors"])))
+    session.get("/api/doctor/shared-profiles/?limit=50")
+    session.get("/api/patient/fhir-profiles/?limit=20")
+
+
+JOURNEYS = {
+    "patient": patient_journey,
+    "applicant": applicant_journey,
+    "provider": provider_journey,
+    "hospital": hospital_journey,
+    "doctor": doctor_journey,
+}
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in JOURNEYS:
+            raise argparse.ArgumentTypeError(f"unknown journey {name!r}; choose from {', '.join(JOURNEYS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# -----------------------
+# Runner
+# -----------------------
+
+def virtual_user(number, args, dataset, measure_from, stop_at, results):
+    rng = random.Random(args.seed * 1000003 + number)
+    recorder = Recorder(measure_from)
+    session = Session(args.base_url, recorder, args.timeout)
+    names, weights = zip(*args.mix.items())
+    journeys = Counter()
+    while time.perf_counter() < stop_at:
+        name = rng.choices(names, weights)[0]
+        try:
+            JOURNEYS[name](session, rng, dataset)
+            journeys[(name, "completed")] += 1
+        except JourneyFailed:
+            journeys[(name, "failed")] += 1
+        except (KeyError, TypeError, ValueError) as exc:
+            # An unexpected response body: count it, keep the user going
+            journeys[(name, "failed")] += 1
+            recorder.errors[f"journey {name}"][type(exc).__name__] += 1
+    session.connection.close()
+    results[number] = (recorder, journeys)
+
+
+def summarize(recorders, seconds):
+    latencies = defaultdict(list)
+    errors = defaultdict(Counter)
+    for recorder in recorders:
+        for label, values in recorder.latencies.items():
+            latencies[label].extend(values)
+        for label, counts in recorder.errors.items():
+            errors[label].update(counts)
+
+    endpoints = {}
+    for label in sorted(latencies):
+        values = latencies[label]
+        endpoints[label] = {
+            "requests": len(values),
+            "errors": sum(errors[label].values()),
+            "rps": len(values) / seconds,
+            "mean_ms": sum(values) / len(values) * 1000,
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": max(values) * 1000,
+        }
+    return endpoints, {label: dict(counts) for label, counts in errors.items() if counts}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    with open(args.dataset) as source:
+        dataset = json.load(source)
+
+    started_at = datetime.utcnow()
+    start = time.perf_counter()
+    measure_from = start + args.warmup
+    stop_at = measure_from + args.duration
+    results = {}
+    threads = [
+        threading.Thread(target=virtual_user, args=(n, args, dataset, measure_from, stop_at, results), daemon=True)
+        for n in range(args.concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Journeys in flight at stop_at finish after it; measure up to the last one
+    seconds = time.perf_counter() - measure_from
+
+    recorders = [recorder for recorder, _ in results.values()]
+    journeys = Counter()
+    for _, counts in results.values():
+        journeys.update(counts)
+    endpoints, errors = summarize(recorders, seconds)
+    total = sum(e["requests"] for e in endpoints.values())
+    report = {
+        "run": {
+            "started_at": started_at.isoformat(timespec="seconds") + "Z",
+            "git_commit": _git_commit(),
+            "base_url": args.base_url,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "measured_s": seconds,
+            "seed": args.seed,
+            "mix": args.mix,
+            "dataset": dataset,
+        },
+        "totals": {
+            "requests": total,
+            "errors": sum(e["errors"] for e in endpoints.values()),
+            "rps": total / seconds,
+            "journeys": {
+                name: {"completed": journeys[(name, "completed")], "failed": journeys[(name, "failed")]}
+                for name in args.mix
+            },
+        },
+        "endpoints": endpoints,
+        "errors": errors,
+    }
+
+    print_report(report)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as out:
+            json.dump(report, out, indent=2)
+        print(f"Results written to {args.out}")
+
+
+def print_report(report):
+    print(f"{'endpoint':<42} | {'reqs':>7} | {'err':>5} | {'req/s':>8} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8}")
+    for label, stats in report["endpoints"].items():
+        print(
+            f"{label:<42} | {stats['requests']:>7} | {stats['errors']:>5} | {stats['rps']:>8.1f} | "
+            f"{stats['p50_ms']:>8.2f} | {stats['p95_ms']:>8.2f} | {stats['p99_ms']:>8.2f}"
+        )
+    totals = report["totals"]
+    print(f"{'total':<42} | {totals['requests']:>7} | {totals['errors']:>5} | {totals['rps']:>8.1f}")
+    for name, counts in totals["journeys"].items():
+        print(f"journey {name}: {counts['completed']} completed, {counts['failed']} failed")
+
+
+def _change(old, new):
+    return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+
+def compare(args):
+    with open(args.baseline) as source:
+        baseline = json.load(source)
+    with open(args.candidate) as source:
+        candidate = json.load(source)
+
+    print(f"{'endpoint':<42} | {'req/s':>8} {'':>8} | {'p95 ms':>8} {'':>8}")
+    for label in sorted(set(baseline["endpoints"]) | set(candidate["endpoints"])):
+        old = baseline["endpoints"].get(label)
+        new = candidate["endpoints"].get(label)
+        if old is None or new is None:
+            print(f"{label:<42} | only in {'candidate' if old is None else 'baseline'}")
+            continue
+        print(
+            f"{label:<42} | {new['rps']:>8.1f} {_change(old['rps'], new['rps']):>8} | "
+            f"{new['p95_ms']:>8.2f} {_change(old['p95_ms'], new['p95_ms']):>8}"
+        )
+    print(f"{'total':<42} | {candidate['totals']['rps']:>8.1f} "
+          f"{_change(baseline['totals']['rps'], candidate['totals']['rps']):>8} |")
+
+
+def main():
+    load_dotenv(BASE_DIR / ".env")   # so --db defaults from, and never equals, the app database
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seeding = commands.add_parser("seed", help="wipe and seed the load-test databases")
+    seeding.add_argument("--patients", type=int, default=2000)
+    seeding.add_argument("--doctors", type=int, default=100)
+    seeding.add_argument("--hospitals", type=int, default=20)
+    seeding.add_argument("--providers", type=int, default=10)
+    seeding.add_argument("--shares", type=int, default=5000)
+    seeding.add_argument("--loans", type=int, default=20000)
+    seeding.add_argument("--seed", type=int, default=42)
+    seeding.add_argument("--db", default=f"{os.getenv('MONGO_DB_NAME', 'healthcare')}_load",
+                         help="MongoDB database to (re)create")
+    seeding.add_argument("--sqlite", default=str(DEFAULT_SQLITE), help="SQLite file to (re)create")
+    seeding.add_argument("--dataset", default=str(DEFAULT_DATASET), help="manifest for the run step")
+
+    running = commands.add_parser("run", help="replay role journeys against a running server")
+    running.add_argument("--base-url", default="http://127.0.0.1:8000")
+    running.add_argument("--concurrency", type=int, default=16, help="virtual users (threads)")
+    running.add_argument("--duration", type=float, default=60.0, help="measured seconds")
+    running.add_argument("--warmup", type=float, default=5.0, help="seconds before measuring starts")
+    running.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                         help=f"journey weights (default {DEFAULT_MIX})")
+    running.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    running.add_argument("--seed", type=int, default=42)
+    running.add_argument("--dataset", default=str(DEFAULT_DATASET))
+    running.add_argument("--out", help="write the JSON results here")
+
+    comparing = commands.add_parser("compare", help="compare two result files")
+    comparing.add_argument("baseline")
+    comparing.add_argument("candidate")
+
+    args = parser.parse_args()
+    {"seed": seed, "run": run, "compare": compare}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
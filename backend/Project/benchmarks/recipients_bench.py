@@ -0,0 +1,117 @@
+"""Latency benchmark for the recipients directory (GET /api/recipients/).
+
+Seeds N practitioners (plus N/50 hospitals and 50 loan providers) in a scratch
+database and times, per request:
+
+  legacy   three full collection scans rendered by DRF's JSONRenderer
+  rebuild  first request after a version bump (scans + render, then cached)
+  cached   version read + pre-rendered body from memory
+  304      version read only, client already holds the current ETag
+
+    python -m benchmarks.recipients_bench --practitioners 100000
+"""
+import argparse
+import random
+
+from .common import CommandCounter, bench_db, percentile, setup_django, timed
+
+FIRST_NAMES = ["Asha", "Ravi", "Meera", "Karan", "Divya", "Arjun", "Nisha", "Vikram"]
+LAST_NAMES = ["Rao", "Shetty", "Iyer", "Khan", "Das", "Nair", "Menon", "Patil"]
+
+
+def seed(db, n, rng):
+    hospitals = max(1, n // 50)
+    db.organizations.insert_many([
+        {"organization_id": f"HOSP-B{i:06d}", "name": f"Bench Hospital {i}", "email": f"h{i}@bench.test"}
+        for i in range(hospitals)
+    ])
+    db.loan_providers.insert_many([
+        {"loan_provider_id": f"LOANP-B{i:04d}", "name": f"Bench Lender {i}", "email": f"l{i}@bench.test"}
+        for i in range(50)
+    ])
+    for start in range(0, n, 10000):
+        db.practitioners.insert_many([
+            {
+                "practitioner_id": f"PRAC-B{i:07d}",
+                "first_name": rng.choice(FIRST_NAMES),
+                "last_name": rng.choice(LAST_NAMES),
+                "specialization": "General",
+                "organization_id": f"HOSP-B{i % hospitals:06d}",
+                "email": f"d{i}@bench.test",
+            }
+            for i in range(start, min(start + 10000, n))
+        ])
+
+
+def run(n, repeat, db_name):
+    setup_django()
+    from rest_framework.renderers import JSONRenderer
+
+    from core.directory import (
+        RecipientsDirectory, build_directory, bump_directory_version,
+        directory_version, etag_for, etag_matches,
+    )
+
+    counter = CommandCounter()
+    client, db = bench_db(db_name, listeners=[counter])
+    for name in ("practitioners", "organizations", "loan_providers", "directory_versions"):
+        db[name].drop()
+    try:
+        seed(db, n, random.Random(5))
+
+        def build():
+            return build_directory(db.practitioners, db.organizations, db.loan_providers)
+
+        directory = RecipientsDirectory(build=build)
+
+        def legacy():
+            return JSONRenderer().render(build())
+
+        def serve(if_none_match=None):
+            version = directory_version(db.directory_versions)
+            if etag_matches(if_none_match, etag_for(version)):
+                return b""
+            return directory.render(version)[1]
+
+        def rebuild():
+            bump_directory_version(db.directory_versions)
+            return serve()
+
+        current = etag_for(directory_version(db.directory_versions))
+        cases = [
+            ("legacy", legacy),
+            ("rebuild", rebuild),
+            ("cached", serve),
+            ("304", lambda: serve(current)),
+        ]
+
+        print(f"practitioners={n}")
+        print(f"{'case':<8} | {'p50 ms':>9} | {'p95 ms':>9} | {'round-trips':>11} | {'body KB':>8}")
+        for name, fn in cases:
+            fn()   # warm up (and fill the cache for the cached/304 cases)
+            counter.reset()
+            body, timings = timed(fn, repeat)
+            trips = counter.count / repeat
+            print(
+                f"{name:<8} | {percentile(timings, 50) * 1000:>9.2f} | "
+                f"{percentile(timings, 95) * 1000:>9.2f} | {trips:>11.1f} | {len(body) / 1024:>8.0f}"
+            )
+            if name == "rebuild":
+                current = etag_for(directory_version(db.directory_versions))
+    finally:
+        for name in ("practitioners", "organizations", "loan_providers", "directory_versions"):
+            db[name].drop()
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--practitioners", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--db", default=None, help="scratch database name")
+    args = parser.parse_args()
+    run(args.practitioners, args.repeat, args.db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Throughput benchmark for the batch risk engine vs calculate_risk_score.
+
+Runs entirely in memory (no database): generates N synthetic loan payloads
+and times the scalar loop, score_loans (dict parsing + vectorized scoring)
+and score_columns alone on pre-built columns.
+
+    python -m benchmarks.risk_bench --sizes 10000 100000 1000000
+"""
+import argparse
+import random
+import time
+
+from core.risk import calculate_risk_score, loans_to_columns, score_columns, score_loans
+
+from .common import make_loan
+
+
+def run(sizes):
+    print(f"{'loans':>9} | {'impl':<13} | {'seconds':>8} | {'loans/s':>12}")
+    for n in sizes:
+        rng = random.Random(11)
+        loans = [make_loan(i, "LOANP-BENCH", rng) for i in range(n)]
+        columns, _ = loans_to_columns(loans)
+
+        timings = {}
+        start = time.perf_counter()
+        scalar = [calculate_risk_score(loan) for loan in loans]
+        timings["scalar"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch = score_loans(loans)
+        timings["score_loans"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        score_columns(**columns)
+        timings["score_columns"] = time.perf_counter() - start
+
+        for name, seconds in timings.items():
+            print(f"{n:>9} | {name:<13} | {seconds:>8.3f} | {n / seconds:>12,.0f}")
+        if batch != scalar:
+            print(f"!! batch results differ from scalar at n={n}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+    run(args.sizes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Latency benchmark for the recipient typeahead index (core.search).
+
+Runs entirely in memory: builds a PrefixIndex over N synthetic doctors plus
+N/50 hospitals and 50 loan providers, then times typical typeahead queries
+(one to three characters, multi-word, filtered by kind or organization).
+
+    python -m benchmarks.search_bench --practitioners 100000
+"""
+import argparse
+import random
+import time
+
+from .common import percentile, setup_django
+from .recipients_bench import FIRST_NAMES, LAST_NAMES
+
+SPECIALIZATIONS = ["Cardiology", "Dermatology", "Neurology", "Orthopedics", "Pediatrics", "General"]
+
+QUERIES = [
+    ({"query": "a"}, "1 char"),
+    ({"query": "ra"}, "2 chars"),
+    ({"query": "meer"}, "4 chars"),
+    ({"query": "arjun na"}, "2 words"),
+    ({"query": "card", "kinds": ["doctor"]}, "specialization"),
+    ({"query": "bench", "kinds": ["hospital"]}, "hospital"),
+    ({"query": "r", "organization_id": "HOSP-B000007"}, "org filter"),
+]
+
+
+def run(n, repeat):
+    setup_django()
+    from core.search import PrefixIndex
+
+    rng = random.Random(9)
+    hospitals = max(1, n // 50)
+    docs = {
+        "doctor": [
+            {
+                "practitioner_id": f"PRAC-B{i:07d}",
+                "first_name": rng.choice(FIRST_NAMES),
+                "last_name": rng.choice(LAST_NAMES),
+                "specialization": rng.choice(SPECIALIZATIONS),
+                "organization_id": f"HOSP-B{i % hospitals:06d}",
+            }
+            for i in range(n)
+        ],
+        "hospital": [{"organization_id": f"HOSP-B{i:06d}", "name": f"Bench Hospital {i}"} for i in range(hospitals)],
+        "loan_provider": [{"loan_provider_id": f"LOANP-B{i:04d}", "name": f"Bench Lender {i}"} for i in range(50)],
+    }
+
+    index = PrefixIndex()
+    start = time.perf_counter()
+    index.load(docs)
+    print(f"entities={len(index)}  load={time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    index.add("doctor", {"practitioner_id": "PRAC-NEW", "first_name": "Zara", "last_name": "Rao", "specialization": "General"})
+    print(f"incremental add={(time.perf_counter() - start) * 1000:.2f} ms")
+
+    print(f"{'query':<16} | {'p50 ms':>8} | {'p99 ms':>8} | {'hits':>4}")
+    for kwargs, label in QUERIES:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            hits = index.search(**kwargs, limit=10)
+            timings.append(time.perf_counter() - start)
+        print(
+            f"{label:<16} | {percentile(timings, 50) * 1000:>8.3f} | "
+            f"{percentile(timings, 99) * 1000:>8.3f} | {len(hits):>4}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--practitioners", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=1000)
+    args = parser.parse_args()
+    run(args.practitioners, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
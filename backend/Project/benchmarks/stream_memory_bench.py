@@ -0,0 +1,109 @@
+"""Peak-RSS benchmark for buffered vs NDJSON-streamed FHIR listings.
+
+For each size N this seeds N FHIR documents for one hospital in a scratch
+database, then serves the listing in a fresh child process either the old way
+(list(find()) rendered by DRF's JSONRenderer) or through core.streaming, and
+reports the child's peak RSS. Streaming should stay flat as N grows.
+
+    python -m benchmarks.stream_memory_bench --sizes 1000 10000 100000
+"""
+import argparse
+import json
+import random
+import resource
+import subprocess
+import sys
+import time
+
+from .common import BASE_DIR, bench_db, make_fhir_doc, setup_django
+
+ORG_ID = "HOSP-BENCH"
+MODES = ["buffered", "ndjson", "ndjson+gzip"]
+
+
+def _peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def child(mode, db_name):
+    setup_django()
+    from rest_framework.renderers import JSONRenderer
+
+    from core.streaming import STREAM_BATCH_SIZE, gzip_chunks, ndjson_lines
+
+    client, db = bench_db(db_name)
+    col = db.fhir_patients_stream_bench
+    query, projection = {"organization_id": ORG_ID}, {"_id": 0}
+
+    baseline = _peak_rss_mb()
+    start = time.perf_counter()
+    sent = 0
+    if mode == "buffered":
+        sent = len(JSONRenderer().render(list(col.find(query, projection))))
+    else:
+        body = ndjson_lines(col.find(query, projection, batch_size=STREAM_BATCH_SIZE))
+        if mode == "ndjson+gzip":
+            body = gzip_chunks(body)
+        for chunk in body:
+            sent += len(chunk)
+    elapsed = time.perf_counter() - start
+    client.close()
+
+    print(json.dumps({
+        "baseline_mb": baseline,
+        "peak_mb": _peak_rss_mb(),
+        "bytes": sent,
+        "seconds": elapsed,
+    }))
+
+
+def run(sizes, db_name):
+    setup_django()
+    client, db = bench_db(db_name)
+    col = db.fhir_patients_stream_bench
+    rng = random.Random(7)
+
+    print(f"{'docs':>8} | {'mode':<12} | {'peak RSS MB':>11} | {'delta MB':>8} | {'body MB':>8} | {'seconds':>7}")
+    try:
+        col.drop()
+        seeded = 0
+        for n in sorted(sizes):
+            while seeded < n:
+                chunk = min(5000, n - seeded)
+                col.insert_many([make_fhir_doc(seeded + i, ORG_ID, rng) for i in range(chunk)])
+                seeded += chunk
+            col.create_index("organization_id")
+
+            for mode in MODES:
+                out = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.stream_memory_bench", "--child", mode]
+                    + (["--db", db_name] if db_name else []),
+                    cwd=BASE_DIR, capture_output=True, text=True, check=True,
+                )
+                stats = json.loads(out.stdout.strip().splitlines()[-1])
+                print(
+                    f"{n:>8} | {mode:<12} | {stats['peak_mb']:>11.1f} | "
+                    f"{stats['peak_mb'] - stats['baseline_mb']:>8.1f} | "
+                    f"{stats['bytes'] / 1e6:>8.1f} | {stats['seconds']:>7.2f}"
+                )
+    finally:
+        col.drop()
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--db", default=None, help="scratch database name")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.db)
+    else:
+        run(args.sizes, args.db)
+
+
+if __name__ == "__main__":
+    main()
@@ -46,6 +46,8 @@ AUTH_USER_MODEL = "core.User"
 # MIDDLEWARE
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',  # must be first
+    'core.metrics.MetricsMiddleware',
+    'core.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -81,7 +83,8 @@ WSGI_APPLICATION = 'config.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        # SQLITE_PATH points a process at another file (benchmarks/load_test.py)
+        'NAME': os.getenv("SQLITE_PATH") or BASE_DIR / 'db.sqlite3',
     }
 }
 
@@ -153,6 +156,90 @@ LOGGING = {
     },
 }
 
+# MONGODB CLIENT (core/db.py)
+# Keyword arguments for pymongo.MongoClient, built lazily once per process.
+# Size MONGO_MAX_POOL_SIZE to the threads a process runs (server threads plus
+# FHIR worker threads); MONGO_COMPRESSORS is e.g. "zstd,zlib".
+MONGO_CLIENT_OPTIONS = {
+    "appname": os.getenv("MONGO_APP_NAME", "capstone-backend"),
+    "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "100")),
+    "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+    "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000")),
+    "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "20000")),
+    "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "30000")),
+    "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "0")) or None,
+    "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0")) or None,
+    "readPreference": os.getenv("MONGO_READ_PREFERENCE", "primary"),
+}
+if os.getenv("MONGO_WRITE_CONCERN"):
+    # "majority", or a number of nodes
+    w = os.getenv("MONGO_WRITE_CONCERN")
+    MONGO_CLIENT_OPTIONS["w"] = int(w) if w.isdigit() else w
+if os.getenv("MONGO_COMPRESSORS"):
+    MONGO_CLIENT_OPTIONS["compressors"] = os.getenv("MONGO_COMPRESSORS")
+# Open the connection when a server process starts rather than on its first request
+MONGO_WARM_UP = os.getenv("MONGO_WARM_UP", "false").lower() == "true"
+
+# ASYNC VIEWS
+# Route the hot read endpoints to core/async_views.py. Turn on only when
+# serving config.asgi with an ASGI server; under WSGI every async view would
+# pay for a per-request event loop.
+ASYNC_VIEWS = os.getenv("ASYNC_VIEWS", "false").lower() == "true"
+
+# METRICS (core/metrics.py)
+# Per-route latency/status/size histograms and per-request Mongo command
+# counts, scraped from GET /api/metrics by addresses in METRICS_ALLOWED_NETWORKS.
+# Loopback only unless widened: behind docker-compose every outside request
+# arrives from the bridge gateway (172.x), so allowing private ranges would
+# publish the endpoint. List the scraper's own address or network instead.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_ALLOWED_NETWORKS = [
+    net.strip() for net in os.getenv("METRICS_ALLOWED_NETWORKS", "127.0.0.0/8,::1/128").split(",") if net.strip()
+]
+if not METRICS_ENABLED:
+    MIDDLEWARE.remove('core.metrics.MetricsMiddleware')
+
+# PROFILING (core/profiling.py)
+# Profiles one request on demand: an X-Profile header from
+# `manage.py profile_token`, or ?_profile=sample|trace from a staff user.
+# Reports are kept in PROFILING_REPORT_DIR and listed by GET /api/profiles/.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "true").lower() == "true"
+PROFILING_REPORT_DIR = os.getenv("PROFILING_REPORT_DIR", str(BASE_DIR / "profiles"))
+PROFILING_MAX_REPORTS = int(os.getenv("PROFILING_MAX_REPORTS", "200"))
+PROFILING_TOKEN_MAX_AGE = int(os.getenv("PROFILING_TOKEN_MAX_AGE", "900"))
+PROFILING_SAMPLE_INTERVAL = float(os.getenv("PROFILING_SAMPLE_INTERVAL", "0.005"))
+if not PROFILING_ENABLED:
+    MIDDLEWARE.remove('core.profiling.ProfilingMiddleware')
+
+# FHIR CONVERSION
+# When true, share_profile only enqueues conversion and `manage.py run_fhir_worker` does it
+FHIR_ASYNC_CONVERSION = os.getenv("FHIR_ASYNC_CONVERSION", "true").lower() == "true"
+
+# FHIR BULK EXPORT (core/fhir_export.py)
+# gzip NDJSON files written by run_fhir_worker; finished exports are deleted
+# after the retention period
+FHIR_EXPORT_DIR = os.getenv("FHIR_EXPORT_DIR", str(BASE_DIR / "exports"))
+FHIR_EXPORT_FILE_LINES = int(os.getenv("FHIR_EXPORT_FILE_LINES", "50000"))
+FHIR_EXPORT_RETENTION_HOURS = int(os.getenv("FHIR_EXPORT_RETENTION_HOURS", "24"))
+
+# ENTITY CACHE (core/entity_cache.py)
+# Role documents are cached per process; set ENTITY_CACHE_DIR to also share
+# fills between the workers on one host through a file-based cache.
+ENTITY_CACHE_SIZE = int(os.getenv("ENTITY_CACHE_SIZE", "10000"))
+ENTITY_CACHE_TTL = int(os.getenv("ENTITY_CACHE_TTL", "30"))
+ENTITY_CACHE_ALIAS = None
+
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+}
+if os.getenv("ENTITY_CACHE_DIR"):
+    CACHES["entities"] = {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.getenv("ENTITY_CACHE_DIR"),
+        "OPTIONS": {"MAX_ENTRIES": ENTITY_CACHE_SIZE},
+    }
+    ENTITY_CACHE_ALIAS = "entities"
+
 # DEFAULT AUTO FIELD
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -163,11 +250,21 @@ CORS_ALLOW_CREDENTIALS = True
 # DRF + JWT
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.ClaimsJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.AllowAny',
     ),
+    # orjson drop-ins for DRF's JSON renderer/parser (see core/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': (
+        'core.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'core.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
 }
 
 # SIMPLE JWT
@@ -0,0 +1,310 @@
+import operator
+from collections import Counter
+from datetime import datetime
+
+from pymongo import ReturnDocument, UpdateOne
+
+from .db import async_collection, loan_requests_col, loan_analytics_col
+
+# -----------------------
+# Loan Provider Analytics
+# -----------------------
+
+RISK_LEVELS = ["LOW", "MEDIUM", "HIGH"]
+STATUSES = ["Approved", "Pending", "Rejected"]
+LOCATIONS = ["Urban", "Rural"]
+
+# Same bounds the dashboard has always used, in query-operator form
+AGE_BANDS = [
+    ("18-30", {"$gte": 18, "$lte": 30}),
+    ("31-45", {"$gte": 31, "$lte": 45}),
+    ("46-60", {"$gte": 46, "$lte": 60}),
+    ("60+", {"$gt": 60}),
+]
+
+_OPS = {"$gt": operator.gt, "$gte": operator.ge, "$lt": operator.lt, "$lte": operator.le}
+
+# Counter groups stored on a rollup document (and produced from a $facet pass)
+COUNTER_GROUPS = ["status", "risk", "risk_status", "location", "tenure", "age", "day"]
+
+
+def _age_band_expr():
+    branches = [
+        {"case": {"$and": [{op: ["$age", value]} for op, value in bounds.items()]}, "then": label}
+        for label, bounds in AGE_BANDS
+    ]
+    return {"$switch": {"branches": branches, "default": None}}
+
+
+def age_band(age):
+    if isinstance(age, bool) or not isinstance(age, (int, float)):
+        return None
+    for label, bounds in AGE_BANDS:
+        if all(_OPS[op](age, value) for op, value in bounds.items()):
+            return label
+    return None
+
+
+def provider_analytics_pipeline(provider_id):
+    """One $match + $facet pass that feeds every widget of the provider dashboard."""
+    return [
+        {"$match": {"loan_provider_id": provider_id}},
+        {"$facet": {
+            "risk_status": [
+                {"$group": {
+                    "_id": {"risk": "$risk", "status": "$status"},
+                    "count": {"$sum": 1}
+                }}
+            ],
+            "location": [
+                {"$group": {"_id": "$hospital_location", "count": {"$sum": 1}}}
+            ],
+            "tenure": [
+                {"$group": {"_id": "$preferred_tenure", "count": {"$sum": 1}}}
+            ],
+            "trend": [
+                {"$group": {
+                    "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}},
+                    "count": {"$sum": 1}
+                }},
+                {"$sort": {"_id": 1}},
+                {"$limit": 7}
+            ],
+            "age": [
+                {"$group": {"_id": _age_band_expr(), "count": {"$sum": 1}}}
+            ],
+        }}
+    ]
+
+
+def counters_from_facets(facets):
+    counters = {"total": 0, **{group: {} for group in COUNTER_GROUPS}}
+
+    for row in facets.get("risk_status", []):
+        risk = row["_id"].get("risk")
+        status = row["_id"].get("status")
+        count = row["count"]
+        counters["total"] += count
+        if status is not None:
+            counters["status"][status] = counters["status"].get(status, 0) + count
+        if risk is not None:
+            counters["risk"][risk] = counters["risk"].get(risk, 0) + count
+        if risk is not None and status is not None:
+            counters["risk_status"].setdefault(risk, {})[status] = count
+
+    for group, facet in (("location", "location"), ("tenure", "tenure"), ("day", "trend"), ("age", "age")):
+        counters[group] = {row["_id"]: row["count"] for row in facets.get(facet, [])}
+
+    return counters
+
+
+def _sort_key(value):
+    # Mirror Mongo's $sort order for the values we store: null, numbers, strings
+    if value is None:
+        return (0, 0, "")
+    text = str(value)
+    if text.lstrip("-").isdigit():
+        return (1, int(text), "")
+    return (2, 0, text)
+
+
+def summarize_counters(counters):
+    """Shape per-provider counters into the response the dashboard expects."""
+    total = counters.get("total", 0)
+    by_status = counters.get("status", {})
+    by_risk = counters.get("risk", {})
+    by_risk_status = counters.get("risk_status", {})
+    by_location = counters.get("location", {})
+    by_age = counters.get("age", {})
+    by_tenure = counters.get("tenure", {})
+    by_day = counters.get("day", {})
+
+    approved = by_status.get("Approved", 0)
+    approval_rate = (approved / total * 100) if total > 0 else 0
+
+    return {
+        "total": total,
+        "approved": approved,
+        "rejected": by_status.get("Rejected", 0),
+        "pending": by_status.get("Pending", 0),
+        "approval_rate": round(approval_rate, 1),
+        "risk_dist": {r.lower(): by_risk.get(r, 0) for r in RISK_LEVELS},
+        "residence_dist": {l.lower(): by_location.get(l, 0) for l in LOCATIONS},
+        "portfolio_health": [
+            {
+                "_id": r.capitalize(),
+                "approved": by_risk_status.get(r, {}).get("Approved", 0),
+                "pending": by_risk_status.get(r, {}).get("Pending", 0),
+                "rejected": by_risk_status.get(r, {}).get("Rejected", 0),
+            }
+            for r in RISK_LEVELS
+        ],
+        "tenure_dist": [
+            {"tenure": str(t) + " M", "count": by_tenure[t]}
+            for t in sorted(by_tenure, key=_sort_key)
+            if by_tenure[t]
+        ],
+        "submission_trend": [
+            {"date": d, "count": by_day[d]}
+            for d in sorted((d for d in by_day if by_day[d]), key=_sort_key)[:7]
+        ],
+        "demographics": [
+            {"range": label, "count": by_age.get(label, 0)}
+            for label, _ in AGE_BANDS
+        ],
+    }
+
+
+def compute_provider_analytics(provider_id, col=None):
+    col = loan_requests_col if col is None else col
+    facets = next(col.aggregate(provider_analytics_pipeline(provider_id)), {})
+    return summarize_counters(counters_from_facets(facets))
+
+
+# -----------------------
+# Incremental Rollups
+# -----------------------
+# Writes only ever $inc an existing rollup document; they never create one.
+# A document created from a provider's next loan would hold that loan alone
+# and hide every older one from the dashboard. Providers without a document
+# are served by the $facet fallback until `manage.py rebuild_loan_rollups`
+# creates it from their loans. Every $inc also bumps `version`, which the
+# rebuild uses to detect writes that raced its scan. For a new provider the
+# rebuild first inserts a placeholder (version 0, `placeholder: True`) that
+# those writes can land on; readers treat it as no rollup at all.
+
+def _key(value):
+    # Rollup counters are nested by key, so dots and a leading "$" are not allowed
+    return str(value).replace(".", "_").lstrip("$")
+
+
+def loan_counter_keys(loan):
+    """Dotted rollup paths a single loan contributes one count to."""
+    keys = ["total"]
+    risk, status = loan.get("risk"), loan.get("status")
+    if status is not None:
+        keys.append(f"status.{_key(status)}")
+    if risk is not None:
+        keys.append(f"risk.{_key(risk)}")
+    if risk is not None and status is not None:
+        keys.append(f"risk_status.{_key(risk)}.{_key(status)}")
+    if loan.get("hospital_location") is not None:
+        keys.append(f"location.{_key(loan['hospital_location'])}")
+    if loan.get("preferred_tenure") is not None:
+        keys.append(f"tenure.{_key(loan['preferred_tenure'])}")
+    band = age_band(loan.get("age"))
+    if band is not None:
+        keys.append(f"age.{band}")
+    if isinstance(loan.get("created_at"), datetime):
+        keys.append(f"day.{loan['created_at'].strftime('%Y-%m-%d')}")
+    return keys
+
+
+def _apply_increments(provider_id, increments, col=None):
+    col = loan_analytics_col if col is None else col
+    increments = {k: v for k, v in increments.items() if v}
+    if not provider_id or not increments:
+        return
+    col.update_one(
+        {"loan_provider_id": provider_id},
+        {"$inc": {**increments, "version": 1}, "$set": {"updated_at": datetime.utcnow()}}
+    )
+
+
+def rollup_increments(before, after):
+    """Counter moves that take one loan from its old buckets to its new ones."""
+    increments = Counter(loan_counter_keys(after))
+    increments.subtract(Counter(loan_counter_keys(before)))
+    return increments
+
+
+def record_loan_created(loan, col=None):
+    _apply_increments(loan.get("loan_provider_id"), Counter(loan_counter_keys(loan)), col)
+
+
+def record_loan_changed(before, after, col=None):
+    _apply_increments(after.get("loan_provider_id"), rollup_increments(before, after), col)
+
+
+def record_loans_changed(increments_by_provider, col=None):
+    """Apply accumulated {provider_id: Counter} moves with one bulk write."""
+    col = loan_analytics_col if col is None else col
+    now = datetime.utcnow()
+    ops = []
+    for provider_id, increments in increments_by_provider.items():
+        increments = {k: v for k, v in increments.items() if v}
+        if provider_id and increments:
+            ops.append(UpdateOne(
+                {"loan_provider_id": provider_id},
+                {"$inc": {**increments, "version": 1}, "$set": {"updated_at": now}}
+            ))
+    if ops:
+        col.bulk_write(ops, ordered=False)
+
+
+def update_loan_and_rollup(loan_filter, changes):
+    """Apply ``$set`` changes to one loan and shift its rollup counters atomically."""
+    before = loan_requests_col.find_one_and_update(
+        loan_filter,
+        {"$set": changes},
+        return_document=ReturnDocument.BEFORE
+    )
+    if before is not None:
+        record_loan_changed(before, {**before, **changes})
+    return before
+
+
+def read_provider_analytics(provider_id):
+    """Dashboard analytics from the rollup document, falling back to a $facet pass."""
+    rollup = loan_analytics_col.find_one({"loan_provider_id": provider_id}, {"_id": 0})
+    if rollup is None or rollup.get("placeholder"):
+        return compute_provider_analytics(provider_id)
+    return summarize_counters(rollup)
+
+
+async def async_read_provider_analytics(provider_id):
+    """read_provider_analytics for async views."""
+    rollup = await async_collection(loan_analytics_col).find_one({"loan_provider_id": provider_id}, {"_id": 0})
+    if rollup is not None and not rollup.get("placeholder"):
+        return summarize_counters(rollup)
+    cursor = await async_collection(loan_requests_col).aggregate(provider_analytics_pipeline(provider_id))
+    facets = await cursor.to_list(1)
+    return summarize_counters(counters_from_facets(facets[0] if facets else {}))
+
+
+def build_rollups(loans):
+    """Recompute rollup counters from an iterable of loans, keyed by provider."""
+    rollups = {}
+    for loan in loans:
+        provider_id = loan.get("loan_provider_id")
+        if not provider_id:
+            continue
+        counters = rollups.setdefault(provider_id, {"total": 0})
+        for path in loan_counter_keys(loan):
+            node = counters
+            *parents, leaf = path.split(".")
+            for part in parents:
+                node = node.setdefault(part, {})
+            node[leaf] = node.get(leaf, 0) + 1
+    return rollups
+
+
+def _flatten(counters, prefix=""):
+    flat = {}
+    for key, value in counters.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and value:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def rollup_drift(stored, expected):
+    """{path: (stored, expected)} for every counter that disagrees."""
+    stored = _flatten({k: v for k, v in (stored or {}).items() if k in COUNTER_GROUPS or k == "total"})
+    expected = _flatten(expected or {})
+    return {
+        path: (stored.get(path, 0), expected.get(path, 0))
+        for path in sorted(set(stored) | set(expected))
+        if stored.get(path, 0) != expected.get(path, 0)
+    }
@@ -0,0 +1,232 @@
+import asyncio
+import functools
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import AuthenticationFailed
+
+from . import views
+from .analytics import async_read_provider_analytics
+from .authentication import ClaimsJWTAuthentication
+from .db import (
+    async_collection,
+    fhir_jobs_col,
+    fhir_patients_col,
+    loan_requests_col,
+    loan_providers_col,
+    shared_profiles_col,
+)
+from .directory import async_directory_version, etag_for, etag_matches, recipients_directory
+from .fhir_queue import conversion_status_from
+from .pagination import InvalidPage, async_keyset_page, parse_limit, wants_page
+from .renderers import ORJSONRenderer
+from .streaming import NDJSON_MEDIA_TYPE
+
+# -----------------------
+# Async (ASGI) Views
+# -----------------------
+# Async versions of the hot read paths. They talk to Mongo through the
+# driver's AsyncMongoClient and run independent queries with asyncio.gather.
+# core/urls.py routes to them instead of the sync views when ASYNC_VIEWS is
+# on, which only makes sense when the app is served by an ASGI server.
+# Request and response shapes match the sync views. Only the methods a view
+# serves run async; any other method is handed to the sync view, so 405s and
+# OPTIONS are answered exactly as DRF answers them.
+
+_authenticator = ClaimsJWTAuthentication()
+_renderer = ORJSONRenderer()
+
+
+def _json(data, status=200):
+    return HttpResponse(_renderer.render(data), status=status, content_type="application/json")
+
+
+def _unauthorized(request, detail):
+    # Same body and header as DRF's exception handler
+    response = _json(detail if isinstance(detail, (list, dict)) else {"detail": detail}, status=401)
+    response["WWW-Authenticate"] = _authenticator.authenticate_header(request)
+    return response
+
+
+async def _authenticate(request, required=True):
+    """(user, None) or (None, 401 response), like DRF's IsAuthenticated.
+
+    With required=False only a bad token is refused, as DRF refuses it even
+    for AllowAny views; the user is then None when no token was sent.
+    """
+    try:
+        result = await _authenticator.aauthenticate(request)
+    except AuthenticationFailed as exc:
+        return None, _unauthorized(request, exc.detail)
+    if result is None:
+        if not required:
+            return None, None
+        return None, _unauthorized(request, "Authentication credentials were not provided.")
+    request.user = result[0]
+    return result[0], None
+
+
+def _serves(sync_view, methods=("GET", "HEAD")):
+    """Run the decorated async view for `methods` and `sync_view` for any other."""
+    allow = ", ".join(sync_view.cls().allowed_methods)
+
+    def decorate(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return await sync_to_async(sync_view)(request, *args, **kwargs)
+            response = await view(request, *args, **kwargs)
+            # Headers DRF puts on every response of the sync view
+            response["Allow"] = allow
+            patch_vary_headers(response, ["Accept"])
+            return response
+        # DRF views are CSRF-exempt too (JWT auth, no session cookies)
+        return csrf_exempt(wrapper)
+    return decorate
+
+
+async def _caller_id(user, field, col):
+    # Same as views.caller_id: the token claim, else a lookup by email
+    value = getattr(user, field, None)
+    if value:
+        return value
+    doc = await async_collection(col).find_one({"email": user.email}, {"_id": 0, field: 1})
+    return doc.get(field) if doc else None
+
+
+def _wants_stream(request):
+    return (
+        NDJSON_MEDIA_TYPE in request.headers.get("Accept", "")
+        or request.GET.get("format") == "ndjson"
+    )
+
+
+async def _list_or_page(request, col, query, projection, sort_field):
+    """views.list_or_page without streaming (callers hand that to the sync view)."""
+    col = async_collection(col)
+    if not wants_page(request.GET):
+        return _json(await col.find(query, projection).to_list())
+    try:
+        page = await async_keyset_page(
+            col, query, projection, sort_field, parse_limit(request.GET), request.GET.get("cursor")
+        )
+    except InvalidPage as exc:
+        return _json({"error": str(exc)}, status=400)
+    return _json(page)
+
+
+@_serves(views.get_recipients)
+async def get_recipients(request):
+    _, denied = await _authenticate(request, required=False)
+    if denied:
+        return denied
+
+    version = await async_directory_version()
+    etag = etag_for(version)
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        response = HttpResponseNotModified()
+    else:
+        # Rebuilds run the three collection scans concurrently
+        version, body = await recipients_directory.arender(version)
+        etag = etag_for(version)
+        response = HttpResponse(body, content_type="application/json")
+    response["ETag"] = etag
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+@_serves(views.loan_provider_analytics)
+async def loan_provider_analytics(request):
+    user, denied = await _authenticate(request)
+    if denied:
+        return denied
+
+    provider_id = await _caller_id(user, "loan_provider_id", loan_providers_col)
+    if not provider_id:
+        return _json({"error": "Unauthorized"}, status=403)
+    return _json(await async_read_provider_analytics(provider_id))
+
+
+@_serves(views.patient_fhir_profiles)
+async def patient_fhir_profiles(request):
+    if _wants_stream(request):
+        return await sync_to_async(views.patient_fhir_profiles)(request)
+
+    user, denied = await _authenticate(request)
+    if denied:
+        return denied
+    if user.role not in views.FHIR_OWNERS:
+        return _json({"error": "Not authorized"}, status=403)
+
+    field, col, missing = views.FHIR_OWNERS[user.role]
+    owner_id = await _caller_id(user, field, col)
+    if not owner_id:
+        return _json({"error": missing}, status=404)
+    return await _list_or_page(request, fhir_patients_col, {field: owner_id}, {"_id": 0}, "created_at")
+
+
+@_serves(views.loan_provider_requests)
+async def loan_provider_requests(request):
+    if _wants_stream(request):
+        return await sync_to_async(views.loan_provider_requests)(request)
+
+    user, denied = await _authenticate(request)
+    if denied:
+        return denied
+
+    provider_id = await _caller_id(user, "loan_provider_id", loan_providers_col)
+    if not provider_id:
+        return _json({"error": "Unauthorized"}, status=403)
+    return await _list_or_page(
+        request,
+        loan_requests_col,
+        {"loan_provider_id": provider_id},
+        views.LOAN_REQUEST_LIST_FIELDS,
+        "created_at"
+    )
+
+
+@_serves(views.shared_profile_status)
+async def shared_profile_status(request, shared_id):
+    user, denied = await _authenticate(request)
+    if denied:
+        return denied
+
+    # The job is keyed by shared_id too, so both reads go out together
+    profile, job = await asyncio.gather(
+        async_collection(shared_profiles_col).find_one(
+            {"shared_id": shared_id},
+            {"_id": 0, "shared_id": 1, "patient_email": 1, "fhir_converted": 1}
+        ),
+        async_collection(fhir_jobs_col).find_one({"shared_id": shared_id}, {"_id": 0}),
+    )
+
+    if not profile:
+        return _json({"error": "Shared profile not found"}, status=404)
+    if profile["patient_email"] != user.email:
+        return _json({"error": "Not allowed"}, status=403)
+    return _json(conversion_status_from(profile, job))
+
+
+@_serves(views.delete_shared_profile, methods=("DELETE",))
+async def delete_shared_profile(request, shared_id):
+    user, denied = await _authenticate(request)
+    if denied:
+        return denied
+
+    profile = await async_collection(shared_profiles_col).find_one(
+        {"shared_id": shared_id}, {"_id": 0, "patient_email": 1}
+    )
+    if not profile:
+        return _json({"error": "Shared profile not found"}, status=404)
+    if profile["patient_email"] != user.email:
+        return _json({"error": "Not allowed"}, status=403)
+
+    await asyncio.gather(
+        async_collection(shared_profiles_col).delete_one({"shared_id": shared_id}),
+        async_collection(fhir_patients_col).delete_one({"shared_id": shared_id}),
+        async_collection(fhir_jobs_col).delete_one({"shared_id": shared_id}),
+    )
+    return _json({"message": "Shared profile deleted successfully"})
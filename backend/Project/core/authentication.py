@@ -0,0 +1,136 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import F
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+# -----------------------
+# Claims-Carrying JWT Auth
+# -----------------------
+# Tokens issued by `login` carry the caller's email, role and domain ID, so a
+# request is authenticated from the token alone: no User row from SQL and no
+# role-collection lookup in Mongo. Revocation is a per-user token version that
+# is cached in-process; bumping it invalidates every older token once the
+# cached value expires (TOKEN_VERSION_CACHE_SECONDS).
+
+# Domain ID field for each role, stored as a claim of the same name
+ROLE_ID_FIELDS = {
+    "patient": "patient_id",
+    "doctor": "practitioner_id",
+    "hospital": "organization_id",
+    "loan_provider": "loan_provider_id",
+}
+
+TOKEN_VERSION_CLAIM = "ver"
+PRINCIPAL_CLAIMS = ["email", "role", TOKEN_VERSION_CLAIM]
+TOKEN_VERSION_CACHE_SECONDS = 60
+
+# Cached for users that no longer exist or are inactive; never matches a token
+_DISABLED = -1
+
+
+class ClaimsUser(TokenUser):
+    """Principal built from token claims: email, role and the role's domain ID."""
+
+    @property
+    def domain_id(self):
+        field = ROLE_ID_FIELDS.get(self.role)
+        return self.token.get(field) if field else None
+
+
+def _version_key(user_id):
+    return f"auth:token_version:{user_id}"
+
+
+def _load_token_version(user_id):
+    row = (
+        get_user_model().objects
+        .filter(pk=user_id)
+        .values_list("token_version", "is_active")
+        .first()
+    )
+    version = row[0] if row and row[1] else _DISABLED
+    cache.set(_version_key(user_id), version, TOKEN_VERSION_CACHE_SECONDS)
+    return version
+
+
+def current_token_version(user_id):
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        version = _load_token_version(user_id)
+    return version
+
+
+async def acurrent_token_version(user_id):
+    version = await cache.aget(_version_key(user_id))
+    if version is None:
+        version = await sync_to_async(_load_token_version)(user_id)
+    return version
+
+
+def revoke_tokens(user_id):
+    """Invalidate every token issued to this user so far."""
+    get_user_model().objects.filter(pk=user_id).update(token_version=F("token_version") + 1)
+    cache.delete(_version_key(user_id))
+
+
+def tokens_for(user, profile):
+    """Refresh token (and its access token) carrying the principal claims."""
+    refresh = RefreshToken.for_user(user)
+    refresh["email"] = user.email
+    refresh["role"] = user.role
+    refresh[TOKEN_VERSION_CLAIM] = user.token_version
+
+    field = ROLE_ID_FIELDS.get(user.role)
+    if field and profile.get(field):
+        refresh[field] = profile[field]
+    if user.is_staff:
+        # Read by IsAdminUser through TokenUser.is_staff (profiling reports)
+        refresh["is_staff"] = True
+    return refresh
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        if not self.has_claims(validated_token):
+            # Tokens issued before claims were added still resolve the User row
+            return super().get_user(validated_token)
+
+        user_id = self.claimed_user_id(validated_token)
+        if validated_token[TOKEN_VERSION_CLAIM] != current_token_version(user_id):
+            raise AuthenticationFailed("Token has been revoked", code="token_revoked")
+
+        return ClaimsUser(validated_token)
+
+    @staticmethod
+    def has_claims(validated_token):
+        return all(claim in validated_token for claim in PRINCIPAL_CLAIMS)
+
+    @staticmethod
+    def claimed_user_id(validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            raise AuthenticationFailed("Token contained no recognizable user identification")
+        return user_id
+
+    async def aauthenticate(self, request):
+        """authenticate() for async views; (user, token) or None."""
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+
+        if not self.has_claims(validated_token):
+            return await sync_to_async(super().get_user)(validated_token), validated_token
+
+        user_id = self.claimed_user_id(validated_token)
+        if validated_token[TOKEN_VERSION_CLAIM] != await acurrent_token_version(user_id):
+            raise AuthenticationFailed("Token has been revoked", code="token_revoked")
+        return ClaimsUser(validated_token), validated_token
@@ -1,27 +1,292 @@
-from pymongo import MongoClient
-from dotenv import load_dotenv
+import asyncio
 import os
+import threading
+import weakref
 from pathlib import Path
 
+from dotenv import load_dotenv
+from pymongo import AsyncMongoClient, MongoClient, monitoring
+from pymongo.errors import DuplicateKeyError
+
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 load_dotenv(BASE_DIR / ".env")
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client[os.getenv("MONGO_DB_NAME")]
 
 # client = MongoClient("mongodb://localhost:27017/")
 # db = client.healthcare
 
+# -----------------------
+# Client Factory
+# -----------------------
+# No connection is made at import time. The first query in a process builds
+# the MongoClient from settings.MONGO_CLIENT_OPTIONS (pool size, timeouts,
+# compressors, read preference, write concern). A process forked after that
+# (pre-fork servers, multiprocessing) gets its own client on first use
+# instead of sharing the parent's sockets.
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Per-process connection pool counters, fed by the driver's pool events."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.open = 0
+            self.created = 0
+            self.closed = 0
+            self.checked_out = 0
+            self.max_checked_out = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.waiting = 0
+            self.max_waiting = 0
+            self.pool_clears = 0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "open": self.open,
+                "created": self.created,
+                "closed": self.closed,
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "waiting": self.waiting,
+                "max_waiting": self.max_waiting,
+                "pool_clears": self.pool_clears,
+            }
+
+    def connection_check_out_started(self, event):
+        with self._lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.waiting -= 1
+            self.checked_out += 1
+            self.checkouts += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.waiting -= 1
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+            self.created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+            self.closed += 1
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+
+pool_stats = PoolStats()
+
+_lock = threading.Lock()
+_client = None
+_client_pid = None
+
+
+def client_options():
+    """Driver keyword arguments, from settings when Django is configured."""
+    from django.conf import settings
+    from django.core.exceptions import ImproperlyConfigured
+
+    try:
+        return dict(getattr(settings, "MONGO_CLIENT_OPTIONS", {}))
+    except ImproperlyConfigured:
+        # Plain scripts without Django settings use driver defaults
+        return {}
+
+
+def event_listeners():
+    """Pool counters always; per-request command metrics when METRICS_ENABLED."""
+    from django.conf import settings
+    from django.core.exceptions import ImproperlyConfigured
+
+    try:
+        enabled = getattr(settings, "METRICS_ENABLED", False)
+    except ImproperlyConfigured:
+        enabled = False
+    if not enabled:
+        return [pool_stats]
+    from .metrics import command_metrics
+    return [pool_stats, command_metrics]
+
+
+def get_client():
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _lock:
+            if _client is None or _client_pid != pid:
+                if _client_pid != pid:
+                    # Inherited from the parent: its sockets are not ours to use or close
+                    pool_stats.reset()
+                _client = MongoClient(
+                    os.getenv("MONGO_URI"),
+                    event_listeners=event_listeners(),
+                    **client_options()
+                )
+                _client_pid = pid
+    return _client
+
+
+def get_db():
+    return get_client()[os.getenv("MONGO_DB_NAME")]
+
+
+def close_client():
+    global _client, _client_pid
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+def warm_up():
+    """Connect now so the first request skips server selection and the handshake.
+
+    The driver fills the pool up to minPoolSize in the background afterwards.
+    """
+    client = get_client()
+    client.admin.command("ping")
+    return pool_stats.snapshot()
+
+
+# The async views (core/async_views.py) use the driver's AsyncMongoClient. An
+# async client belongs to the event loop it was first used on, so there is one
+# per loop (ASGI servers run one loop per worker process).
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    loop = asyncio.get_running_loop()
+    pid, client = _async_clients.get(loop, (None, None))
+    if pid != os.getpid():
+        client = AsyncMongoClient(
+            os.getenv("MONGO_URI"),
+            event_listeners=event_listeners(),
+            **client_options()
+        )
+        _async_clients[loop] = (os.getpid(), client)
+    return client
+
+
+def async_collection(col):
+    """Async counterpart of one of the collections below."""
+    return get_async_client()[os.getenv("MONGO_DB_NAME")][col.name]
+
+
+class LazyDatabase:
+    """Stands in for the Database until first use, then resolves per process."""
+
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+    def __getitem__(self, name):
+        return get_db()[name]
+
+    def __repr__(self):
+        return f"LazyDatabase({os.getenv('MONGO_DB_NAME')!r})"
+
+
+class LazyCollection:
+    """Stands in for a Collection until first use, then resolves per process."""
+
+    def __init__(self, name):
+        self.name = name
+        self._client = None
+        self._collection = None
+
+    def _resolve(self):
+        client = get_client()
+        if client is not self._client:
+            self._collection = client[os.getenv("MONGO_DB_NAME")][self.name]
+            self._client = client
+        return self._collection
+
+    def __getattr__(self, attr):
+        return getattr(self._resolve(), attr)
+
+    def __getitem__(self, name):
+        return self._resolve()[name]
+
+    def __repr__(self):
+        return f"LazyCollection({self.name!r})"
+
+
+db = LazyDatabase()
+
 # Core collections
-patients_col = db.patients
-practitioners_col = db.practitioners
+patients_col = LazyCollection("patients")
+practitioners_col = LazyCollection("practitioners")
 
 
-organizations_col = db.organizations
-shared_profiles_col = db.shared_profiles
+organizations_col = LazyCollection("organizations")
+shared_profiles_col = LazyCollection("shared_profiles")
+directory_versions_col = LazyCollection("directory_versions")   # bumped when recipients join or change
 
 # FHIR storage
-fhir_patients_col = db.fhir_patients
+fhir_patients_col = LazyCollection("fhir_patients")
+fhir_jobs_col = LazyCollection("fhir_conversion_jobs")   # durable queue for background conversion
+fhir_exports_col = LazyCollection("fhir_export_jobs")   # bulk $export jobs and their manifests
+convert_checkpoints_col = LazyCollection("fhir_convert_checkpoints")   # resume points for manage.py fhir_convert
 
 # Loan module
-loan_providers_col = db.loan_providers
-loan_requests_col = db.loan_requests   # <-- REQUIRED
+loan_providers_col = LazyCollection("loan_providers")
+loan_requests_col = LazyCollection("loan_requests")   # <-- REQUIRED
+loan_analytics_col = LazyCollection("loan_provider_analytics")   # per-provider rollup counters
+
+
+# -----------------------
+# Generated IDs
+# -----------------------
+# Domain IDs (patient_id, loan_id, ...) are short random strings under a
+# unique index (core/indexes.py), so an insert can collide with an existing
+# one; it is retried with a freshly generated ID.
+
+MAX_ID_ATTEMPTS = 5
+
+
+def insert_with_fresh_id(col, doc, field, generate, attempts=MAX_ID_ATTEMPTS):
+    """insert_one(doc), replacing doc[field] with generate() while it collides.
+
+    Duplicates on any other unique key (email, say) are raised as they are.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return col.insert_one(doc)
+        except DuplicateKeyError as exc:
+            if field not in (exc.details or {}).get("keyPattern", {}) or attempt == attempts:
+                raise
+            doc.pop("_id", None)
+            doc[field] = generate()
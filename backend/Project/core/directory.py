@@ -0,0 +1,110 @@
+import asyncio
+import threading
+
+from .db import async_collection, directory_versions_col, practitioners_col, organizations_col, loan_providers_col
+from .renderers import ORJSONRenderer
+
+# -----------------------
+# Recipients Directory
+# -----------------------
+# The share form lists every doctor, hospital and loan provider. The listing
+# is built once per process and served from memory as pre-rendered JSON.
+# A version counter in Mongo is bumped whenever a recipient joins or changes
+# (see `bump_directory_version`). Each request reads only that counter: if it
+# moved, the directory is rebuilt, and it also serves as the ETag so clients
+# with a current copy get a 304.
+
+DIRECTORY_ID = "recipients"
+
+DOCTOR_FIELDS = {"_id": 0, "practitioner_id": 1, "first_name": 1, "last_name": 1}
+HOSPITAL_FIELDS = {"_id": 0, "organization_id": 1, "name": 1}
+LOAN_PROVIDER_FIELDS = {"_id": 0, "loan_provider_id": 1, "name": 1}
+
+
+def directory_version(col=None):
+    col = directory_versions_col if col is None else col
+    doc = col.find_one({"_id": DIRECTORY_ID}, {"version": 1})
+    return doc["version"] if doc else 0
+
+
+def bump_directory_version(col=None):
+    col = directory_versions_col if col is None else col
+    col.update_one({"_id": DIRECTORY_ID}, {"$inc": {"version": 1}}, upsert=True)
+
+
+def build_directory(practitioners=None, organizations=None, loan_providers=None):
+    practitioners = practitioners_col if practitioners is None else practitioners
+    organizations = organizations_col if organizations is None else organizations
+    loan_providers = loan_providers_col if loan_providers is None else loan_providers
+    return {
+        "doctors": list(practitioners.find({}, DOCTOR_FIELDS)),
+        "hospitals": list(organizations.find({}, HOSPITAL_FIELDS)),
+        "loan_providers": list(loan_providers.find({}, LOAN_PROVIDER_FIELDS)),
+    }
+
+
+async def async_directory_version():
+    doc = await async_collection(directory_versions_col).find_one({"_id": DIRECTORY_ID}, {"version": 1})
+    return doc["version"] if doc else 0
+
+
+async def async_build_directory():
+    """build_directory with the three scans running concurrently."""
+    doctors, hospitals, loan_providers = await asyncio.gather(
+        async_collection(practitioners_col).find({}, DOCTOR_FIELDS).to_list(),
+        async_collection(organizations_col).find({}, HOSPITAL_FIELDS).to_list(),
+        async_collection(loan_providers_col).find({}, LOAN_PROVIDER_FIELDS).to_list(),
+    )
+    return {"doctors": doctors, "hospitals": hospitals, "loan_providers": loan_providers}
+
+
+def etag_for(version):
+    return f'"{DIRECTORY_ID}-{version}"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    return "*" in tags or any(t.removeprefix("W/") == etag for t in tags)
+
+
+class RecipientsDirectory:
+    """Rendered directory for the newest version this process has seen."""
+
+    def __init__(self, build=build_directory):
+        self.build = build
+        self._lock = threading.Lock()
+        self._state = (None, None)   # (version, rendered JSON body)
+
+    def render(self, version):
+        """(version, body) for ``version``, rebuilding if the cached copy is another one.
+
+        Read the version before calling: a join during the build bumps it
+        again, so the next request rebuilds.
+        """
+        state = self._state
+        if state[0] != version:
+            with self._lock:
+                state = self._state
+                if state[0] != version:
+                    state = (version, ORJSONRenderer().render(self.build()))
+                    self._state = state
+        return state
+
+    async def arender(self, version, build=async_build_directory):
+        """render() for async views. Concurrent rebuilds on one loop are harmless:
+        the last one to finish wins and all of them carry the same version."""
+        state = self._state
+        if state[0] != version:
+            state = (version, ORJSONRenderer().render(await build()))
+            self._state = state
+        return state
+
+    def clear(self):
+        with self._lock:
+            self._state = (None, None)
+
+
+recipients_directory = RecipientsDirectory()
@@ -0,0 +1,205 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .db import patients_col, practitioners_col, organizations_col, loan_providers_col
+
+# -----------------------
+# Principal / Reference Entity Cache
+# -----------------------
+# Role documents (patients, practitioners, organizations, loan providers) are
+# read on almost every request and rarely change. They are cached in-process
+# (LRU + TTL) under both their email and their natural ID. When
+# ENTITY_CACHE_ALIAS names a Django cache, that cache sits behind the
+# in-process one so workers on the same host share fills.
+#
+# Writes go through `invalidate`, which drops the local entry and the shared
+# one. Other workers' in-process copies expire after ENTITY_CACHE_TTL seconds,
+# which bounds how stale a cached document can be.
+
+# role -> (collection, natural ID field)
+ENTITY_KINDS = {
+    "patient": (patients_col, "patient_id"),
+    "doctor": (practitioners_col, "practitioner_id"),
+    "hospital": (organizations_col, "organization_id"),
+    "loan_provider": (loan_providers_col, "loan_provider_id"),
+}
+
+# Password hashes never leave Mongo through the cache
+ENTITY_PROJECTION = {"_id": 0, "password": 0}
+
+
+class EntityCache:
+    """Thread-safe LRU of documents with a per-entry TTL and hit/miss counters."""
+
+    def __init__(self, max_size, ttl, shared=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared = shared
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, doc = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return doc
+                del self._entries[key]
+
+        if self.shared is not None:
+            doc = self.shared.get(key)
+            if doc is not None:
+                self._store(key, doc)
+                with self._lock:
+                    self.shared_hits += 1
+                return doc
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def peek(self, key):
+        """Like get, without touching counters or LRU order."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            return entry[1]
+        return self.shared.get(key) if self.shared is not None else None
+
+    def _store(self, key, doc):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, doc)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def set(self, key, doc):
+        self._store(key, doc)
+        if self.shared is not None:
+            self.shared.set(key, doc, self.ttl)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+        if self.shared is not None:
+            self.shared.delete_many(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.shared_hits = self.misses = self.evictions = 0
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.shared_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+
+def _shared_backend():
+    alias = getattr(settings, "ENTITY_CACHE_ALIAS", None)
+    return caches[alias] if alias else None
+
+
+entity_cache = EntityCache(
+    max_size=getattr(settings, "ENTITY_CACHE_SIZE", 10000),
+    ttl=getattr(settings, "ENTITY_CACHE_TTL", 30),
+    shared=_shared_backend(),
+)
+
+
+def _key(kind, field, value):
+    return f"entity:{kind}:{field}:{value}"
+
+
+def _lookup(kind, field, value):
+    if not value:
+        return None
+    key = _key(kind, field, value)
+    doc = entity_cache.get(key)
+    if doc is None:
+        col, id_field = ENTITY_KINDS[kind]
+        doc = col.find_one({field: value}, ENTITY_PROJECTION)
+        if doc is None:
+            # Misses are not cached so a fresh registration is visible at once
+            return None
+        entity_cache.set(_key(kind, "email", doc.get("email")), doc)
+        entity_cache.set(_key(kind, id_field, doc.get(id_field)), doc)
+    # Callers may add fields to what they get back; keep the cached copy intact
+    return copy.deepcopy(doc)
+
+
+def get_by_email(kind, email):
+    return _lookup(kind, "email", email)
+
+
+def get_by_id(kind, natural_id):
+    return _lookup(kind, ENTITY_KINDS[kind][1], natural_id)
+
+
+def get_many_by_id(kind, natural_ids):
+    """{natural_id: doc} for the IDs that exist; one $in query for the uncached ones."""
+    col, id_field = ENTITY_KINDS[kind]
+    found = {}
+    missing = []
+    for natural_id in dict.fromkeys(natural_ids):
+        doc = entity_cache.get(_key(kind, id_field, natural_id)) if natural_id else None
+        if doc is not None:
+            found[natural_id] = copy.deepcopy(doc)
+        elif natural_id:
+            missing.append(natural_id)
+
+    if missing:
+        for doc in col.find({id_field: {"$in": missing}}, ENTITY_PROJECTION):
+            entity_cache.set(_key(kind, "email", doc.get("email")), doc)
+            entity_cache.set(_key(kind, id_field, doc.get(id_field)), doc)
+            found[doc[id_field]] = copy.deepcopy(doc)
+    return found
+
+
+def invalidate(kind, email=None, natural_id=None):
+    """Drop a document from the cache after it was written.
+
+    Either key is enough: the other one is taken from the cached copy.
+    """
+    id_field = ENTITY_KINDS[kind][1]
+    keys = set()
+    for field, value in (("email", email), (id_field, natural_id)):
+        if not value:
+            continue
+        keys.add(_key(kind, field, value))
+        cached = entity_cache.peek(_key(kind, field, value))
+        if cached is not None:
+            keys.add(_key(kind, "email", cached.get("email")))
+            keys.add(_key(kind, id_field, cached.get(id_field)))
+    if keys:
+        entity_cache.delete(*keys)
+
+
+def cache_stats():
+    return entity_cache.stats()
@@ -0,0 +1,279 @@
+import hashlib
+import uuid
+from datetime import datetime, timezone
+
+import orjson
+from pymongo import ReplaceOne, UpdateOne
+
+from .db import fhir_patients_col, shared_profiles_col
+from .entity_cache import get_by_email, get_by_id, get_many_by_id
+from .fhir_search import search_fields
+
+# -----------------------
+# FHIR Conversion
+# -----------------------
+
+
+def build_fhir_patient(patient, practitioner, organization, visit_reason, patient_fhir_id=None):
+    # Rebuilds pass the existing Patient id so references stay stable
+    patient_fhir_id = patient_fhir_id or f"pat-{uuid.uuid4()}"
+
+    bundle = {
+        "resourceType": "Bundle",
+        "type": "collection",
+        "entry": []
+    }
+
+    # 1️⃣ Patient
+    patient_resource = {
+        "resourceType": "Patient",
+        "id": patient_fhir_id,
+        "name": [{
+            "family": patient.get("last_name"),
+            "given": [patient.get("first_name")]
+        }],
+        "gender": patient.get("gender"),
+        "birthDate": str(patient.get("dob")),
+        "telecom": [{
+            "system": "phone",
+            "value": patient.get("phone")
+        }] if patient.get("phone") else [],
+        "address": [{
+            "city": patient.get("city"),
+            "state": patient.get("state"),
+            "postalCode": patient.get("zip"),
+            "country": "India"
+        }]
+    }
+
+    bundle["entry"].append({"resource": patient_resource})
+
+    # 2️⃣ Known Allergies (only if provided)
+    allergies = patient.get("allergies") or []
+    if isinstance(allergies, str):
+        allergies = [a.strip() for a in allergies.split(",") if a.strip()]
+
+    for allergy in allergies:
+        allergy_resource = {
+            "resourceType": "AllergyIntolerance",
+            "patient": {"reference": f"Patient/{patient_fhir_id}"},
+            "code": {"text": allergy}
+        }
+        bundle["entry"].append({"resource": allergy_resource})
+
+    # 3️⃣ Blood Group Observation
+    if patient.get("blood_group"):
+        blood_resource = {
+            "resourceType": "Observation",
+            "status": "final",
+            "code": {"text": "Blood group"},
+            "subject": {"reference": f"Patient/{patient_fhir_id}"},
+            "valueCodeableConcept": {"text": patient.get("blood_group")}
+        }
+        bundle["entry"].append({"resource": blood_resource})
+
+    # 4️⃣ Visit Reason Observation
+    if visit_reason:
+        visit_resource = {
+            "resourceType": "Observation",
+            "status": "final",
+            "code": {"text": "Visit Reason"},
+            "subject": {"reference": f"Patient/{patient_fhir_id}"},
+            "valueString": visit_reason
+        }
+        bundle["entry"].append({"resource": visit_resource})
+
+    return bundle
+
+
+def content_hash(fhir_resource):
+    """Hash of a bundle's content, ignoring meta (version bookkeeping)."""
+    content = {k: v for k, v in fhir_resource.items() if k != "meta"}
+    return hashlib.sha256(orjson.dumps(content, option=orjson.OPT_SORT_KEYS, default=str)).hexdigest()
+
+
+def _with_meta(fhir_resource, version, now):
+    return {
+        **fhir_resource,
+        "meta": {
+            "versionId": str(version),
+            "lastUpdated": now.replace(tzinfo=timezone.utc).isoformat().replace("+00:00", "Z"),
+        },
+    }
+
+
+def fhir_document(shared_doc, fhir_resource):
+    """The fhir_patients document stored for one shared profile."""
+    now = datetime.utcnow()
+    return {
+        "shared_id": shared_doc["shared_id"],
+        "patient_id": shared_doc["patient_id"],
+        "practitioner_id": shared_doc.get("practitioner_id"),
+        "organization_id": shared_doc.get("organization_id"),
+        "fhir_resource": _with_meta(fhir_resource, 1, now),
+        "content_hash": content_hash(fhir_resource),
+        "search": search_fields(fhir_resource),
+        "created_at": now,
+        "updated_at": now
+    }
+
+
+def convert_shared_profile(shared_doc, patient=None):
+    """Build and store the FHIR bundle for a shared profile, then flag it converted.
+
+    Safe to repeat: the stored bundle is keyed by shared_id and replaced. A
+    share deleted while it was converting takes the new bundle with it.
+    """
+    if patient is None:
+        patient = get_by_email("patient", shared_doc["patient_email"])
+    if patient is None:
+        raise LookupError(f"Patient for {shared_doc['shared_id']} not found")
+
+    practitioner = get_by_id("doctor", shared_doc.get("practitioner_id"))
+    organization = get_by_id("hospital", shared_doc.get("organization_id"))
+
+    fhir_patient = build_fhir_patient(
+        patient,
+        practitioner,
+        organization,
+        shared_doc.get("illness_reason")
+    )
+
+    fhir_patients_col.replace_one(
+        {"shared_id": shared_doc["shared_id"]},
+        fhir_document(shared_doc, fhir_patient),
+        upsert=True
+    )
+    flagged = shared_profiles_col.update_one(
+        {"shared_id": shared_doc["shared_id"]},
+        {"$set": {"fhir_converted": True}}
+    )
+    if flagged.matched_count == 0:
+        # delete_shared_profile removes the share before its bundle, so the
+        # bundle written above is either removed there or here
+        fhir_patients_col.delete_one({"shared_id": shared_doc["shared_id"]})
+
+
+def convert_shared_profiles(shared_docs, patient, practitioners, organizations):
+    """Bulk form of convert_shared_profile for one patient's shares.
+
+    Recipients are passed in already resolved, as dicts keyed by
+    practitioner_id / organization_id.
+    """
+    if not shared_docs:
+        return
+    fhir_patients_col.bulk_write([
+        ReplaceOne(
+            {"shared_id": shared_doc["shared_id"]},
+            fhir_document(shared_doc, build_fhir_patient(
+                patient,
+                practitioners.get(shared_doc.get("practitioner_id")),
+                organizations.get(shared_doc.get("organization_id")),
+                shared_doc.get("illness_reason")
+            )),
+            upsert=True
+        )
+        for shared_doc in shared_docs
+    ], ordered=False)
+    shared_profiles_col.update_many(
+        {"shared_id": {"$in": [s["shared_id"] for s in shared_docs]}},
+        {"$set": {"fhir_converted": True}}
+    )
+
+
+# Patient fields copied onto each share when it is made (see views.build_shared_doc)
+SHARE_SNAPSHOT = {
+    "patient_name": "first_name",
+    "gender": "gender",
+    "dob": "dob",
+    "phone": "phone",
+    "address": "address",
+    "city": "city",
+}
+
+
+def stored_patient_fhir_id(fhir_resource):
+    """The Patient resource id inside a stored bundle, reused when it is rebuilt."""
+    for entry in fhir_resource.get("entry", []):
+        resource = entry.get("resource") or {}
+        if resource.get("resourceType") == "Patient":
+            return resource.get("id")
+    return None
+
+
+def rebuild_update(stored, rebuilt, digest=None, search=None, now=None):
+    """UpdateOne moving a stored FHIR document to a rebuilt bundle, or None if unchanged.
+
+    `stored` needs shared_id, fhir_resource and (when present) content_hash.
+    The write bumps meta.versionId and is conditional on the version read, so
+    a concurrent rebuild is not overwritten.
+    """
+    digest = digest or content_hash(rebuilt)
+    old = stored["fhir_resource"]
+    if digest == (stored.get("content_hash") or content_hash(old)):
+        return None
+    now = now or datetime.utcnow()
+    version = (old.get("meta") or {}).get("versionId")
+    return UpdateOne(
+        {"shared_id": stored["shared_id"], "fhir_resource.meta.versionId": version},
+        {"$set": {
+            "fhir_resource": _with_meta(rebuilt, int(version or 1) + 1, now),
+            "content_hash": digest,
+            "search": search or search_fields(rebuilt),
+            "updated_at": now,
+        }}
+    )
+
+
+def refresh_patient_bundles(patient):
+    """Bring a patient's shares and stored bundles up to date with their profile.
+
+    Only shares whose snapshot differs are rewritten, and only bundles whose
+    rebuilt content hashes differently get a new meta.versionId; the bundle
+    writes go out as one bulk_write. Shares not converted yet need nothing,
+    conversion reads the current profile. Returns the number of bundles rewritten.
+    """
+    patient_id = patient.get("patient_id")
+    if not patient_id:
+        return 0
+
+    snapshot = {field: patient.get(source) for field, source in SHARE_SNAPSHOT.items()}
+    shared_profiles_col.update_many(
+        {"patient_id": patient_id, "$or": [{field: {"$ne": value}} for field, value in snapshot.items()]},
+        {"$set": snapshot}
+    )
+
+    stored = list(fhir_patients_col.find(
+        {"patient_id": patient_id},
+        {"_id": 0, "shared_id": 1, "fhir_resource": 1, "content_hash": 1}
+    ))
+    if not stored:
+        return 0
+    shares = {
+        s["shared_id"]: s for s in shared_profiles_col.find(
+            {"patient_id": patient_id},
+            {"_id": 0, "shared_id": 1, "illness_reason": 1, "practitioner_id": 1, "organization_id": 1}
+        )
+    }
+    practitioners = get_many_by_id("doctor", [s.get("practitioner_id") for s in shares.values()])
+    organizations = get_many_by_id("hospital", [s.get("organization_id") for s in shares.values()])
+
+    now = datetime.utcnow()
+    ops = []
+    for doc in stored:
+        share = shares.get(doc["shared_id"])
+        if share is None:
+            continue
+        rebuilt = build_fhir_patient(
+            patient,
+            practitioners.get(share.get("practitioner_id")),
+            organizations.get(share.get("organization_id")),
+            share.get("illness_reason"),
+            patient_fhir_id=stored_patient_fhir_id(doc["fhir_resource"])
+        )
+        op = rebuild_update(doc, rebuilt, now=now)
+        if op is not None:
+            ops.append(op)
+    if ops:
+        fhir_patients_col.bulk_write(ops, ordered=False)
+    return len(ops)
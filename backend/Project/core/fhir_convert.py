@@ -0,0 +1,194 @@
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import django
+from pymongo import ReplaceOne
+
+from .db import (
+    convert_checkpoints_col,
+    fhir_patients_col,
+    organizations_col,
+    patients_col,
+    practitioners_col,
+    shared_profiles_col,
+)
+from .fhir import build_fhir_patient, fhir_document, rebuild_update, stored_patient_fhir_id
+
+# -----------------------
+# Bulk FHIR Conversion
+# -----------------------
+# Engine behind `manage.py fhir_convert`: converts every unconverted share,
+# or rebuilds every bundle after a mapping change. Shares are read in _id
+# order, in chunks. Per chunk, the patients, practitioners, organizations
+# and existing bundles it references are fetched with one $in query each.
+# Bundles are built in a process pool while the next chunk is read. Results
+# are written in chunk order with one bulk_write. Existing bundles keep their
+# Patient id and only change when their content hash does (as in
+# refresh_patient_bundles).
+#
+# After each written chunk, the last _id is saved in fhir_convert_checkpoints,
+# so an interrupted run resumes where it stopped.
+
+CONVERT_CHUNK_SIZE = 2000
+SHARE_PROJECTION = {
+    "shared_id": 1,
+    "patient_id": 1,
+    "patient_email": 1,
+    "practitioner_id": 1,
+    "organization_id": 1,
+    "illness_reason": 1,
+    "fhir_converted": 1,
+}
+ENTITY_PROJECTION = {"_id": 0, "password": 0}
+
+
+def build_documents(items):
+    """Process-pool task: [(share, patient, practitioner, organization, patient_fhir_id)] -> fhir documents."""
+    return [
+        fhir_document(share, build_fhir_patient(
+            patient, practitioner, organization, share.get("illness_reason"), patient_fhir_id=patient_fhir_id
+        ))
+        for share, patient, practitioner, organization, patient_fhir_id in items
+    ]
+
+
+def _by(col, field, values, projection=ENTITY_PROJECTION):
+    values = list({v for v in values if v})
+    if not values:
+        return {}
+    return {doc[field]: doc for doc in col.find({field: {"$in": values}}, projection)}
+
+
+def prefetch(shares):
+    """The documents a chunk of shares references, one $in query per collection."""
+    return {
+        "patients": _by(patients_col, "email", (s.get("patient_email") for s in shares)),
+        "practitioners": _by(practitioners_col, "practitioner_id", (s.get("practitioner_id") for s in shares)),
+        "organizations": _by(organizations_col, "organization_id", (s.get("organization_id") for s in shares)),
+        "stored": _by(
+            fhir_patients_col, "shared_id", (s["shared_id"] for s in shares),
+            {"_id": 0, "shared_id": 1, "fhir_resource": 1, "content_hash": 1}
+        ),
+    }
+
+
+def plan_chunk(shares, refs):
+    """(build items, shared_ids without a patient) for one chunk."""
+    items, orphaned = [], []
+    for share in shares:
+        patient = refs["patients"].get(share.get("patient_email"))
+        if patient is None:
+            orphaned.append(share["shared_id"])
+            continue
+        stored = refs["stored"].get(share["shared_id"])
+        items.append((
+            share,
+            patient,
+            refs["practitioners"].get(share.get("practitioner_id")),
+            refs["organizations"].get(share.get("organization_id")),
+            stored_patient_fhir_id(stored["fhir_resource"]) if stored else None,
+        ))
+    return items, orphaned
+
+
+def write_chunk(shares, refs, documents, totals, dry_run=False):
+    """Turn built documents into one bulk_write, then flag the shares converted."""
+    ops = []
+    for doc in documents:
+        stored = refs["stored"].get(doc["shared_id"])
+        if stored is None:
+            totals["created"] += 1
+            ops.append(ReplaceOne({"shared_id": doc["shared_id"]}, doc, upsert=True))
+            continue
+        op = rebuild_update(stored, doc["fhir_resource"], doc["content_hash"], doc["search"], doc["updated_at"])
+        if op is None:
+            totals["unchanged"] += 1
+        else:
+            totals["updated"] += 1
+            ops.append(op)
+
+    built = {doc["shared_id"] for doc in documents}
+    unflagged = [s["shared_id"] for s in shares if not s.get("fhir_converted") and s["shared_id"] in built]
+    if dry_run:
+        return
+    if ops:
+        fhir_patients_col.bulk_write(ops, ordered=False)
+    if unflagged:
+        shared_profiles_col.update_many({"shared_id": {"$in": unflagged}}, {"$set": {"fhir_converted": True}})
+
+
+def load_checkpoint(name):
+    return convert_checkpoints_col.find_one({"_id": name, "done": False})
+
+
+def save_checkpoint(name, last_id, totals, done=False):
+    convert_checkpoints_col.update_one(
+        {"_id": name},
+        {"$set": {"last_id": last_id, "totals": dict(totals), "done": done, "updated_at": datetime.utcnow()}},
+        upsert=True
+    )
+
+
+def _chunks(cursor, size):
+    chunk = []
+    for doc in cursor:
+        chunk.append(doc)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def convert_all(rebuild=False, chunk_size=CONVERT_CHUNK_SIZE, workers=0, checkpoint=None,
+                restart=False, dry_run=False, progress=None):
+    """Convert unconverted shares (or, with rebuild, every share). Returns the totals Counter.
+
+    workers=0 builds in this process. progress(totals, seconds) is called after
+    every written chunk.
+    """
+    name = checkpoint or ("rebuild" if rebuild else "unconverted")
+    query = {} if rebuild else {"fhir_converted": False}
+    totals = Counter()
+    saved = None if restart or dry_run else load_checkpoint(name)
+    if saved:
+        query["_id"] = {"$gt": saved["last_id"]}
+        totals.update(saved.get("totals", {}))
+
+    started = time.perf_counter()
+    cursor = shared_profiles_col.find(query, SHARE_PROJECTION, batch_size=chunk_size).sort("_id", 1)
+    pool = ProcessPoolExecutor(workers, initializer=django.setup) if workers else None
+    pending = deque()
+
+    def finish_oldest():
+        shares, refs, orphaned, result = pending.popleft()
+        documents = result.result() if pool else result
+        write_chunk(shares, refs, documents, totals, dry_run)
+        totals["scanned"] += len(shares)
+        totals["orphaned"] += len(orphaned)
+        if not dry_run:
+            save_checkpoint(name, shares[-1]["_id"], totals)
+        if progress:
+            progress(totals, time.perf_counter() - started)
+
+    try:
+        for shares in _chunks(cursor, chunk_size):
+            refs = prefetch(shares)
+            items, orphaned = plan_chunk(shares, refs)
+            result = pool.submit(build_documents, items) if pool else build_documents(items)
+            pending.append((shares, refs, orphaned, result))
+            # Keep every worker busy while bounding memory to a few chunks
+            if len(pending) > max(workers, 1) * 2:
+                finish_oldest()
+        while pending:
+            finish_oldest()
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+
+    if not dry_run:
+        save_checkpoint(name, None, totals, done=True)
+    totals["seconds"] = time.perf_counter() - started
+    return totals
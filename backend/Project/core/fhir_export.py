@@ -0,0 +1,246 @@
+import gzip
+import logging
+import os
+import shutil
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from pymongo import ReturnDocument
+
+from .db import fhir_exports_col, fhir_patients_col
+from .fhir_queue import DONE, FAILED, QUEUED, RUNNING, poll
+from .streaming import ndjson_lines
+
+logger = logging.getLogger("backend")
+
+# -----------------------
+# FHIR Bulk Export
+# -----------------------
+# Modelled on FHIR Bulk Data `$export`: a hospital kicks off an export, polls
+# its status URL and downloads the files listed in the manifest. Jobs live in
+# fhir_export_jobs and are run by `manage.py run_fhir_worker` (same lease
+# scheme as the conversion queue). Each job streams the organization's stored
+# bundles through a batched cursor into gzip NDJSON files under
+# FHIR_EXPORT_DIR/<export_id>/, one Bundle per line.
+#
+# Every export covers bundles last written (updated_at, else created_at) at or
+# before its transactionTime, so passing that back as `_since` on the next
+# export picks up exactly what was stored or regenerated after it.
+
+EXPORT_TYPE = "Bundle"
+EXPORT_BATCH_SIZE = 1000
+LEASE_SECONDS = 300
+OUTPUT_FORMATS = {"application/fhir+ndjson", "application/ndjson", "ndjson"}
+
+
+class InvalidExport(ValueError):
+    pass
+
+
+def parse_since(value):
+    """`_since` as a naive UTC datetime (how created_at is stored), or None."""
+    if not value:
+        return None
+    try:
+        since = datetime.fromisoformat(value.replace(" ", "+"))  # an unescaped "+" arrives as a space
+    except ValueError:
+        raise InvalidExport("_since must be an ISO 8601 instant")
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    return since
+
+
+def instant(value):
+    return value.replace(tzinfo=timezone.utc).isoformat().replace("+00:00", "Z") if value else None
+
+
+def export_dir(export_id):
+    return os.path.join(settings.FHIR_EXPORT_DIR, export_id)
+
+
+def active_export(organization_id):
+    return fhir_exports_col.find_one(
+        {"organization_id": organization_id, "status": {"$in": [QUEUED, RUNNING]}},
+        {"_id": 0}
+    )
+
+
+def start_export(organization_id, since, request_url):
+    now = datetime.utcnow()
+    job = {
+        "export_id": uuid.uuid4().hex,
+        "organization_id": organization_id,
+        "since": since,
+        "transaction_time": now,
+        "request": request_url,
+        "status": QUEUED,
+        "attempts": 0,
+        "output": [],
+        "last_error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+    fhir_exports_col.insert_one(job)
+    job.pop("_id", None)
+    return job
+
+
+def get_export(export_id):
+    return fhir_exports_col.find_one({"export_id": export_id}, {"_id": 0})
+
+
+def delete_export(export_id):
+    """Cancel or remove an export. A worker still running it cleans up after itself."""
+    fhir_exports_col.delete_one({"export_id": export_id})
+    shutil.rmtree(export_dir(export_id), ignore_errors=True)
+
+
+def claim_next_export(worker):
+    now = datetime.utcnow()
+    return fhir_exports_col.find_one_and_update(
+        {"$or": [
+            {"status": QUEUED},
+            {"status": RUNNING, "lease_expires_at": {"$lt": now}},
+        ]},
+        {
+            "$set": {
+                "status": RUNNING,
+                "worker": worker,
+                "lease_expires_at": now + timedelta(seconds=LEASE_SECONDS),
+                "updated_at": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def _owned(job):
+    return {"export_id": job["export_id"], "worker": job["worker"], "status": RUNNING}
+
+
+def _write_file(path, lines):
+    """gzip NDJSON to `path` (via a .part file); returns the line count."""
+    count = 0
+    with gzip.open(path + ".part", "wb", compresslevel=6) as out:
+        for line in lines:
+            out.write(line)
+            count += 1
+    os.replace(path + ".part", path)
+    return count
+
+
+def _chunks(iterator, size):
+    chunk = []
+    for item in iterator:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_export(job):
+    """Stream the job's bundles into numbered files; returns the manifest output list."""
+    window = {"$lte": job["transaction_time"]}
+    if job.get("since"):
+        window["$gt"] = job["since"]
+    cursor = fhir_patients_col.find(
+        {"organization_id": job["organization_id"], "$or": [
+            {"updated_at": window},
+            # Documents stored before updated_at was tracked
+            {"updated_at": None, "created_at": window},
+        ]},
+        {"_id": 0, "fhir_resource": 1},
+        batch_size=EXPORT_BATCH_SIZE
+    )
+
+    directory = export_dir(job["export_id"])
+    shutil.rmtree(directory, ignore_errors=True)  # a retried job starts over
+    os.makedirs(directory)
+
+    output = []
+    lines = ndjson_lines(doc["fhir_resource"] for doc in cursor)
+    for number, chunk in enumerate(_chunks(lines, settings.FHIR_EXPORT_FILE_LINES), start=1):
+        name = f"{EXPORT_TYPE}-{number}.ndjson.gz"
+        count = _write_file(os.path.join(directory, name), chunk)
+        output.append({"type": EXPORT_TYPE, "file": name, "count": count})
+        # Large exports outlive one lease; keep it while making progress
+        renewed = fhir_exports_col.update_one(
+            _owned(job),
+            {"$set": {
+                "output": output,
+                "lease_expires_at": datetime.utcnow() + timedelta(seconds=LEASE_SECONDS),
+                "updated_at": datetime.utcnow(),
+            }}
+        )
+        if not renewed.matched_count:
+            raise LookupError("Export was cancelled or reclaimed")
+    return output
+
+
+def run_export(job):
+    try:
+        output = write_export(job)
+    except LookupError:
+        # Cancelled (or lease lost) mid-run: leave no files behind for a deleted job
+        if get_export(job["export_id"]) is None:
+            shutil.rmtree(export_dir(job["export_id"]), ignore_errors=True)
+        return
+    except Exception as exc:
+        error = f"{type(exc).__name__}: {exc}"
+        logger.error("FHIR export %s failed: %s", job["export_id"], error)
+        fhir_exports_col.update_one(
+            _owned(job),
+            {"$set": {"status": FAILED, "last_error": error, "updated_at": datetime.utcnow()},
+             "$unset": {"lease_expires_at": ""}}
+        )
+        return
+
+    now = datetime.utcnow()
+    finished = fhir_exports_col.update_one(
+        _owned(job),
+        {"$set": {
+            "status": DONE,
+            "output": output,
+            "completed_at": now,
+            "expires_at": now + timedelta(hours=settings.FHIR_EXPORT_RETENTION_HOURS),
+            "updated_at": now,
+        }, "$unset": {"lease_expires_at": ""}}
+    )
+    if not finished.matched_count and get_export(job["export_id"]) is None:
+        shutil.rmtree(export_dir(job["export_id"]), ignore_errors=True)
+
+
+def purge_expired_exports():
+    """Delete finished exports past their retention, files included."""
+    expired = [
+        job["export_id"] for job in fhir_exports_col.find(
+            {"expires_at": {"$lt": datetime.utcnow()}}, {"_id": 0, "export_id": 1}
+        )
+    ]
+    for export_id in expired:
+        delete_export(export_id)
+    return len(expired)
+
+
+def work(worker, stop_event, poll_interval=1.0):
+    """Run queued exports until stop_event is set."""
+    poll(claim_next_export, run_export, worker, stop_event, poll_interval)
+
+
+def manifest(job, file_url):
+    """The Bulk Data completion manifest; file_url(name) builds download URLs."""
+    return {
+        "transactionTime": instant(job["transaction_time"]),
+        "request": job["request"],
+        "requiresAccessToken": True,
+        "output": [
+            {"type": item["type"], "url": file_url(item["file"]), "count": item["count"]}
+            for item in job["output"]
+        ],
+        "error": [],
+    }
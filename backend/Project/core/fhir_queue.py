@@ -0,0 +1,259 @@
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument, UpdateOne
+
+from .db import fhir_jobs_col, shared_profiles_col
+from .fhir import convert_shared_profile
+
+logger = logging.getLogger("backend")
+
+# -----------------------
+# FHIR Conversion Queue
+# -----------------------
+# share_profile persists the share and enqueues one job per shared_id in
+# fhir_conversion_jobs; `manage.py run_fhir_worker` drains it. A job is
+# claimed with a lease, so a crashed worker's jobs are picked up again once
+# the lease expires. Failures back off exponentially up to MAX_ATTEMPTS; a
+# job whose worker keeps dying (OOM on a huge bundle, say) is not reclaimed
+# past MAX_ATTEMPTS either, and the sweep marks it failed.
+# Errors outside a job (Mongo unreachable, say) are logged and retried with
+# a backoff, so a worker thread outlives them; run_fhir_worker restarts any
+# thread that dies anyway.
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+MAX_ATTEMPTS = 5
+LEASE_SECONDS = 120
+BACKOFF_SECONDS = 5
+RECONCILE_BATCH = 1000
+ERROR_BACKOFF_MAX_SECONDS = 60
+
+
+def worker_name(suffix=""):
+    return f"{socket.gethostname()}:{os.getpid()}{suffix}"
+
+
+def _enqueue_op(shared_id, now):
+    return UpdateOne(
+        {"shared_id": shared_id},
+        {
+            "$set": {
+                "status": QUEUED,
+                "attempts": 0,
+                "available_at": now,
+                "last_error": None,
+                "updated_at": now,
+            },
+            "$setOnInsert": {"created_at": now},
+        },
+        upsert=True
+    )
+
+
+def enqueue_conversion(shared_id):
+    enqueue_conversions([shared_id])
+
+
+def enqueue_conversions(shared_ids):
+    if shared_ids:
+        now = datetime.utcnow()
+        fhir_jobs_col.bulk_write([_enqueue_op(sid, now) for sid in shared_ids], ordered=False)
+
+
+def claim_next_job(worker):
+    now = datetime.utcnow()
+    return fhir_jobs_col.find_one_and_update(
+        {"$or": [
+            {"status": QUEUED, "available_at": {"$lte": now}},
+            {"status": RUNNING, "lease_expires_at": {"$lt": now}, "attempts": {"$lt": MAX_ATTEMPTS}},
+        ]},
+        {
+            "$set": {
+                "status": RUNNING,
+                "worker": worker,
+                "lease_expires_at": now + timedelta(seconds=LEASE_SECONDS),
+                "updated_at": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("available_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def fail_exhausted_jobs():
+    """Mark failed the jobs whose lease expired on their last attempt. Returns how many."""
+    now = datetime.utcnow()
+    result = fhir_jobs_col.update_many(
+        {"status": RUNNING, "lease_expires_at": {"$lt": now}, "attempts": {"$gte": MAX_ATTEMPTS}},
+        {
+            "$set": {
+                "status": FAILED,
+                "last_error": f"Worker lease expired on each of {MAX_ATTEMPTS} attempts",
+                "updated_at": now,
+            },
+            "$unset": {"lease_expires_at": ""},
+        }
+    )
+    if result.modified_count:
+        logger.error("%s FHIR conversion job(s) failed permanently after expired leases", result.modified_count)
+    return result.modified_count
+
+
+def _finish(job, status, error=None, retry_at=None):
+    changes = {"status": status, "last_error": error, "updated_at": datetime.utcnow()}
+    if retry_at is not None:
+        changes["available_at"] = retry_at
+    # Only the worker holding the lease may finish the job
+    fhir_jobs_col.update_one(
+        {"_id": job["_id"], "worker": job["worker"], "status": RUNNING},
+        {"$set": changes, "$unset": {"lease_expires_at": ""}}
+    )
+
+
+def run_job(job):
+    share = shared_profiles_col.find_one({"shared_id": job["shared_id"]})
+    if share is None:
+        # Deleted before conversion ran; nothing to do
+        _finish(job, DONE, error="Shared profile no longer exists")
+        return
+
+    try:
+        convert_shared_profile(share)
+    except Exception as exc:
+        error = f"{type(exc).__name__}: {exc}"
+        if job["attempts"] >= MAX_ATTEMPTS:
+            logger.error("FHIR conversion for %s failed permanently: %s", job["shared_id"], error)
+            _finish(job, FAILED, error=error)
+        else:
+            delay = BACKOFF_SECONDS * 2 ** (job["attempts"] - 1)
+            logger.warning("FHIR conversion for %s failed, retrying in %ss: %s", job["shared_id"], delay, error)
+            _finish(job, QUEUED, error=error, retry_at=datetime.utcnow() + timedelta(seconds=delay))
+        return
+
+    _finish(job, DONE)
+
+
+def reconcile_unconverted(batch=RECONCILE_BATCH):
+    """Enqueue shares still flagged fhir_converted=False that have no job.
+
+    Covers shares created before the queue existed and enqueues lost between
+    the share insert and the job upsert. Failed jobs are left for an operator.
+    Walks every unconverted share in _id order, `batch` at a time, so shares
+    that already have a job never hide the ones behind them.
+    """
+    enqueued = 0
+    last_id = None
+    while True:
+        query = {"fhir_converted": False}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        shares = list(
+            shared_profiles_col.find(query, {"_id": 1, "shared_id": 1}).sort("_id", 1).limit(batch)
+        )
+        if not shares:
+            return enqueued
+        last_id = shares[-1]["_id"]
+        shared_ids = [s["shared_id"] for s in shares]
+        tracked = {
+            j["shared_id"] for j in fhir_jobs_col.find(
+                {"shared_id": {"$in": shared_ids}}, {"_id": 0, "shared_id": 1}
+            )
+        }
+        missing = [sid for sid in shared_ids if sid not in tracked]
+        enqueue_conversions(missing)
+        enqueued += len(missing)
+        if len(shares) < batch:
+            return enqueued
+
+
+def poll(claim, run, worker, stop_event, poll_interval=1.0):
+    """Claim and run jobs until stop_event is set, sleeping while none are ready.
+
+    An error from claim or run is logged and followed by an exponential
+    backoff instead of ending the loop; a half-run job is reclaimed once its
+    lease expires.
+    """
+    failures = 0
+    while not stop_event.is_set():
+        try:
+            job = claim(worker)
+            if job is not None:
+                run(job)
+        except Exception:
+            failures += 1
+            delay = min(poll_interval * 2 ** failures, ERROR_BACKOFF_MAX_SECONDS)
+            logger.exception("%s failed, retrying in %.0fs", worker, delay)
+            stop_event.wait(delay)
+            continue
+        failures = 0
+        if job is None:
+            stop_event.wait(poll_interval)
+
+
+def work(worker, stop_event, poll_interval=1.0):
+    """Drain the queue until stop_event is set."""
+    poll(claim_next_job, run_job, worker, stop_event, poll_interval)
+
+
+def _start_worker(target, name, stop_event, poll_interval):
+    thread = threading.Thread(
+        target=target,
+        args=(worker_name(f":{name}"), stop_event, poll_interval),
+        name=name,
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+def start_workers(count, poll_interval=1.0, target=work, name="fhir-worker", stop_event=None):
+    """Start `count` daemon threads running `target`; returns (stop_event, threads).
+
+    Pass another module's loop (e.g. fhir_export.work) and a shared stop_event
+    to run several queues from one process.
+    """
+    stop_event = stop_event or threading.Event()
+    threads = [_start_worker(target, f"{name}-{i}", stop_event, poll_interval) for i in range(count)]
+    return stop_event, threads
+
+
+def restart_dead_workers(threads, stop_event, poll_interval=1.0, target=work):
+    """Replace, in place, the threads from start_workers that have died. Returns how many."""
+    restarted = 0
+    for i, thread in enumerate(threads):
+        if thread.is_alive() or stop_event.is_set():
+            continue
+        logger.error("Worker thread %s died; restarting it", thread.name)
+        threads[i] = _start_worker(target, thread.name, stop_event, poll_interval)
+        restarted += 1
+    return restarted
+
+
+def conversion_status(shared_doc):
+    job = fhir_jobs_col.find_one({"shared_id": shared_doc["shared_id"]}, {"_id": 0})
+    return conversion_status_from(shared_doc, job)
+
+
+def conversion_status_from(shared_doc, job):
+    """conversion_status for a job document the caller already fetched (or None)."""
+    if job is None:
+        status = DONE if shared_doc.get("fhir_converted") else QUEUED
+        job = {}
+    else:
+        status = job["status"]
+    return {
+        "shared_id": shared_doc["shared_id"],
+        "fhir_converted": bool(shared_doc.get("fhir_converted")),
+        "status": status,
+        "attempts": job.get("attempts", 0),
+        "last_error": job.get("last_error"),
+        "updated_at": job.get("updated_at"),
+    }
@@ -0,0 +1,157 @@
+import re
+from datetime import date, timedelta
+
+# -----------------------
+# FHIR Search Fields
+# -----------------------
+# Each stored FHIR document carries a `search` sub-document extracted from its
+# bundle when it is written (fhir.fhir_document), so the search endpoint is an
+# index seek per owner instead of a scan over bundles. Strings are lowercased
+# and matched by prefix, like FHIR string search; birthdate is the ISO date
+# string, which sorts chronologically. `manage.py backfill_fhir_search` fills
+# in documents written before the fields existed or by an older SEARCH_VERSION.
+
+SEARCH_VERSION = 1
+
+# query parameter -> search field
+STRING_PARAMS = {"name": "name", "address-city": "city", "code": "code"}
+GENDERS = {"male", "female", "other", "unknown"}
+DATE_PREFIXES = ("eq", "gt", "ge", "lt", "le")
+PAGING_PARAMS = {"_count", "_cursor", "format"}
+DEFAULT_COUNT = 20
+MAX_COUNT = 100
+
+_ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_PARTIAL_DATE = re.compile(r"^(\d{4})(?:-(\d{2}))?(?:-(\d{2}))?$")
+
+
+class InvalidSearch(ValueError):
+    pass
+
+
+def _words(text):
+    return [w for w in str(text).lower().split() if w]
+
+
+def search_fields(bundle):
+    """The `search` sub-document for a bundle built by fhir.build_fhir_patient."""
+    fields = {"v": SEARCH_VERSION, "name": [], "gender": None, "birthdate": None, "city": [], "code": []}
+    for entry in bundle.get("entry", []):
+        resource = entry.get("resource") or {}
+        kind = resource.get("resourceType")
+        if kind == "Patient":
+            for name in resource.get("name") or []:
+                for part in [name.get("family"), *(name.get("given") or [])]:
+                    if part:
+                        fields["name"].extend(_words(part))
+            if resource.get("gender"):
+                fields["gender"] = str(resource["gender"]).lower()
+            if _ISO_DATE.match(str(resource.get("birthDate") or "")):
+                fields["birthdate"] = resource["birthDate"]
+            for address in resource.get("address") or []:
+                if address.get("city"):
+                    fields["city"].append(" ".join(_words(address["city"])))
+        elif kind == "Observation":
+            text = (resource.get("code") or {}).get("text")
+            if text:
+                fields["code"].append(" ".join(_words(text)))
+    for key in ("name", "city", "code"):
+        fields[key] = sorted(set(fields[key]))
+    return fields
+
+
+def _prefix(value):
+    return {"$regex": "^" + re.escape(value)}
+
+
+def _date_range(value):
+    """[start, end) as ISO strings for a (possibly partial) FHIR date."""
+    match = _PARTIAL_DATE.match(value)
+    if not match:
+        raise InvalidSearch("birthdate must be YYYY, YYYY-MM or YYYY-MM-DD")
+    year, month, day = match.groups()
+    try:
+        if day:
+            start = date(int(year), int(month), int(day))
+            return start.isoformat(), (start + timedelta(days=1)).isoformat()
+        if month:
+            start = date(int(year), int(month), 1)
+            end = date(int(year) + (start.month == 12), start.month % 12 + 1, 1)
+            return start.isoformat()[:7], end.isoformat()[:7]
+    except ValueError:
+        raise InvalidSearch("birthdate is not a valid date")
+    return year, str(int(year) + 1)
+
+
+def _birthdate_clause(value):
+    prefix = value[:2] if value[:2] in DATE_PREFIXES else "eq"
+    start, end = _date_range(value[2:] if value[:2] in DATE_PREFIXES else value)
+    bounds = {
+        "eq": {"$gte": start, "$lt": end},
+        "gt": {"$gte": end},
+        "ge": {"$gte": start},
+        "lt": {"$lt": start},
+        "le": {"$lt": end},
+    }[prefix]
+    return {"search.birthdate": bounds}
+
+
+def build_search_query(params):
+    """Mongo filter (without the owner) for FHIR search parameters.
+
+    `params` is a QueryDict; repeated parameters must all match.
+    """
+    clauses = []
+    for param in params:
+        if param in PAGING_PARAMS:
+            continue
+        for value in params.getlist(param):
+            value = value.strip()
+            if not value:
+                raise InvalidSearch(f"{param} must not be empty")
+            if param == "name":
+                # Every word has to prefix some part of the name
+                clauses.extend({"search.name": _prefix(word)} for word in _words(value))
+            elif param in STRING_PARAMS:
+                clauses.append({f"search.{STRING_PARAMS[param]}": _prefix(" ".join(_words(value)))})
+            elif param == "gender":
+                if value.lower() not in GENDERS:
+                    raise InvalidSearch(f"gender must be one of {', '.join(sorted(GENDERS))}")
+                clauses.append({"search.gender": value.lower()})
+            elif param == "birthdate":
+                clauses.append(_birthdate_clause(value))
+            else:
+                raise InvalidSearch(f"Unsupported search parameter: {param}")
+    if not clauses:
+        raise InvalidSearch("At least one search parameter is required")
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def parse_count(params):
+    try:
+        count = int(params.get("_count", DEFAULT_COUNT))
+    except ValueError:
+        raise InvalidSearch("_count must be an integer")
+    if count < 1:
+        raise InvalidSearch("_count must be positive")
+    return min(count, MAX_COUNT)
+
+
+def searchset(docs, self_url, next_url):
+    """A FHIR searchset Bundle whose entries are the matching stored bundles."""
+    links = [{"relation": "self", "url": self_url}]
+    if next_url:
+        links.append({"relation": "next", "url": next_url})
+    return {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "link": links,
+        "entry": [
+            {
+                "fullUrl": f"urn:shared-profile:{doc['shared_id']}",
+                "resource": doc["fhir_resource"],
+                "search": {"mode": "match"},
+            }
+            for doc in docs
+        ],
+    }
@@ -0,0 +1,191 @@
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+from .db import db
+
+# -----------------------
+# Index Registry
+# -----------------------
+# Every index the views rely on, per collection. `manage.py ensure_indexes`
+# creates these and then explains QUERY_SHAPES against them.
+#
+# Generated IDs (patient_id, practitioner_id, shared_id, loan_id, ...) are
+# random and can collide, so their indexes are unique and writers retry with a
+# fresh ID (db.insert_with_fresh_id). A duplicate ID would let two accounts see
+# each other's shares and loans. Account IDs are only unique where set: legacy
+# rows and update_profile's upserts have none, and would all collide as null.
+#
+# List endpoints filter on an owner field and page newest first, so their
+# indexes are (owner, sort field desc, _id desc) to back keyset pagination.
+
+NEWEST_SHARED = [("shared_at", DESCENDING), ("_id", DESCENDING)]
+NEWEST_CREATED = [("created_at", DESCENDING), ("_id", DESCENDING)]
+
+
+def unique_id(field):
+    return IndexModel(
+        [(field, ASCENDING)], unique=True, partialFilterExpression={field: {"$exists": True}}, name=f"{field}_unique"
+    )
+
+
+# Recipient typeahead catches up on entities created or updated since its last sync
+RECENTLY_CHANGED = [
+    IndexModel([("created_at", ASCENDING)], name="created_at"),
+    IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+]
+
+# FHIR search (core/fhir_search.py) seeks on one extracted field within the
+# clinician's own documents; gender is too coarse to lead and is filtered after
+FHIR_SEARCH = [
+    IndexModel([(owner, ASCENDING), (f"search.{field}", ASCENDING)], name=f"{owner}_search_{field}")
+    for owner in ("practitioner_id", "organization_id")
+    for field in ("name", "birthdate", "city", "code")
+]
+
+INDEXES = {
+    "patients": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+        unique_id("patient_id"),
+    ],
+    "practitioners": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+        unique_id("practitioner_id"),
+        IndexModel([("organization_id", ASCENDING)], name="organization_id"),
+    ] + RECENTLY_CHANGED,
+    "organizations": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+        unique_id("organization_id"),
+    ] + RECENTLY_CHANGED,
+    "shared_profiles": [
+        unique_id("shared_id"),
+        IndexModel([("patient_id", ASCENDING)] + NEWEST_SHARED, name="patient_newest"),
+        IndexModel([("practitioner_id", ASCENDING)] + NEWEST_SHARED, name="practitioner_newest"),
+        IndexModel([("organization_id", ASCENDING)] + NEWEST_SHARED, name="organization_newest"),
+        # fhir_convert walks unconverted shares in _id order
+        IndexModel(
+            [("fhir_converted", ASCENDING), ("_id", ASCENDING)],
+            partialFilterExpression={"fhir_converted": False},
+            name="unconverted_id",
+        ),
+    ],
+    "fhir_patients": [
+        IndexModel([("shared_id", ASCENDING)], name="shared_id"),
+        IndexModel([("patient_id", ASCENDING)] + NEWEST_CREATED, name="patient_newest"),
+        IndexModel([("practitioner_id", ASCENDING)] + NEWEST_CREATED, name="practitioner_newest"),
+        IndexModel([("organization_id", ASCENDING)] + NEWEST_CREATED, name="organization_newest"),
+        IndexModel([("organization_id", ASCENDING), ("updated_at", ASCENDING)], name="organization_updated"),
+    ] + FHIR_SEARCH,
+    "fhir_conversion_jobs": [
+        IndexModel([("shared_id", ASCENDING)], unique=True, name="shared_id_unique"),
+        IndexModel([("status", ASCENDING), ("available_at", ASCENDING)], name="status_available"),
+        IndexModel([("status", ASCENDING), ("lease_expires_at", ASCENDING)], name="status_lease"),
+    ],
+    "fhir_export_jobs": [
+        IndexModel([("export_id", ASCENDING)], unique=True, name="export_id_unique"),
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created"),
+        IndexModel([("organization_id", ASCENDING), ("status", ASCENDING)], name="organization_status"),
+        IndexModel([("expires_at", ASCENDING)], sparse=True, name="expires_at"),
+    ],
+    "loan_providers": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+        unique_id("loan_provider_id"),
+    ] + RECENTLY_CHANGED,
+    "loan_requests": [
+        IndexModel([("loan_id", ASCENDING)], unique=True, name="loan_id_unique"),
+        IndexModel([("loan_provider_id", ASCENDING), ("status", ASCENDING)], name="provider_status"),
+        IndexModel([("loan_provider_id", ASCENDING)] + NEWEST_CREATED, name="provider_newest"),
+        IndexModel([("patient_id", ASCENDING)] + NEWEST_CREATED, name="patient_newest"),
+    ],
+    "loan_provider_analytics": [
+        IndexModel([("loan_provider_id", ASCENDING)], unique=True, name="loan_provider_id_unique"),
+    ],
+}
+
+# (view, collection, filter[, sort]) for every indexed lookup the views make.
+# get_recipients deliberately lists whole collections and is not here.
+QUERY_SHAPES = [
+    ("login/get_profile", "patients", {"email": "x@example.com"}),
+    ("login/get_profile", "practitioners", {"email": "x@example.com"}),
+    ("login/get_profile", "organizations", {"email": "x@example.com"}),
+    ("login/loan views", "loan_providers", {"email": "x@example.com"}),
+    ("register", "organizations", {"organization_id": "HOSP-000000"}),
+    ("share_profile", "practitioners", {"practitioner_id": "DR-000000"}),
+    ("share_profile", "organizations", {"organization_id": "HOSP-000000"}),
+    ("patient_shared_profiles", "shared_profiles", {"patient_id": "PAT-0"}),
+    ("doctor_shared_profiles", "shared_profiles", {"practitioner_id": "DR-000000"}),
+    ("hospital_shared_profiles", "shared_profiles", {"organization_id": "HOSP-000000"}),
+    ("import_loan_applications", "shared_profiles", {"organization_id": "HOSP-000000", "patient_id": {"$in": ["PAT-0"]}}),
+    ("delete_shared_profile", "shared_profiles", {"shared_id": "SHARE-000000"}),
+    ("delete_shared_profile", "fhir_patients", {"shared_id": "SHARE-000000"}),
+    ("shared_profile_status", "fhir_conversion_jobs", {"shared_id": "SHARE-000000"}),
+    ("run_fhir_worker", "fhir_conversion_jobs", {"status": "queued", "available_at": {"$lte": 0}}),
+    ("run_fhir_worker", "fhir_conversion_jobs", {"status": "running", "lease_expires_at": {"$lt": 0}, "attempts": {"$gte": 5}}),
+    ("run_fhir_worker", "shared_profiles", {"fhir_converted": False}),
+    ("fhir_convert", "shared_profiles", {"fhir_converted": False, "_id": {"$gt": ObjectId("0" * 24)}}, [("_id", ASCENDING)]),
+    ("fhir_convert", "patients", {"email": {"$in": ["x@example.com"]}}),
+    ("run_fhir_worker", "fhir_export_jobs", {"status": "queued"}, [("created_at", ASCENDING)]),
+    ("run_fhir_worker", "fhir_export_jobs", {"expires_at": {"$lt": 0}}),
+    ("run_fhir_worker", "fhir_patients", {"organization_id": "HOSP-000000", "$or": [
+        {"updated_at": {"$gt": 0, "$lte": 1}}, {"updated_at": None, "created_at": {"$gt": 0, "$lte": 1}},
+    ]}),
+    ("update_profile", "fhir_patients", {"patient_id": "PAT-0"}),
+    ("fhir_export", "fhir_export_jobs", {"organization_id": "HOSP-000000", "status": {"$in": ["queued", "running"]}}),
+    ("fhir_export_status", "fhir_export_jobs", {"export_id": "0" * 32}),
+    ("patient_fhir_profiles", "fhir_patients", {"patient_id": "PAT-0"}),
+    ("fhir_search", "fhir_patients", {"organization_id": "HOSP-000000", "search.name": {"$regex": "^ra"}}),
+    ("fhir_search", "fhir_patients", {"practitioner_id": "DR-000000", "search.birthdate": {"$gte": "1984", "$lt": "1985"}}),
+    ("fhir_search", "fhir_patients", {"organization_id": "HOSP-000000", "search.city": {"$regex": "^beng"}}),
+    ("fhir_search", "fhir_patients", {"practitioner_id": "DR-000000", "search.code": {"$regex": "^blood"}}),
+    ("patient_fhir_profiles", "fhir_patients", {"practitioner_id": "DR-000000"}),
+    ("patient_fhir_profiles", "fhir_patients", {"organization_id": "HOSP-000000"}),
+    ("loan_provider_requests", "loan_requests", {"loan_provider_id": "LOANP-000000"}),
+    ("loan_provider_analytics", "loan_requests", {"loan_provider_id": "LOANP-000000"}),
+    ("loan_provider_analytics", "loan_provider_analytics", {"loan_provider_id": "LOANP-000000"}),
+    ("loan_detail/update_loan_status", "loan_requests", {"loan_id": "LOAN-000000", "loan_provider_id": "LOANP-000000"}),
+    ("respond_to_loan_plan", "loan_requests", {"loan_id": "LOAN-000000"}),
+    ("patient_loans", "loan_requests", {"patient_id": "PAT-0"}),
+    ("search_recipients", "practitioners", {"$or": [{"created_at": {"$gte": 0}}, {"updated_at": {"$gte": 0}}]}),
+    ("search_recipients", "organizations", {"$or": [{"created_at": {"$gte": 0}}, {"updated_at": {"$gte": 0}}]}),
+    ("search_recipients", "loan_providers", {"$or": [{"created_at": {"$gte": 0}}, {"updated_at": {"$gte": 0}}]}),
+    # Keyset pages of the list endpoints
+    ("patient_shared_profiles?limit", "shared_profiles", {"patient_id": "PAT-0"}, NEWEST_SHARED),
+    ("doctor_shared_profiles?limit", "shared_profiles", {"practitioner_id": "DR-000000"}, NEWEST_SHARED),
+    ("hospital_shared_profiles?limit", "shared_profiles", {"organization_id": "HOSP-000000"}, NEWEST_SHARED),
+    ("patient_fhir_profiles?limit", "fhir_patients", {"patient_id": "PAT-0"}, NEWEST_CREATED),
+    ("patient_fhir_profiles?limit", "fhir_patients", {"practitioner_id": "DR-000000"}, NEWEST_CREATED),
+    ("patient_fhir_profiles?limit", "fhir_patients", {"organization_id": "HOSP-000000"}, NEWEST_CREATED),
+    ("loan_provider_requests?limit", "loan_requests", {"loan_provider_id": "LOANP-000000"}, NEWEST_CREATED),
+    ("patient_loans?limit", "loan_requests", {"patient_id": "PAT-0"}, NEWEST_CREATED),
+]
+
+
+def ensure_indexes(database=None):
+    """Create every registered index. Returns {collection: [index names]}."""
+    database = db if database is None else database
+    return {
+        name: database[name].create_indexes(models)
+        for name, models in INDEXES.items()
+    }
+
+
+def _plan_stages(plan):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+
+def explain_query_shapes(database=None):
+    """Yield (view, collection, filter, winning plan stages) for every query shape."""
+    database = db if database is None else database
+    for view, collection, query, *sort in QUERY_SHAPES:
+        cursor = database[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort[0])
+        explained = cursor.explain()
+        winning = explained.get("queryPlanner", {}).get("winningPlan", {})
+        yield view, collection, query, list(_plan_stages(winning))
@@ -0,0 +1,292 @@
+import csv
+import io
+import json
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from pymongo.errors import BulkWriteError
+
+from .analytics import loan_counter_keys, record_loans_changed
+from .db import MAX_ID_ATTEMPTS, loan_providers_col, loan_requests_col, patients_col, shared_profiles_col
+from .risk import score_loans
+
+# -----------------------
+# Loan Documents
+# -----------------------
+
+RISK_STATUS = {"HIGH": "Rejected", "LOW": "Approved"}
+
+
+def generate_loan_id():
+    return f"LOAN-{uuid.uuid4().hex[:6].upper()}"
+
+
+def build_loan_doc(patient, data, risk, score, loan_id=None, created_at=None):
+    """The loan_requests document for one application, as apply_for_loan stores it."""
+    status = RISK_STATUS.get(risk, "Pending")
+
+    loan_doc = {
+        "loan_id": loan_id or generate_loan_id(),
+        "patient_id": patient["patient_id"],
+        "patient_name": f"{patient['first_name']} {patient['last_name']}",
+        "age": int(data.get("age", 0)),
+        "loan_purpose": data.get("loan_purpose"),
+        "medical_reason": data.get("medical_reason"),
+        "treatment_type": data.get("treatment_type"),
+        "phone": data.get("phone"),
+        "preferred_tenure": int(data.get("preferred_tenure")),
+        "hospital_name": data.get("hospital_name"),
+        "hospital_location": data.get("hospital_location"),
+        "required_amount": int(data.get("required_amount")),
+        "monthly_income": int(data.get("monthly_income", 0)),
+        "insurance_available": data.get("insurance_available") or data.get("existing_insurance"),
+        "existing_loans": data.get("existing_loans"),
+        "loan_provider_id": data.get("loan_provider_id") or data.get("loan_provider"),
+        "risk": risk,
+        "risk_score": score,
+        "status": status,
+        "created_at": created_at or datetime.utcnow()
+    }
+
+    # Revised Plan for Medium Risk
+    if risk == "MEDIUM":
+        loan_doc["revised_amount"] = int(int(data.get("required_amount")) * 0.8)
+        loan_doc["revised_tenure"] = int(data.get("preferred_tenure")) + 12
+
+    return loan_doc
+
+
+# -----------------------
+# Bulk Loan Import
+# -----------------------
+# Partner batches arrive as CSV or NDJSON files with one application per row,
+# in the same fields apply_for_loan takes plus patient_id. Rows are parsed
+# lazily, validated, scored in chunks with the batch risk engine and inserted
+# with unordered insert_many; every rejected row is reported with its line.
+# A hospital's upload may only file for patients who have shared a profile
+# with it; other rows fail as "Patient not found", so patient IDs cannot be
+# probed through it.
+
+IMPORT_FORMATS = ["csv", "ndjson"]
+IMPORT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+DUPLICATE_KEY = 11000
+
+REQUIRED_FIELDS = ["patient_id", "loan_provider_id", "required_amount", "preferred_tenure"]
+ID_FIELDS = ["patient_id", "loan_provider_id"]
+INT_FIELDS = ["required_amount", "preferred_tenure", "monthly_income", "age"]
+MAX_INT = 2 ** 63  # BSON int64
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.errors = []
+        self.error_count = 0
+        self.started = time.perf_counter()
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def as_dict(self):
+        seconds = time.perf_counter() - self.started
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "failed": self.error_count,
+            "errors": sorted(self.errors, key=lambda e: e["line"]),
+            "errors_truncated": self.error_count > len(self.errors),
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(self.rows / seconds) if seconds else None,
+        }
+
+
+def detect_format(filename, content_type=None):
+    name = (filename or "").lower()
+    if name.endswith((".ndjson", ".jsonl")) or "ndjson" in (content_type or ""):
+        return "ndjson"
+    if name.endswith(".csv") or "csv" in (content_type or ""):
+        return "csv"
+    return None
+
+
+def iter_rows(stream, fmt):
+    """Yield (line number, row dict or None, parse error or None) from a binary stream."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for row in reader:
+            # Empty cells count as missing so optional fields fall back to defaults
+            yield reader.line_num, {k: v for k, v in row.items() if k and v not in ("", None)}, None
+    else:
+        for line_no, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                yield line_no, None, f"Invalid JSON: {exc}"
+                continue
+            if not isinstance(row, dict):
+                yield line_no, None, "Each line must be a JSON object"
+                continue
+            yield line_no, row, None
+
+
+def validate_row(row):
+    if not row.get("loan_provider_id") and row.get("loan_provider"):
+        row["loan_provider_id"] = row["loan_provider"]
+    missing = [field for field in REQUIRED_FIELDS if not row.get(field)]
+    if missing:
+        return f"Missing {', '.join(missing)}"
+    # NDJSON rows can carry any JSON value here
+    for field in ID_FIELDS:
+        if not isinstance(row[field], str):
+            return f"{field} must be a string"
+    for field in INT_FIELDS:
+        if field in row:
+            try:
+                value = int(row[field])
+            except (TypeError, ValueError, OverflowError):
+                return f"{field} must be an integer"
+            if not -MAX_INT <= value < MAX_INT:
+                return f"{field} is out of range"
+    if int(row["preferred_tenure"]) <= 0:
+        return "preferred_tenure must be positive"
+    if int(row["required_amount"]) <= 0:
+        return "required_amount must be positive"
+    return None
+
+
+def _insert_with_fresh_ids(docs, lines, report):
+    """insert_many(ordered=False), re-issuing loan IDs that collide. Returns inserted docs."""
+    inserted = []
+    for _ in range(MAX_ID_ATTEMPTS):
+        if not docs:
+            break
+        # IDs already taken in the collection are swapped before the write
+        taken = {
+            d["loan_id"] for d in loan_requests_col.find(
+                {"loan_id": {"$in": [d["loan_id"] for d in docs]}}, {"_id": 0, "loan_id": 1}
+            )
+        }
+        for doc in docs:
+            while doc["loan_id"] in taken:
+                doc["loan_id"] = generate_loan_id()
+
+        try:
+            loan_requests_col.insert_many(docs, ordered=False)
+            return inserted + docs
+        except BulkWriteError as exc:
+            failed = {e["index"]: e for e in exc.details.get("writeErrors", [])}
+            retry, retry_lines = [], []
+            for index, (doc, line) in enumerate(zip(docs, lines)):
+                error = failed.get(index)
+                if error is None:
+                    inserted.append(doc)
+                elif error.get("code") == DUPLICATE_KEY:
+                    # Raced with another writer on the same ID; try again with a new one
+                    doc.pop("_id", None)
+                    doc["loan_id"] = generate_loan_id()
+                    retry.append(doc)
+                    retry_lines.append(line)
+                else:
+                    report.error(line, error.get("errmsg", "Insert failed"))
+            docs, lines = retry, retry_lines
+
+    for line in lines:
+        report.error(line, "Could not allocate a unique loan_id")
+    return inserted
+
+
+def _import_chunk(chunk, report, defaults, dry_run, organization_id=None):
+    lines = [line for line, _ in chunk]
+    rows = [row for _, row in chunk]
+
+    patient_ids = list({r["patient_id"] for r in rows})
+    if organization_id is not None:
+        patient_ids = shared_profiles_col.distinct(
+            "patient_id", {"organization_id": organization_id, "patient_id": {"$in": patient_ids}}
+        )
+    patients = {
+        p["patient_id"]: p for p in patients_col.find(
+            {"patient_id": {"$in": patient_ids}},
+            {"_id": 0, "patient_id": 1, "first_name": 1, "last_name": 1}
+        )
+    }
+    providers = {
+        p["loan_provider_id"] for p in loan_providers_col.find(
+            {"loan_provider_id": {"$in": list({r["loan_provider_id"] for r in rows})}},
+            {"_id": 0, "loan_provider_id": 1}
+        )
+    }
+
+    now = datetime.utcnow()
+    used_ids = set()
+    docs, doc_lines = [], []
+    for line, row, result in zip(lines, rows, score_loans(rows)):
+        if row["patient_id"] not in patients:
+            report.error(line, "Patient not found")
+            continue
+        if row["loan_provider_id"] not in providers:
+            report.error(line, "Loan provider not found")
+            continue
+        if result is None:
+            report.error(line, "Could not score loan")
+            continue
+
+        loan_id = generate_loan_id()
+        while loan_id in used_ids:
+            loan_id = generate_loan_id()
+        used_ids.add(loan_id)
+
+        risk, score = result
+        docs.append(build_loan_doc(patients[row["patient_id"]], {**defaults, **row}, risk, score, loan_id, now))
+        doc_lines.append(line)
+
+    if dry_run:
+        report.inserted += len(docs)
+        return
+
+    inserted = _insert_with_fresh_ids(docs, doc_lines, report)
+    report.inserted += len(inserted)
+
+    rollups = defaultdict(Counter)
+    for doc in inserted:
+        rollups[doc["loan_provider_id"]].update(loan_counter_keys(doc))
+    record_loans_changed(rollups)
+
+
+def import_loans(stream, fmt, defaults=None, chunk_size=IMPORT_CHUNK_SIZE, dry_run=False, organization_id=None):
+    """Import a CSV/NDJSON stream of loan applications. Returns the report dict.
+
+    `defaults` fills fields a row leaves out (e.g. hospital_name for a
+    hospital's own upload). With `organization_id`, only patients who shared
+    a profile with that organization can be filed for.
+    """
+    report = ImportReport()
+    defaults = defaults or {}
+    chunk = []
+
+    for line, row, parse_error in iter_rows(stream, fmt):
+        report.rows += 1
+        if parse_error:
+            report.error(line, parse_error)
+            continue
+        error = validate_row(row)
+        if error:
+            report.error(line, error)
+            continue
+        chunk.append((line, row))
+        if len(chunk) >= chunk_size:
+            _import_chunk(chunk, report, defaults, dry_run, organization_id)
+            chunk = []
+    if chunk:
+        _import_chunk(chunk, report, defaults, dry_run, organization_id)
+
+    return report.as_dict()
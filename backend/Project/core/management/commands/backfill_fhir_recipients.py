@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from core.db import fhir_patients_col, shared_profiles_col
+
+# FHIR documents written before recipients were denormalized onto them
+MISSING_RECIPIENTS = {"practitioner_id": {"$exists": False}}
+
+
+class Command(BaseCommand):
+    help = "Copy practitioner_id/organization_id from shared_profiles onto FHIR documents that lack them."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        updated = orphaned = 0
+
+        cursor = fhir_patients_col.find(MISSING_RECIPIENTS, {"_id": 0, "shared_id": 1}, batch_size=batch_size)
+        batch = []
+        for doc in cursor:
+            batch.append(doc["shared_id"])
+            if len(batch) >= batch_size:
+                done, missing = self._backfill(batch, options["dry_run"])
+                updated, orphaned = updated + done, orphaned + missing
+                batch = []
+        if batch:
+            done, missing = self._backfill(batch, options["dry_run"])
+            updated, orphaned = updated + done, orphaned + missing
+
+        verb = "Would update" if options["dry_run"] else "Updated"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {updated} FHIR document(s); {orphaned} had no shared profile"
+        ))
+
+    def _backfill(self, shared_ids, dry_run):
+        shares = {
+            s["shared_id"]: s
+            for s in shared_profiles_col.find(
+                {"shared_id": {"$in": shared_ids}},
+                {"_id": 0, "shared_id": 1, "practitioner_id": 1, "organization_id": 1}
+            )
+        }
+        ops = [
+            UpdateOne(
+                {"shared_id": shared_id, **MISSING_RECIPIENTS},
+                {"$set": {
+                    "practitioner_id": shares[shared_id].get("practitioner_id"),
+                    "organization_id": shares[shared_id].get("organization_id"),
+                }}
+            )
+            for shared_id in shared_ids if shared_id in shares
+        ]
+        if ops and not dry_run:
+            fhir_patients_col.bulk_write(ops, ordered=False)
+        return len(ops), len(shared_ids) - len(ops)
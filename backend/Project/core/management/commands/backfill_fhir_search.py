@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from core.db import fhir_patients_col
+from core.fhir_search import SEARCH_VERSION, search_fields
+
+# FHIR documents written before search fields existed, or by an older extractor
+STALE_SEARCH = {"search.v": {"$ne": SEARCH_VERSION}}
+
+
+class Command(BaseCommand):
+    help = "Extract FHIR search fields onto stored FHIR documents that lack them (or have an older version)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        updated = 0
+
+        cursor = fhir_patients_col.find(STALE_SEARCH, {"_id": 1, "fhir_resource": 1}, batch_size=batch_size)
+        batch = []
+        for doc in cursor:
+            batch.append(UpdateOne(
+                {"_id": doc["_id"]},
+                {"$set": {"search": search_fields(doc.get("fhir_resource") or {})}}
+            ))
+            if len(batch) >= batch_size:
+                updated += self._flush(batch, options["dry_run"])
+                batch = []
+        if batch:
+            updated += self._flush(batch, options["dry_run"])
+
+        verb = "Would update" if options["dry_run"] else "Updated"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {updated} FHIR document(s)"))
+
+    def _flush(self, ops, dry_run):
+        if not dry_run:
+            fhir_patients_col.bulk_write(ops, ordered=False)
+        return len(ops)
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from pymongo.errors import OperationFailure
+
+from core.indexes import INDEXES, ensure_indexes, explain_query_shapes
+
+
+class Command(BaseCommand):
+    help = "Create the MongoDB indexes the API relies on and verify no view query does a COLLSCAN."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--no-create", action="store_true", help="Only verify query plans")
+        parser.add_argument("--no-verify", action="store_true", help="Only create indexes")
+
+    def handle(self, *args, **options):
+        if not options["no_create"]:
+            try:
+                created = ensure_indexes()
+            except OperationFailure as exc:
+                # Typically a unique index over existing duplicate data
+                raise CommandError(f"Index creation failed: {exc}")
+            for collection, names in created.items():
+                self.stdout.write(f"{collection}: {', '.join(names)}")
+            self.stdout.write(self.style.SUCCESS(
+                f"Ensured {sum(len(m) for m in INDEXES.values())} index(es) on {len(INDEXES)} collection(s)"
+            ))
+
+        if options["no_verify"]:
+            return
+
+        scans = []
+        for view, collection, query, stages in explain_query_shapes():
+            verdict = "COLLSCAN" if "COLLSCAN" in stages else "ok"
+            self.stdout.write(f"  [{verdict}] {view}: {collection}.find({query}) -> {' > '.join(stages)}")
+            if verdict == "COLLSCAN":
+                scans.append(f"{view} ({collection})")
+
+        if scans:
+            raise CommandError("Queries still doing a COLLSCAN: " + ", ".join(scans))
+        self.stdout.write(self.style.SUCCESS("All view query shapes use an index"))
@@ -0,0 +1,53 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from core.fhir_convert import CONVERT_CHUNK_SIZE, convert_all, load_checkpoint
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert shares that have no FHIR bundle yet (or rebuild every bundle with --rebuild) "
+        "in parallel, resuming from the last checkpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rebuild", action="store_true", help="Rebuild bundles for every share, not just unconverted ones")
+        parser.add_argument("--chunk-size", type=int, default=CONVERT_CHUNK_SIZE)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=max((os.cpu_count() or 1) - 1, 0),
+            help="Build processes besides this one, which reads and writes (0 builds inline)",
+        )
+        parser.add_argument("--checkpoint", help="Checkpoint name (defaults to 'unconverted' or 'rebuild')")
+        parser.add_argument("--restart", action="store_true", help="Ignore an unfinished checkpoint and start over")
+        parser.add_argument("--dry-run", action="store_true", help="Build and compare without writing")
+
+    def handle(self, *args, **options):
+        name = options["checkpoint"] or ("rebuild" if options["rebuild"] else "unconverted")
+        saved = None if options["restart"] or options["dry_run"] else load_checkpoint(name)
+        if saved:
+            self.stdout.write(f"Resuming '{name}' after {saved['last_id']} ({saved['totals'].get('scanned', 0)} scanned)")
+
+        def progress(totals, seconds):
+            self.stdout.write(f"  {totals['scanned']} share(s), {totals['scanned'] / seconds if seconds else 0:.0f}/s")
+
+        totals = convert_all(
+            rebuild=options["rebuild"],
+            chunk_size=options["chunk_size"],
+            workers=options["workers"],
+            checkpoint=name,
+            restart=options["restart"],
+            dry_run=options["dry_run"],
+            progress=progress if options["verbosity"] > 1 else None,
+        )
+
+        seconds = totals["seconds"]
+        verb = "Would write" if options["dry_run"] else "Wrote"
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {totals['scanned']} share(s) in {seconds:.1f}s "
+            f"({totals['scanned'] / seconds if seconds else 0:.0f}/s); "
+            f"{verb} {totals['created']} new and {totals['updated']} changed bundle(s), "
+            f"{totals['unchanged']} unchanged, {totals['orphaned']} without a patient"
+        ))
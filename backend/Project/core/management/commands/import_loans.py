@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.loans import IMPORT_CHUNK_SIZE, IMPORT_FORMATS, detect_format, import_loans
+
+
+class Command(BaseCommand):
+    help = "Bulk import loan applications from a CSV or NDJSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=IMPORT_FORMATS, help="Defaults to the file extension")
+        parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+        parser.add_argument("--hospital-name", help="hospital_name for rows that leave it out")
+        parser.add_argument("--dry-run", action="store_true", help="Validate and score without inserting")
+        parser.add_argument("--report", help="Write the full JSON report to this file")
+
+    def handle(self, *args, **options):
+        fmt = options["format"] or detect_format(options["path"])
+        if fmt is None:
+            raise CommandError("Cannot tell the file format from its name; pass --format")
+
+        defaults = {"hospital_name": options["hospital_name"]} if options["hospital_name"] else {}
+        try:
+            with open(options["path"], "rb") as stream:
+                report = import_loans(
+                    stream, fmt, defaults=defaults,
+                    chunk_size=options["chunk_size"], dry_run=options["dry_run"]
+                )
+        except OSError as exc:
+            raise CommandError(str(exc))
+
+        for error in report["errors"][:20]:
+            self.stdout.write(f"  line {error['line']}: {error['error']}")
+        if report["failed"] > 20:
+            self.stdout.write(f"  ... {report['failed'] - 20} more")
+
+        if options["report"]:
+            with open(options["report"], "w") as out:
+                json.dump(report, out, indent=2)
+
+        verb = "Validated" if options["dry_run"] else "Inserted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {report['inserted']} of {report['rows']} row(s), {report['failed']} failed, "
+            f"in {report['seconds']}s ({report['rows_per_second']} rows/s)"
+        ))
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.profiling import MODES, profile_token
+
+
+class Command(BaseCommand):
+    help = "Print an X-Profile header that profiles the requests carrying it (see core/profiling.py)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mode", choices=MODES, default="sample", help="sample: stack sampling; trace: cProfile")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"X-Profile: {profile_token(options['mode'])}")
+        self.stderr.write(f"Valid for {settings.PROFILING_TOKEN_MAX_AGE} seconds; reports are listed at /api/profiles/")
@@ -0,0 +1,130 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from pymongo.errors import DuplicateKeyError
+
+from core.analytics import build_rollups, rollup_drift
+from core.db import loan_requests_col, loan_analytics_col
+
+# Only the fields that feed a rollup counter
+ROLLUP_PROJECTION = {
+    "_id": 0,
+    "loan_provider_id": 1,
+    "risk": 1,
+    "status": 1,
+    "hospital_location": 1,
+    "preferred_tenure": 1,
+    "age": 1,
+    "created_at": 1,
+}
+# Rescans of one provider whose rollup kept changing while it was being rebuilt
+REBUILD_ATTEMPTS = 5
+
+
+class Command(BaseCommand):
+    help = "Recompute per-provider loan analytics rollups from loan_requests and report drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--provider", help="Only rebuild this loan_provider_id")
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Report drift without writing; exit with an error if any rollup is off",
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        provider = options["provider"]
+        query = {"loan_provider_id": provider} if provider else {}
+
+        # Read before the scan, so an $inc that lands during it shows as a new version
+        stored = {
+            doc["loan_provider_id"]: doc
+            for doc in loan_analytics_col.find(query, {"_id": 0})
+        }
+        if not options["check"]:
+            # Loans created during the scan only reach a rollup that already exists
+            for provider_id in loan_requests_col.distinct("loan_provider_id", query):
+                if provider_id and provider_id not in stored:
+                    stored[provider_id] = create_placeholder(provider_id)
+
+        cursor = loan_requests_col.find(query, ROLLUP_PROJECTION, batch_size=options["batch_size"])
+        expected = build_rollups(cursor)
+
+        drifted = 0
+        for provider_id in sorted(set(expected) | set(stored)):
+            current = stored.get(provider_id)
+            drift = rollup_drift(current, expected.get(provider_id))
+            if not drift:
+                continue
+            drifted += 1
+            if current is None or current.get("placeholder"):
+                loans = expected.get(provider_id, {}).get("total", 0)
+                self.stdout.write(f"{provider_id}: no rollup document ({loans} loans)")
+                continue
+            self.stdout.write(f"{provider_id}: {len(drift)} counter(s) drifted")
+            for path, (have, want) in drift.items():
+                self.stdout.write(f"    {path}: stored={have} expected={want}")
+
+        if options["check"]:
+            if drifted:
+                raise CommandError(f"{drifted} provider rollup(s) drifted")
+            self.stdout.write(self.style.SUCCESS(f"{len(expected)} provider rollup(s) in sync"))
+            return
+
+        raced = [
+            provider_id for provider_id, counters in expected.items()
+            if not write_rollup(provider_id, counters, stored.get(provider_id))
+        ]
+        skipped = [provider_id for provider_id in raced if not rebuild_provider(provider_id)]
+        orphaned = set(stored) - set(expected)
+        if orphaned:
+            loan_analytics_col.delete_many({"loan_provider_id": {"$in": list(orphaned)}})
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {len(expected) - len(skipped)} provider rollup(s); {drifted} had drifted"
+        ))
+        if skipped:
+            raise CommandError(
+                f"Rollups kept changing during the rebuild, left as they were: {', '.join(skipped)}"
+            )
+
+
+def create_placeholder(provider_id):
+    """Insert an empty version-0 rollup for a provider that has none; returns the stored document."""
+    doc = {"loan_provider_id": provider_id, "version": 0, "placeholder": True, "updated_at": datetime.utcnow()}
+    try:
+        loan_analytics_col.insert_one(doc)
+    except DuplicateKeyError:
+        return loan_analytics_col.find_one({"loan_provider_id": provider_id}, {"_id": 0})
+    doc.pop("_id", None)
+    return doc
+
+
+def write_rollup(provider_id, counters, stored):
+    """Replace the rollup only if no $inc landed since `stored` was read. Returns whether it was written.
+
+    Without a stored rollup, a placeholder is created instead and False is
+    returned: loans created while `counters` were scanned never reached one,
+    so they have to be scanned again.
+    """
+    if stored is None:
+        create_placeholder(provider_id)
+        return False
+    version = stored.get("version")
+    doc = {"loan_provider_id": provider_id, **counters, "version": (version or 0) + 1, "updated_at": datetime.utcnow()}
+    # A missing version matches None, for documents written before versions existed
+    result = loan_analytics_col.replace_one({"loan_provider_id": provider_id, "version": version}, doc)
+    return result.matched_count == 1
+
+
+def rebuild_provider(provider_id):
+    """Rescan one provider's loans until its rollup holds still long enough to be replaced."""
+    for _ in range(REBUILD_ATTEMPTS):
+        stored = loan_analytics_col.find_one({"loan_provider_id": provider_id}, {"_id": 0})
+        counters = build_rollups(
+            loan_requests_col.find({"loan_provider_id": provider_id}, ROLLUP_PROJECTION)
+        ).get(provider_id)
+        if counters is None or write_rollup(provider_id, counters, stored):
+            return True
+    return False
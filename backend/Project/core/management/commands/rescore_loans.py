@@ -0,0 +1,100 @@
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from core.analytics import record_loans_changed, rollup_increments
+from core.db import loan_requests_col
+from core.risk import score_loans
+
+# Scoring inputs plus the fields the analytics rollups are keyed on
+RESCORE_PROJECTION = {
+    "loan_id": 1,
+    "loan_provider_id": 1,
+    "required_amount": 1,
+    "monthly_income": 1,
+    "preferred_tenure": 1,
+    "existing_loans": 1,
+    "insurance_available": 1,
+    "existing_insurance": 1,
+    "treatment_type": 1,
+    "risk": 1,
+    "risk_score": 1,
+    "status": 1,
+    "hospital_location": 1,
+    "age": 1,
+    "created_at": 1,
+}
+
+
+class Command(BaseCommand):
+    help = "Re-run the risk rules over stored loans in chunks and write back changed risk/risk_score."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=5000)
+        parser.add_argument("--provider", help="Only rescore loans for this loan_provider_id")
+        parser.add_argument("--dry-run", action="store_true", help="Score and report without writing")
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        query = {"loan_provider_id": options["provider"]} if options["provider"] else {}
+
+        totals = Counter()
+        transitions = Counter()
+        started = time.perf_counter()
+        scoring_seconds = 0.0
+
+        cursor = loan_requests_col.find(query, RESCORE_PROJECTION, batch_size=chunk_size)
+        chunk = []
+        for loan in cursor:
+            chunk.append(loan)
+            if len(chunk) >= chunk_size:
+                scoring_seconds += self._rescore(chunk, options["dry_run"], totals, transitions)
+                chunk = []
+        if chunk:
+            scoring_seconds += self._rescore(chunk, options["dry_run"], totals, transitions)
+
+        elapsed = time.perf_counter() - started
+        for (old, new), count in sorted(transitions.items()):
+            self.stdout.write(f"  {old} -> {new}: {count}")
+        verb = "Would update" if options["dry_run"] else "Updated"
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {totals['scanned']} loan(s) in {elapsed:.1f}s "
+            f"({totals['scanned'] / elapsed if elapsed else 0:.0f}/s, "
+            f"scoring {totals['scanned'] / scoring_seconds if scoring_seconds else 0:.0f}/s); "
+            f"{verb} {totals['changed']}; {totals['unscorable']} could not be scored"
+        ))
+
+    def _rescore(self, loans, dry_run, totals, transitions):
+        start = time.perf_counter()
+        results = score_loans(loans)
+        scoring = time.perf_counter() - start
+
+        now = datetime.utcnow()
+        ops = []
+        rollups = defaultdict(Counter)
+        for loan, result in zip(loans, results):
+            totals["scanned"] += 1
+            if result is None:
+                totals["unscorable"] += 1
+                continue
+            risk, score = result
+            if risk == loan.get("risk") and score == loan.get("risk_score"):
+                continue
+
+            totals["changed"] += 1
+            transitions[(loan.get("risk"), risk)] += 1
+            ops.append(UpdateOne(
+                {"_id": loan["_id"]},
+                {"$set": {"risk": risk, "risk_score": score, "rescored_at": now}}
+            ))
+            rollups[loan.get("loan_provider_id")].update(
+                rollup_increments(loan, {**loan, "risk": risk})
+            )
+
+        if ops and not dry_run:
+            loan_requests_col.bulk_write(ops, ordered=False)
+            record_loans_changed(rollups)
+        return scoring
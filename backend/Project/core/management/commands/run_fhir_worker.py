@@ -0,0 +1,81 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import fhir_export
+from core.fhir_queue import fail_exhausted_jobs, reconcile_unconverted, restart_dead_workers, start_workers
+
+logger = logging.getLogger("backend")
+
+# Seconds between checks that every worker thread is still alive
+SUPERVISE_INTERVAL = 5.0
+
+
+class Command(BaseCommand):
+    help = (
+        "Run background FHIR conversion workers fed by the fhir_conversion_jobs queue, "
+        "plus bulk $export workers fed by fhir_export_jobs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=4)
+        parser.add_argument("--export-threads", type=int, default=1, help="Bulk export workers (0 disables)")
+        parser.add_argument("--poll-interval", type=float, default=1.0)
+        parser.add_argument(
+            "--reconcile-every",
+            type=float,
+            default=60.0,
+            help=(
+                "Seconds between sweeps for exhausted jobs, unconverted shares without a job "
+                "and expired exports (0 disables)"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        poll_interval = options["poll_interval"]
+        stop_event, threads = start_workers(options["threads"], poll_interval)
+        _, export_threads = start_workers(
+            options["export_threads"],
+            poll_interval,
+            target=fhir_export.work,
+            name="fhir-export",
+            stop_event=stop_event,
+        )
+        self.stdout.write(
+            f"Started {len(threads)} FHIR conversion worker(s) "
+            f"and {len(export_threads)} export worker(s)"
+        )
+
+        reconcile_every = options["reconcile_every"]
+        next_sweep = time.monotonic()
+        try:
+            while True:
+                restart_dead_workers(threads, stop_event, poll_interval)
+                restart_dead_workers(export_threads, stop_event, poll_interval, target=fhir_export.work)
+                if reconcile_every and time.monotonic() >= next_sweep:
+                    self.sweep()
+                    next_sweep = time.monotonic() + reconcile_every
+                time.sleep(SUPERVISE_INTERVAL)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping workers...")
+        finally:
+            stop_event.set()
+            for thread in threads + export_threads:
+                thread.join()
+
+    def sweep(self):
+        # A failed sweep (Mongo briefly unreachable) is retried at the next one
+        try:
+            failed = fail_exhausted_jobs()
+            queued = reconcile_unconverted()
+            purged = fhir_export.purge_expired_exports()
+        except Exception:
+            logger.exception("FHIR worker sweep failed")
+            return
+        if failed:
+            self.stdout.write(f"Failed {failed} conversion job(s) that ran out of attempts")
+        if queued:
+            self.stdout.write(f"Reconciled {queued} unconverted share(s)")
+        if purged:
+            self.stdout.write(f"Purged {purged} expired export(s)")
@@ -0,0 +1,407 @@
+import contextvars
+import ipaddress
+import json
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from pymongo import monitoring
+
+# -----------------------
+# Request Metrics
+# -----------------------
+# MetricsMiddleware times every request per route (the URL pattern, so
+# /api/loan/provider/<loan_id>/ is one series) and records status codes and
+# response sizes. MongoCommandMetrics, registered on the Mongo clients in
+# core/db.py, attributes each command's count, duration and returned
+# documents to the request that issued it, through a context variable that
+# follows both threads and asyncio tasks. Streamed responses are measured
+# when the stream ends, so their getMores count too.
+#
+# GET /api/metrics renders everything in the Prometheus text format. The
+# numbers are per process: scrape each worker, or run one worker per target.
+#
+# The same listener fills any active `command_log`: the commands themselves,
+# in order and timed, for query budgets in tests (core/query_budget.py) and
+# profiling reports (core/profiling.py).
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COMMAND_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+NO_ROUTE = "(unmatched)"
+NO_REQUEST = "(none)"
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense (not thread-safe by itself)."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield _number(bound), total
+        yield "+Inf", total + self.counts[-1]
+
+
+class RequestStats:
+    """What one request did; merged into the registry once its route is known."""
+
+    __slots__ = ("route", "commands", "by_command", "documents", "bytes")
+
+    def __init__(self):
+        self.route = NO_ROUTE
+        self.commands = 0
+        self.by_command = defaultdict(lambda: [0, 0.0, 0])   # name -> [count, seconds, failures]
+        self.documents = 0
+        self.bytes = 0
+
+    def add_command(self, name, seconds, documents, failed):
+        totals = self.by_command[name]
+        totals[0] += 1
+        totals[1] += seconds
+        totals[2] += failed
+        self.commands += 1
+        self.documents += documents
+
+
+_current = contextvars.ContextVar("request_stats", default=None)
+_log = contextvars.ContextVar("command_log", default=None)
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = defaultdict(int)                                  # (route, method, status)
+            self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))    # route
+            self.sizes = defaultdict(lambda: Histogram(SIZE_BUCKETS))         # route
+            self.per_request = defaultdict(lambda: Histogram(COMMAND_BUCKETS))  # route
+            self.commands = defaultdict(int)                                  # (route, command)
+            self.command_seconds = defaultdict(float)                         # (route, command)
+            self.documents = defaultdict(int)                                 # route
+            self.command_failures = defaultdict(int)                          # (route, command)
+
+    def record_request(self, stats, method, status, seconds):
+        route = stats.route
+        with self._lock:
+            self.requests[(route, method, str(status))] += 1
+            self.latency[route].observe(seconds)
+            self.sizes[route].observe(stats.bytes)
+            self.per_request[route].observe(stats.commands)
+            for command, (count, command_seconds, failures) in stats.by_command.items():
+                self._add_command(route, command, count, command_seconds, failures)
+            self.documents[route] += stats.documents
+
+    def record_command(self, route, command, seconds, documents, failed=False):
+        with self._lock:
+            self._add_command(route, command, 1, seconds, int(failed))
+            self.documents[route] += documents
+
+    def _add_command(self, route, command, count, seconds, failures):
+        self.commands[(route, command)] += count
+        self.command_seconds[(route, command)] += seconds
+        if failures:
+            self.command_failures[(route, command)] += failures
+
+    def render(self):
+        with self._lock:
+            lines = []
+            _counter(lines, "http_requests_total", "Requests by route, method and status.",
+                     (({"route": r, "method": m, "status": s}, v) for (r, m, s), v in self.requests.items()))
+            _histogram(lines, "http_request_duration_seconds", "Request latency by route.", self.latency)
+            _histogram(lines, "http_response_size_bytes", "Response body size by route.", self.sizes)
+            _histogram(lines, "mongo_commands_per_request", "Mongo commands issued per request, by route.",
+                       self.per_request)
+            _counter(lines, "mongo_commands_total", "Mongo commands by route and command name.",
+                     (({"route": r, "command": c}, v) for (r, c), v in self.commands.items()))
+            _counter(lines, "mongo_command_duration_seconds_total", "Time in Mongo commands by route and command name.",
+                     (({"route": r, "command": c}, v) for (r, c), v in self.command_seconds.items()))
+            _counter(lines, "mongo_command_failures_total", "Failed Mongo commands by route and command name.",
+                     (({"route": r, "command": c}, v) for (r, c), v in self.command_failures.items()))
+            _counter(lines, "mongo_documents_returned_total", "Documents returned by cursor commands, by route.",
+                     (({"route": r}, v) for r, v in self.documents.items()))
+        return lines
+
+
+registry = MetricsRegistry()
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _counter(lines, name, help_text, samples, kind="counter"):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+
+def _histogram(lines, name, help_text, histograms):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for route, histogram in histograms.items():
+        for bound, count in histogram.samples():
+            lines.append(f"{name}_bucket{_labels({'route': route, 'le': bound})} {count}")
+        lines.append(f"{name}_sum{_labels({'route': route})} {_number(histogram.sum)}")
+        lines.append(f"{name}_count{_labels({'route': route})} {sum(histogram.counts)}")
+
+
+# -----------------------
+# Mongo Command Listener
+# -----------------------
+
+def _returned(reply):
+    cursor = reply.get("cursor") if isinstance(reply, dict) else None
+    if not cursor:
+        return 0
+    return len(cursor.get("firstBatch") or cursor.get("nextBatch") or ())
+
+
+# Command field that holds the filter, per command name
+FILTER_FIELDS = {
+    "find": "filter",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+}
+
+
+def _shape(value):
+    """A filter with its values masked, so descriptions are stable across runs."""
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in value:
+            shape = _shape(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return "?"
+
+
+def describe_command(name, command):
+    """One line for a Mongo command: '<command> <collection> <masked filter>'."""
+    collection = command.get("collection") if name == "getMore" else command.get(name)
+    if name in FILTER_FIELDS:
+        detail = _shape(command.get(FILTER_FIELDS[name]) or {})
+    elif name == "aggregate":
+        detail = [next(iter(stage), "?") for stage in command.get("pipeline", [])]
+    elif name in ("update", "delete"):
+        detail = [_shape(op.get("q", {})) for op in command.get(name + "s", [])]
+    elif name == "insert":
+        detail = f"{len(command.get('documents', []))} document(s)"
+    else:
+        detail = None
+    line = f"{name} {collection}" if isinstance(collection, str) else name
+    if detail is not None:
+        line += " " + (detail if isinstance(detail, str) else json.dumps(detail, separators=(",", ":")))
+    return line
+
+
+class CommandLog:
+    """The commands issued while it is active, in order: offset, description, duration."""
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.entries = []
+        self._pending = {}
+
+    def started(self, event):
+        entry = {
+            "at": time.perf_counter() - self.start,
+            "command": describe_command(event.command_name, event.command),
+            "seconds": None,
+            "failed": False,
+        }
+        self.entries.append(entry)
+        self._pending[(event.request_id, event.connection_id)] = entry
+        if self.parent is not None:
+            self.parent.started(event)
+
+    def finished(self, event, failed):
+        entry = self._pending.pop((event.request_id, event.connection_id), None)
+        if entry is not None:
+            entry["seconds"] = event.duration_micros / 1e6
+            entry["failed"] = failed
+        if self.parent is not None:
+            self.parent.finished(event, failed)
+
+
+@contextmanager
+def command_log():
+    """Log the Mongo commands issued inside the block (nested logs see them too)."""
+    log = CommandLog(_log.get())
+    token = _log.set(log)
+    try:
+        yield log
+    finally:
+        _log.reset(token)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+
+    def started(self, event):
+        log = _log.get()
+        if log is not None:
+            log.started(event)
+
+    def succeeded(self, event):
+        self._record(event, _returned(event.reply), failed=False)
+
+    def failed(self, event):
+        self._record(event, 0, failed=True)
+
+    def _record(self, event, documents, failed):
+        log = _log.get()
+        if log is not None:
+            log.finished(event, failed)
+        seconds = event.duration_micros / 1e6
+        stats = _current.get()
+        if stats is not None:
+            stats.add_command(event.command_name, seconds, documents, failed)
+        else:
+            # Workers, management commands, anything outside a request
+            registry.record_command(NO_REQUEST, event.command_name, seconds, documents, failed)
+
+
+command_metrics = MongoCommandMetrics()
+
+
+# -----------------------
+# Middleware
+# -----------------------
+
+def request_route(request):
+    match = getattr(request, "resolver_match", None)
+    return "/" + match.route if match is not None and match.route else NO_ROUTE
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, stats, start)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, stats, start)
+
+    def _finish(self, request, response, stats, start):
+        stats.route = request_route(request)
+        if response.streaming and not response.is_async:
+            response.streaming_content = self._measure_stream(
+                response.streaming_content, request, response.status_code, stats, start
+            )
+            return response
+        if not response.streaming:
+            stats.bytes = len(response.content)
+        registry.record_request(stats, request.method, response.status_code, time.perf_counter() - start)
+        return response
+
+    def _measure_stream(self, content, request, status, stats, start):
+        chunks = iter(content)
+        try:
+            while True:
+                # Attribute the cursor's getMores to this request while it streams
+                token = _current.set(stats)
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+                finally:
+                    _current.reset(token)
+                stats.bytes += len(chunk)
+                yield chunk
+        finally:
+            registry.record_request(stats, request.method, status, time.perf_counter() - start)
+
+
+# -----------------------
+# Exposition
+# -----------------------
+
+def _allowed(request):
+    try:
+        address = ipaddress.ip_address(request.META.get("REMOTE_ADDR", ""))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(net) for net in settings.METRICS_ALLOWED_NETWORKS)
+
+
+def _process_gauges():
+    from .db import pool_stats
+    from .entity_cache import cache_stats
+
+    lines = []
+    pool = pool_stats.snapshot()
+    for key in ("open", "checked_out", "max_checked_out", "waiting", "max_waiting"):
+        _counter(lines, f"mongo_pool_{key}", f"Connection pool {key.replace('_', ' ')}.", [({}, pool[key])], "gauge")
+    for key in ("created", "closed", "checkouts", "checkout_failures", "pool_clears"):
+        name = key.removeprefix("pool_")
+        _counter(lines, f"mongo_pool_{name}_total", f"Connection pool {name.replace('_', ' ')}.", [({}, pool[key])])
+
+    cache = cache_stats()
+    _counter(lines, "entity_cache_size", "Cached role documents.", [({}, cache["size"])], "gauge")
+    for key in ("hits", "shared_hits", "misses", "evictions"):
+        _counter(lines, f"entity_cache_{key}_total", f"Entity cache {key.replace('_', ' ')}.", [({}, cache[key])])
+    return lines
+
+
+def metrics_view(request):
+    """Prometheus scrape target; 404 outside METRICS_ALLOWED_NETWORKS."""
+    if not _allowed(request):
+        raise Http404
+    body = "\n".join(registry.render() + _process_gauges()) + "\n"
+    return HttpResponse(body, content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,144 @@
+import base64
+import json
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import DESCENDING
+from rest_framework.response import Response
+
+from .streaming import stream_cursor, wants_stream
+
+# -----------------------
+# Keyset (Cursor) Pagination
+# -----------------------
+# Opt-in: list endpoints keep returning a plain list unless the client sends
+# `limit` or `cursor`. Pages are ordered newest first on (sort_field, _id), so
+# each page is one indexed range scan no matter how deep the client pages.
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+class InvalidPage(ValueError):
+    pass
+
+
+def wants_page(params):
+    return "limit" in params or "cursor" in params
+
+
+def encode_cursor(value, _id):
+    payload = {"v": value.isoformat() if isinstance(value, datetime) else value, "id": str(_id)}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        value = payload["v"]
+        if value is not None:
+            value = datetime.fromisoformat(value)
+        return value, ObjectId(payload["id"])
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise InvalidPage("Invalid cursor")
+
+
+def parse_limit(params):
+    raw = params.get("limit", DEFAULT_LIMIT)
+    try:
+        limit = int(raw)
+    except (TypeError, ValueError):
+        raise InvalidPage("limit must be an integer")
+    if limit < 1:
+        raise InvalidPage("limit must be positive")
+    return min(limit, MAX_LIMIT)
+
+
+def after_cursor(sort_field, value, _id):
+    """Filter for documents that sort after (value, _id) in descending order."""
+    same_value = {sort_field: value, "_id": {"$lt": _id}}
+    if value is None:
+        # Missing sort values sort last; only other missing values can follow
+        return same_value
+    return {"$or": [
+        {sort_field: {"$lt": value}},
+        same_value,
+        {sort_field: None},
+    ]}
+
+
+def _page_projection(projection, sort_field):
+    projection = dict(projection or {})
+    projection.pop("_id", None)
+    if any(projection.values()):
+        # Inclusion projection: make sure the keyset fields come back
+        projection[sort_field] = 1
+    return projection or None
+
+
+def _page_find(query, projection, sort_field, cursor):
+    if cursor:
+        query = {"$and": [query, after_cursor(sort_field, *decode_cursor(cursor))]}
+    return query, _page_projection(projection, sort_field)
+
+
+def _page_sort(sort_field):
+    return [(sort_field, DESCENDING), ("_id", DESCENDING)]
+
+
+def _finish_page(docs, projection, sort_field, limit):
+    requested = set(k for k, v in (projection or {}).items() if v)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        next_cursor = encode_cursor(last.get(sort_field), last["_id"])
+
+    for doc in docs:
+        doc.pop("_id", None)
+        if requested and sort_field not in requested:
+            doc.pop(sort_field, None)
+
+    return {"results": docs, "next_cursor": next_cursor}
+
+
+def keyset_page(col, query, projection, sort_field, limit, cursor=None):
+    """Return ({"results": [...], "next_cursor": str | None}) for one page."""
+    find_query, find_projection = _page_find(query, projection, sort_field, cursor)
+    docs = list(
+        col.find(find_query, find_projection)
+        .sort(_page_sort(sort_field))
+        .limit(limit + 1)
+    )
+    return _finish_page(docs, projection, sort_field, limit)
+
+
+async def async_keyset_page(col, query, projection, sort_field, limit, cursor=None):
+    """keyset_page for an async (AsyncMongoClient) collection."""
+    find_query, find_projection = _page_find(query, projection, sort_field, cursor)
+    docs = await (
+        col.find(find_query, find_projection)
+        .sort(_page_sort(sort_field))
+        .limit(limit + 1)
+        .to_list()
+    )
+    return _finish_page(docs, projection, sort_field, limit)
+
+
+def list_or_page(request, col, query, projection, sort_field):
+    """Full list for legacy clients, one keyset page when `limit`/`cursor` is sent,
+    or an NDJSON stream when the view allows it and the client asks for one."""
+    if wants_stream(request):
+        return stream_cursor(request, col, query, projection)
+    if not wants_page(request.query_params):
+        return Response(list(col.find(query, projection)))
+    try:
+        limit = parse_limit(request.query_params)
+        return Response(keyset_page(
+            col, query, projection, sort_field, limit, request.query_params.get("cursor")
+        ))
+    except InvalidPage as exc:
+        return Response({"error": str(exc)}, status=400)
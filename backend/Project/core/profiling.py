@@ -0,0 +1,451 @@
+import cProfile
+import itertools
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+from datetime import datetime
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core import signing
+from django.http import HttpResponse
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import APIException
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+from .authentication import ClaimsJWTAuthentication
+from .metrics import command_log, request_route
+
+logger = logging.getLogger("backend")
+
+# -----------------------
+# On-Demand Profiling
+# -----------------------
+# ProfilingMiddleware profiles a single request when it carries an X-Profile
+# header signed with SECRET_KEY (`manage.py profile_token`), or a `_profile`
+# query parameter and a staff user's token. Mode "sample" (the default) reads
+# the request thread's stack every PROFILING_SAMPLE_INTERVAL seconds and keeps
+# the stacks in collapsed form, ready for flamegraph.pl or speedscope. Mode
+# "trace" runs cProfile instead and keeps per-function times with their
+# callers. Both record the top allocations with tracemalloc and a timeline of
+# the Mongo commands (metrics.command_log).
+#
+# tracemalloc is process-wide: allocations made meanwhile by other requests
+# (or any other thread) land in the report too. Reports say so in
+# "memory_scope" and count the requests that overlapped the profiled one in
+# "overlapping_requests"; only with 0 are the allocations this request's own.
+#
+# Reports are JSON files in PROFILING_REPORT_DIR, listed by GET /api/profiles/
+# for staff. A request without either flag costs one header and one query
+# string lookup. One request per process is profiled at a time; flags that
+# arrive meanwhile are ignored. Only the view runs under the profiler: a
+# streamed body is produced later, and work an async view hands to a thread
+# pool is not sampled.
+
+PROFILE_HEADER = "HTTP_X_PROFILE"
+PROFILE_PARAM = "_profile"
+MODES = ("sample", "trace")
+SIGNING_SALT = "core.profiling"
+TOP_FUNCTIONS = 50
+TOP_CALLERS = 5
+TOP_ALLOCATIONS = 25
+TRACEMALLOC_FRAMES = 10
+SUMMARY_FIELDS = (
+    "id", "created_at", "method", "path", "route", "status", "mode", "seconds", "mongo_commands",
+    "overlapping_requests",
+)
+
+_REPORT_ID = re.compile(r"^\d{8}T\d{6}-[0-9a-f]{8}$")
+_slot = threading.Lock()
+
+
+class InFlight:
+    """Requests running in this process, counted without a lock.
+
+    next() on an itertools.count is atomic under the GIL, so every request
+    pays two of them and nothing else. Reading goes through next() too: each
+    read counts as one request entering and leaving, which cancels out.
+    """
+
+    def __init__(self):
+        self._entered = itertools.count()
+        self._left = itertools.count()
+
+    def enter(self):
+        next(self._entered)
+
+    def leave(self):
+        next(self._left)
+
+    def snapshot(self):
+        """(requests entered so far, requests running now)."""
+        entered = next(self._entered)
+        return entered, entered - next(self._left)
+
+
+in_flight = InFlight()
+
+
+def profile_token(mode="sample"):
+    """X-Profile header value, valid for PROFILING_TOKEN_MAX_AGE seconds."""
+    return signing.TimestampSigner(salt=SIGNING_SALT).sign(mode)
+
+
+def _header_mode(request):
+    value = request.META.get(PROFILE_HEADER)
+    if not value:
+        return None
+    try:
+        mode = signing.TimestampSigner(salt=SIGNING_SALT).unsign(value, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    return mode if mode in MODES else None
+
+
+def _param_mode(request, auth):
+    """Mode asked for by ?_profile=, honoured for staff only. Views never see the parameter."""
+    value = request.GET.get(PROFILE_PARAM)
+    request.GET = request.GET.copy()
+    del request.GET[PROFILE_PARAM]
+    if auth is None or not auth[0].is_staff:
+        return None
+    return value if value in MODES else "sample"
+
+
+def _authenticate(request):
+    try:
+        return ClaimsJWTAuthentication().authenticate(request)
+    except APIException:
+        return None
+
+
+async def _aauthenticate(request):
+    try:
+        return await ClaimsJWTAuthentication().aauthenticate(request)
+    except APIException:
+        return None
+
+
+# -----------------------
+# Profilers
+# -----------------------
+
+def _short(filename):
+    _, sep, tail = filename.rpartition("site-packages" + os.sep)
+    if sep:
+        return tail
+    base = str(settings.BASE_DIR) + os.sep
+    return filename[len(base):] if filename.startswith(base) else filename
+
+
+def _label(func):
+    filename, line, name = func
+    return name if filename == "~" else f"{name} ({_short(filename)}:{line})"
+
+
+class StackSampler:
+    """Samples one thread's Python stack from a background thread."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({_short(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+
+def _functions(profile):
+    stats = pstats.Stats(profile).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_FUNCTIONS]
+    return [
+        {
+            "function": _label(func),
+            "calls": calls,
+            "primitive_calls": primitive,
+            "own_seconds": own,
+            "cumulative_seconds": cumulative,
+            "callers": [
+                {"function": _label(caller), "calls": totals[1], "cumulative_seconds": totals[3]}
+                for caller, totals in sorted(callers.items(), key=lambda item: item[1][3], reverse=True)[:TOP_CALLERS]
+            ],
+        }
+        for func, (primitive, calls, own, cumulative, callers) in rows
+    ]
+
+
+def _allocations(snapshot, baseline):
+    # Not the profiler's own bookkeeping or the sampler thread
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, threading.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+    if baseline is None:
+        stats = snapshot.statistics("traceback")
+    else:
+        stats = [stat for stat in snapshot.compare_to(baseline, "traceback") if stat.size_diff > 0]
+    return [
+        {
+            "size": getattr(stat, "size_diff", stat.size),
+            "count": getattr(stat, "count_diff", stat.count),
+            # Allocation site first
+            "traceback": [f"{_short(frame.filename)}:{frame.lineno}" for frame in reversed(stat.traceback)],
+        }
+        for stat in stats[:TOP_ALLOCATIONS]
+    ]
+
+
+class RequestProfiler:
+    """Profiles the code between start() and stop() on the calling thread."""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.sampler = None
+        self.profile = None
+
+    def start(self):
+        self._stack = ExitStack()
+        self.log = self._stack.enter_context(command_log())
+        # Under PYTHONTRACEMALLOC only the growth during the request is reported
+        self._baseline = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        if self._baseline is None:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        tracemalloc.reset_peak()
+        # Called from inside a request, so that one is not counted
+        self._entered, running = in_flight.snapshot()
+        self._overlapping = running - 1
+        if self.mode == "trace":
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            self.sampler = StackSampler(threading.get_ident(), settings.PROFILING_SAMPLE_INTERVAL)
+            self.sampler.start()
+        self._started = time.perf_counter()
+
+    def stop(self):
+        self.seconds = time.perf_counter() - self._started
+        if self.profile is not None:
+            self.profile.disable()
+        if self.sampler is not None:
+            self.sampler.stop()
+        self._stack.close()
+        snapshot = tracemalloc.take_snapshot()
+        self.peak = tracemalloc.get_traced_memory()[1]
+        entered, _ = in_flight.snapshot()
+        # Less the snapshot taken in start()
+        self.overlapping = self._overlapping + entered - self._entered - 1
+        if self._baseline is None:
+            tracemalloc.stop()
+        self.allocations = _allocations(snapshot, self._baseline)
+
+    def report(self, request, response):
+        now = datetime.utcnow()
+        report = {
+            "id": f"{now:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}",
+            "created_at": now.isoformat(timespec="seconds") + "Z",
+            "method": request.method,
+            "path": request.get_full_path(),
+            "route": request_route(request),
+            "status": response.status_code,
+            "mode": self.mode,
+            "seconds": self.seconds,
+            "mongo_commands": len(self.log.entries),
+            "mongo": [
+                {
+                    "at_ms": round(entry["at"] * 1000, 3),
+                    "command": entry["command"],
+                    "ms": None if entry["seconds"] is None else round(entry["seconds"] * 1000, 3),
+                    "failed": entry["failed"],
+                }
+                for entry in self.log.entries
+            ],
+            "memory_scope": "process",
+            "overlapping_requests": self.overlapping,
+            "memory_peak_bytes": self.peak,
+            "allocations": self.allocations,
+        }
+        if self.sampler is not None:
+            report["samples"] = sum(self.sampler.stacks.values())
+            report["stacks"] = [f"{stack} {count}" for stack, count in self.sampler.stacks.most_common()]
+        else:
+            report["functions"] = _functions(self.profile)
+        return report
+
+
+# -----------------------
+# Report Storage
+# -----------------------
+
+def _report_path(report_id):
+    return os.path.join(settings.PROFILING_REPORT_DIR, f"{report_id}.json")
+
+
+def save_report(report):
+    """Write a report, dropping the oldest beyond PROFILING_MAX_REPORTS."""
+    os.makedirs(settings.PROFILING_REPORT_DIR, exist_ok=True)
+    path = _report_path(report["id"])
+    with open(path + ".part", "w") as out:
+        json.dump(report, out, default=str)
+    os.replace(path + ".part", path)
+
+    names = sorted(name for name in os.listdir(settings.PROFILING_REPORT_DIR) if name.endswith(".json"))
+    for name in names[:-settings.PROFILING_MAX_REPORTS]:
+        try:
+            os.remove(os.path.join(settings.PROFILING_REPORT_DIR, name))
+        except FileNotFoundError:
+            pass
+
+
+def load_report(report_id):
+    if not _REPORT_ID.match(report_id):
+        return None
+    try:
+        with open(_report_path(report_id)) as source:
+            return json.load(source)
+    except FileNotFoundError:
+        return None
+
+
+def list_reports():
+    """Report summaries, newest first."""
+    try:
+        names = sorted(os.listdir(settings.PROFILING_REPORT_DIR), reverse=True)
+    except FileNotFoundError:
+        return []
+    summaries = []
+    for name in names:
+        report = load_report(name.removesuffix(".json")) if name.endswith(".json") else None
+        if report is not None:
+            summaries.append({field: report.get(field) for field in SUMMARY_FIELDS})
+    return summaries
+
+
+# -----------------------
+# Middleware
+# -----------------------
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        in_flight.enter()
+        try:
+            return self._profile(request)
+        finally:
+            in_flight.leave()
+
+    def _profile(self, request):
+        mode = _header_mode(request)
+        if mode is None and PROFILE_PARAM in request.GET:
+            mode = _param_mode(request, _authenticate(request))
+        if mode is None or not _slot.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            profiler = RequestProfiler(mode)
+            profiler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.stop()
+            return self._finish(request, response, profiler)
+        finally:
+            _slot.release()
+
+    async def __acall__(self, request):
+        in_flight.enter()
+        try:
+            return await self._aprofile(request)
+        finally:
+            in_flight.leave()
+
+    async def _aprofile(self, request):
+        mode = _header_mode(request)
+        if mode is None and PROFILE_PARAM in request.GET:
+            mode = _param_mode(request, await _aauthenticate(request))
+        if mode is None or not _slot.acquire(blocking=False):
+            return await self.get_response(request)
+        try:
+            profiler = RequestProfiler(mode)
+            profiler.start()
+            try:
+                response = await self.get_response(request)
+            finally:
+                profiler.stop()
+            return self._finish(request, response, profiler)
+        finally:
+            _slot.release()
+
+    def _finish(self, request, response, profiler):
+        report = profiler.report(request, response)
+        try:
+            save_report(report)
+        except OSError as exc:
+            logger.error("Could not save profile report %s: %s", report["id"], exc)
+            return response
+        response["X-Profile-Id"] = report["id"]
+        return response
+
+
+# -----------------------
+# Report Endpoints
+# -----------------------
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def profile_reports(request):
+    return Response(list_reports())
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def profile_report(request, report_id):
+    report = load_report(report_id)
+    if report is None:
+        return Response({"error": "Report not found"}, status=404)
+    return Response(report)
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def profile_flamegraph(request, report_id):
+    # Collapsed stacks: flamegraph.pl input, or drop the file on speedscope.app
+    report = load_report(report_id)
+    if report is None or "stacks" not in report:
+        return Response({"error": "Report not found"}, status=404)
+    return HttpResponse("\n".join(report["stacks"]) + "\n", content_type="text/plain; charset=utf-8")
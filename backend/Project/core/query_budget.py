@@ -0,0 +1,110 @@
+import difflib
+from collections import Counter
+from contextlib import contextmanager
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .db import event_listeners
+from .metrics import command_log, command_metrics
+
+# -----------------------
+# Query Budgets
+# -----------------------
+# Test utility against query-count regressions: `capture_queries` records
+# every Django SQL query and every Mongo command issued inside the block, the
+# latter through metrics.command_log (so METRICS_ENABLED must be on).
+# QUERY_BUDGETS declares, per route, how much SQL one request may run and
+# which Mongo commands it is expected to send.
+# `assert_within_budget` fails when a request runs more SQL than budgeted or
+# sends any Mongo command the budget does not list (a swapped collection or
+# command fails even at the same count), with a diff of the expected commands
+# against the issued ones, followed by every issued command and SQL statement.
+#
+# Budgets are for a cold request: caches cleared, token carrying its claims.
+# Warm requests only ever issue fewer queries.
+
+
+class Budget:
+    """Most SQL queries a request may run, and the Mongo commands it is expected to send."""
+
+    def __init__(self, sql=0, mongo=()):
+        self.sql = sql
+        self.mongo = list(mongo)   # "<command> <collection>", in order
+
+
+# Route, as the metrics label it -> Budget
+QUERY_BUDGETS = {
+    "/api/auth/login/": Budget(sql=1, mongo=["find patients"]),
+    # Authenticated routes: one SQL query for the token version, nothing for the user
+    "/api/profile/": Budget(sql=1, mongo=["find patients"]),
+    "/api/patient/shared-profiles/": Budget(sql=1, mongo=["find shared_profiles"]),
+    "/api/patient/fhir-profiles/": Budget(sql=1, mongo=["find fhir_patients"]),
+    "/api/loan/provider/analytics/": Budget(sql=1, mongo=["find loan_provider_analytics"]),
+    "/api/loan/provider/requests/": Budget(sql=1, mongo=["find loan_requests"]),
+    "/api/loan/provider/<str:loan_id>/": Budget(sql=1, mongo=["find loan_requests"]),
+}
+
+
+class CapturedQueries:
+    """What ran inside capture_queries: SQL statements and Mongo command lines."""
+
+    def __init__(self):
+        self.sql = []
+        self.mongo = []
+
+    @property
+    def mongo_keys(self):
+        """'<command> <collection>' per command, as Budget.mongo lists them."""
+        return [" ".join(line.split(" ", 2)[:2]) for line in self.mongo]
+
+
+@contextmanager
+def capture_queries():
+    if command_metrics not in event_listeners():
+        raise ImproperlyConfigured("capture_queries needs METRICS_ENABLED for the Mongo command listener")
+    captured = CapturedQueries()
+    with command_log() as log, CaptureQueriesContext(connection) as sql:
+        yield captured
+    captured.sql = [query["sql"] for query in sql.captured_queries]
+    captured.mongo = [entry["command"] for entry in log.entries]
+
+
+def budget_report(label, captured, budget):
+    """Failure message for a capture over `budget`; None when within it."""
+    over_sql = len(captured.sql) > budget.sql
+    # Issued commands beyond the budgeted ones, counting repeats
+    unexpected = Counter(captured.mongo_keys) - Counter(budget.mongo)
+    over_mongo = bool(unexpected)
+    if not over_sql and not over_mongo:
+        return None
+
+    lines = [
+        f"{label} exceeded its query budget: "
+        f"{len(captured.sql)} SQL (budget {budget.sql}), "
+        f"{len(captured.mongo)} Mongo (budget {len(budget.mongo)})",
+    ]
+    if over_mongo:
+        lines.extend(difflib.unified_diff(
+            budget.mongo, captured.mongo_keys, "budget", "issued", lineterm="", n=len(budget.mongo)
+        ))
+    lines.append("Mongo commands:")
+    lines.extend(f"  {number}. {line}" for number, line in enumerate(captured.mongo, start=1))
+    lines.append("SQL queries:")
+    lines.extend(f"  {number}. {sql}" for number, sql in enumerate(captured.sql, start=1))
+    return "\n".join(lines)
+
+
+def assert_within_budget(label, captured, budget):
+    report = budget_report(label, captured, budget)
+    if report:
+        raise AssertionError(report)
+
+
+@contextmanager
+def query_budget(route, label=None):
+    """Capture the block and assert it stays within QUERY_BUDGETS[route]."""
+    with capture_queries() as captured:
+        yield captured
+    assert_within_budget(label or route, captured, QUERY_BUDGETS[route])
@@ -0,0 +1,75 @@
+import orjson
+from bson import Decimal128, ObjectId
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# -----------------------
+# orjson Renderer / Parser
+# -----------------------
+# Drop-in replacements for DRF's JSONRenderer / JSONParser (the project
+# defaults, see REST_FRAMEWORK in settings). Output is byte-for-byte what
+# JSONRenderer produces with the default COMPACT/UNICODE/STRICT settings:
+# datetimes, dates and times go through DRF's own encoder (millisecond
+# precision, "Z" for UTC), and so does anything else orjson does not know.
+# ObjectId renders as its hex string and Decimal128 like Decimal (a number);
+# DRF's encoder rejects both.
+#
+# Known differences, both still valid JSON with the same value:
+#   * floats >= 1e16 or < 1e-4 in magnitude: orjson writes 1e16 / 0.00001,
+#     json writes 1e+16 / 1e-05
+#   * NaN / Infinity render as null instead of raising
+# Integers outside 64 bits, and pretty-printed (indent) responses, fall back
+# to JSONRenderer.
+
+DUMPS_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+_drf_default = JSONEncoder().default
+
+
+def _default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, Decimal128):
+        return float(obj.to_decimal())
+    return _drf_default(obj)
+
+
+def dumps(data):
+    """orjson encoding with JSONRenderer's output (see module comment)."""
+    # JSONRenderer escapes these two: they are valid JSON but end lines in JavaScript
+    return (
+        orjson.dumps(data, default=_default, option=DUMPS_OPTIONS)
+        .replace(b"\xe2\x80\xa8", b"\\u2028")
+        .replace(b"\xe2\x80\xa9", b"\\u2029")
+    )
+
+
+class ORJSONRenderer(JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if self.get_indent(accepted_media_type or "", renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            return dumps(data)
+        except orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bits, which the stdlib encoder handles
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class ORJSONParser(JSONParser):
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        body = stream.read() if stream is not None else b""
+        try:
+            if encoding.lower().replace("-", "") != "utf8":
+                body = body.decode(encoding)
+            return orjson.loads(body)
+        except (orjson.JSONDecodeError, UnicodeDecodeError) as exc:
+            raise ParseError(f"JSON parse error - {exc}")
@@ -0,0 +1,163 @@
+import numpy as np
+
+# -----------------------
+# Risk Calculation Engine
+# -----------------------
+
+HIGH_RISK_TREATMENTS = ["surgery", "emergency", "dialysis"]
+
+
+def calculate_risk_score(data):
+    score = 0
+
+    required_amount = int(data.get("required_amount", 0))
+    income = int(data.get("monthly_income", 0))
+    tenure = int(data.get("preferred_tenure", 1)) # avoid div by zero
+
+    # EMI Calculation
+    emi = required_amount / tenure
+
+    # Income vs Loan Amount (EMI)
+    if emi > income * 0.5:
+        score += 40
+    elif emi > income * 0.3:
+        score += 20
+
+    # Existing Loans
+    if data.get("existing_loans") == "yes":
+        score += 20
+
+    # Insurance
+    if data.get("insurance_available") == "no" or data.get("existing_insurance") == "no":
+        score += 15
+
+    # Tenure
+    if tenure >= 36:
+        score += 20
+    elif tenure >= 24:
+        score += 10
+
+    # Treatment Type
+    treatment = data.get("treatment_type", "").lower()
+    if any(word in treatment for word in HIGH_RISK_TREATMENTS):
+        score += 15
+    else:
+        score += 5
+
+    # Final Risk Decision
+    if score > 60:
+        return "HIGH", score
+    elif score > 30:
+        return "MEDIUM", score
+    else:
+        return "LOW", score
+
+
+# -----------------------
+# Batch Risk Engine
+# -----------------------
+# Scores whole portfolios at once with the same rules as calculate_risk_score.
+# Rows the scalar function would reject (non-numeric amounts, zero tenure, a
+# non-string treatment) or that are too large to divide exactly in float64 are
+# scored one by one with the scalar function, so results always match it.
+
+# Integers above this lose precision when numpy converts them to float64
+_EXACT_INT_LIMIT = 2 ** 53
+
+
+def score_columns(required_amount, monthly_income, preferred_tenure,
+                  has_existing_loans, uninsured, treatment_type):
+    """Vectorized calculate_risk_score over parallel column arrays.
+
+    Numeric columns are integers, the two flag columns are booleans and
+    treatment_type holds already lower-cased strings. Returns (risks, scores).
+    """
+    required = np.asarray(required_amount, dtype=np.int64)
+    income = np.asarray(monthly_income, dtype=np.int64)
+    tenure = np.asarray(preferred_tenure, dtype=np.int64)
+    has_existing_loans = np.asarray(has_existing_loans, dtype=bool)
+    uninsured = np.asarray(uninsured, dtype=bool)
+    treatment = np.asarray(treatment_type, dtype=np.str_)
+
+    emi = required / tenure
+    score = np.where(emi > income * 0.5, 40, np.where(emi > income * 0.3, 20, 0))
+    score += np.where(has_existing_loans, 20, 0)
+    score += np.where(uninsured, 15, 0)
+    score += np.where(tenure >= 36, 20, np.where(tenure >= 24, 10, 0))
+
+    high_risk = np.zeros(len(treatment), dtype=bool)
+    for word in HIGH_RISK_TREATMENTS:
+        high_risk |= np.char.find(treatment, word) >= 0
+    score += np.where(high_risk, 15, 5)
+
+    risks = np.where(score > 60, "HIGH", np.where(score > 30, "MEDIUM", "LOW"))
+    return risks, score
+
+
+def loans_to_columns(loans):
+    """Split loan dicts into score_columns() inputs.
+
+    Returns (columns, rows): rows[i] is the index in `loans` of column entry i.
+    Loans that cannot be vectorized exactly are left out of both.
+    """
+    required_col, income_col, tenure_col = [], [], []
+    existing_col, uninsured_col, treatment_col = [], [], []
+    rows = []
+    for index, data in enumerate(loans):
+        get = data.get
+        try:
+            required_amount = int(get("required_amount", 0))
+            income = int(get("monthly_income", 0))
+            tenure = int(get("preferred_tenure", 1))
+            treatment = get("treatment_type", "").lower()
+        except (TypeError, ValueError, AttributeError):
+            continue
+        if tenure == 0 or type(treatment) is not str:
+            continue
+        if not (-_EXACT_INT_LIMIT < required_amount < _EXACT_INT_LIMIT
+                and -_EXACT_INT_LIMIT < income < _EXACT_INT_LIMIT
+                and -_EXACT_INT_LIMIT < tenure < _EXACT_INT_LIMIT):
+            continue
+
+        required_col.append(required_amount)
+        income_col.append(income)
+        tenure_col.append(tenure)
+        existing_col.append(get("existing_loans") == "yes")
+        uninsured_col.append(get("insurance_available") == "no" or get("existing_insurance") == "no")
+        treatment_col.append(treatment)
+        rows.append(index)
+
+    columns = {
+        "required_amount": required_col,
+        "monthly_income": income_col,
+        "preferred_tenure": tenure_col,
+        "has_existing_loans": existing_col,
+        "uninsured": uninsured_col,
+        "treatment_type": treatment_col,
+    }
+    return columns, rows
+
+
+def score_loans(loans):
+    """Batch calculate_risk_score: a (risk, score) tuple per loan, or None where
+    calculate_risk_score would raise for that loan."""
+    loans = list(loans)
+    results = [None] * len(loans)
+
+    columns, rows = loans_to_columns(loans)
+    if rows:
+        risks, scores = score_columns(**columns)
+        for index, risk, score in zip(rows, risks.tolist(), scores.tolist()):
+            results[index] = (risk, score)
+    if len(rows) == len(loans):
+        return results
+
+    vectorized = set(rows)
+    for index, data in enumerate(loans):
+        if index in vectorized:
+            continue
+        try:
+            results[index] = calculate_risk_score(data)
+        except (TypeError, ValueError, AttributeError, ZeroDivisionError):
+            results[index] = None
+    return results
@@ -0,0 +1,230 @@
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+
+from .db import practitioners_col, organizations_col, loan_providers_col
+from .directory import directory_version
+
+# -----------------------
+# Recipient Typeahead
+# -----------------------
+# An in-memory prefix index over doctor names and specializations, hospital
+# names and loan provider names. Every word of an entity's searchable text is
+# one (token, key) entry in a sorted list, so a prefix is a bisect range and
+# a lookup never scans the whole directory.
+#
+# register adds new entities to the local index directly. Other processes
+# notice the directory version move (checked at most every
+# SEARCH_SYNC_SECONDS) and pull only the entities created or updated since
+# their last sync.
+
+SEARCH_KINDS = {
+    "doctor": (practitioners_col, "practitioner_id"),
+    "hospital": (organizations_col, "organization_id"),
+    "loan_provider": (loan_providers_col, "loan_provider_id"),
+}
+
+SEARCH_FIELDS = {
+    "doctor": ["first_name", "last_name", "specialization"],
+    "hospital": ["name"],
+    "loan_provider": ["name"],
+}
+
+DEFAULT_SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+SEARCH_SYNC_SECONDS = 1.0
+# Sync windows overlap by this much to absorb clock skew between app servers
+SYNC_OVERLAP = timedelta(seconds=5)
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return _WORD.findall(str(text).lower()) if text else []
+
+
+def entity_label(kind, doc):
+    if kind == "doctor":
+        return f"Dr. {doc.get('first_name') or ''} {doc.get('last_name') or ''}".strip()
+    return doc.get("name") or ""
+
+
+def entity_record(kind, doc):
+    """The compact result row returned by the search endpoint."""
+    id_field = SEARCH_KINDS[kind][1]
+    record = {"kind": kind, "id": doc.get(id_field), "label": entity_label(kind, doc)}
+    if kind == "doctor":
+        record["specialization"] = doc.get("specialization")
+        record["organization_id"] = doc.get("organization_id")
+    return record
+
+
+class PrefixIndex:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = []   # sorted (token, key)
+        self._records = {}   # key -> result row
+        self._tokens = {}    # key -> tokens, so an entity can be re-indexed
+        self._by_org = {}    # organization_id -> doctor keys
+
+    def __len__(self):
+        return len(self._records)
+
+    def _remove(self, key):
+        for token in self._tokens.pop(key, ()):
+            i = bisect_left(self._entries, (token, key))
+            if i < len(self._entries) and self._entries[i] == (token, key):
+                del self._entries[i]
+        record = self._records.pop(key, None)
+        if record and record.get("organization_id"):
+            self._by_org.get(record["organization_id"], set()).discard(key)
+
+    def add(self, kind, doc):
+        record = entity_record(kind, doc)
+        if not record["id"]:
+            return
+        key = (kind, record["id"])
+        tokens = set()
+        for field in SEARCH_FIELDS[kind]:
+            tokens.update(tokenize(doc.get(field)))
+        with self._lock:
+            self._remove(key)
+            self._records[key] = record
+            self._tokens[key] = tokens
+            if record.get("organization_id"):
+                self._by_org.setdefault(record["organization_id"], set()).add(key)
+            for token in tokens:
+                insort(self._entries, (token, key))
+
+    def load(self, docs_by_kind):
+        """Replace the whole index; one sort instead of an insort per token."""
+        entries, records, token_sets, by_org = [], {}, {}, {}
+        for kind, docs in docs_by_kind.items():
+            for doc in docs:
+                record = entity_record(kind, doc)
+                if not record["id"]:
+                    continue
+                key = (kind, record["id"])
+                tokens = set()
+                for field in SEARCH_FIELDS[kind]:
+                    tokens.update(tokenize(doc.get(field)))
+                records[key] = record
+                token_sets[key] = tokens
+                if record.get("organization_id"):
+                    by_org.setdefault(record["organization_id"], set()).add(key)
+                entries.extend((token, key) for token in tokens)
+        entries.sort()
+        with self._lock:
+            self._entries, self._records, self._tokens, self._by_org = entries, records, token_sets, by_org
+
+    def _range(self, prefix):
+        lo = bisect_left(self._entries, (prefix,))
+        hi = bisect_left(self._entries, (prefix + "\U0010ffff",), lo)
+        return lo, hi
+
+    def search(self, query, kinds=None, organization_id=None, limit=DEFAULT_SEARCH_LIMIT):
+        """Top ``limit`` entities whose words start with every word of ``query``.
+
+        Matches come back in token order, so whole-word hits sort ahead of
+        longer words sharing the prefix.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        with self._lock:
+            spans = {term: self._range(term) for term in set(terms)}
+            ranked = sorted(spans, key=lambda term: spans[term][1] - spans[term][0])
+            lo, hi = spans[ranked[0]]
+
+            if organization_id:
+                members = self._by_org.get(organization_id, ())
+                if len(members) < hi - lo:
+                    # A hospital's doctors are fewer than the prefix range: match them directly
+                    return self._match_members(members, ranked, kinds, limit)
+
+            results, seen = [], set()
+            for i in range(lo, hi):
+                key = self._entries[i][1]
+                if key in seen:
+                    continue
+                seen.add(key)
+                if kinds and key[0] not in kinds:
+                    continue
+                record = self._records[key]
+                if organization_id and record.get("organization_id") != organization_id:
+                    continue
+                if not self._matches(key, ranked[1:]):
+                    continue
+                results.append(record)
+                if len(results) >= limit:
+                    break
+            return results
+
+    def _matches(self, key, terms):
+        tokens = self._tokens[key]
+        return all(any(t.startswith(term) for t in tokens) for term in terms)
+
+    def _match_members(self, members, terms, kinds, limit):
+        matched = []
+        for key in members:
+            if kinds and key[0] not in kinds:
+                continue
+            if self._matches(key, terms):
+                # Same order as a range walk: by the token matching the narrowest term
+                first = min(t for t in self._tokens[key] if t.startswith(terms[0]))
+                matched.append((first, key))
+        matched.sort()
+        return [self._records[key] for _, key in matched[:limit]]
+
+
+class RecipientSearch:
+    """PrefixIndex kept in step with the recipient collections."""
+
+    def __init__(self, kinds=None, versions=None):
+        self.kinds = SEARCH_KINDS if kinds is None else kinds
+        self.versions = versions
+        self.index = PrefixIndex()
+        self._sync_lock = threading.Lock()
+        self._version = None
+        self._synced_at = None
+        self._checked = 0.0
+
+    def _fetch(self, query):
+        projection = {"_id": 0, "email": 0, "password": 0}
+        return {kind: col.find(query, projection) for kind, (col, _) in self.kinds.items()}
+
+    def sync(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked < SEARCH_SYNC_SECONDS:
+            return
+        with self._sync_lock:
+            if not force and now - self._checked < SEARCH_SYNC_SECONDS:
+                return
+            version = directory_version(self.versions)
+            if version != self._version:
+                started = datetime.utcnow()
+                if self._synced_at is None:
+                    self.index.load(self._fetch({}))
+                else:
+                    since = self._synced_at - SYNC_OVERLAP
+                    changed = {"$or": [{"created_at": {"$gte": since}}, {"updated_at": {"$gte": since}}]}
+                    for kind, docs in self._fetch(changed).items():
+                        for doc in docs:
+                            self.index.add(kind, doc)
+                self._version, self._synced_at = version, started
+            self._checked = time.monotonic()
+
+    def add(self, kind, doc):
+        """Index an entity this process just wrote, without waiting for a sync."""
+        if kind in self.kinds:
+            self.index.add(kind, doc)
+
+    def search(self, query, **filters):
+        self.sync()
+        return self.index.search(query, **filters)
+
+
+recipient_search = RecipientSearch()
@@ -0,0 +1,121 @@
+import gzip
+import json
+import zlib
+
+import orjson
+
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from .renderers import dumps
+
+# -----------------------
+# NDJSON Streaming
+# -----------------------
+# List views that opt in (see STREAMING_RENDERERS) stream one JSON document per
+# line when the client sends `Accept: application/x-ndjson`, so a worker only
+# ever holds one cursor batch in memory instead of the whole result set.
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+STREAM_BATCH_SIZE = 500
+GZIP_FLUSH_BYTES = 64 * 1024
+GUNZIP_READ_BYTES = 64 * 1024
+GZIP_CODINGS = ("gzip", "x-gzip", "*")
+
+
+def _dumps(doc):
+    try:
+        return dumps(doc) + b"\n"
+    except orjson.JSONEncodeError:
+        return json.dumps(doc, cls=JSONEncoder, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Renders ordinary (non-streamed) responses, e.g. errors, as NDJSON."""
+
+    media_type = NDJSON_MEDIA_TYPE
+    format = "ndjson"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if isinstance(data, list):
+            return b"".join(_dumps(doc) for doc in data)
+        return _dumps(data)
+
+
+STREAMING_RENDERERS = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer]
+
+
+def wants_stream(request):
+    renderer = getattr(request, "accepted_renderer", None)
+    return renderer is not None and renderer.format == NDJSONRenderer.format
+
+
+def ndjson_lines(docs):
+    for doc in docs:
+        yield _dumps(doc)
+
+
+def accepts_gzip(request):
+    """Whether Accept-Encoding allows gzip, honouring q-values (`gzip;q=0` refuses it)."""
+    qualities = {}
+    for part in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        coding, *params = part.split(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+    # An explicit gzip entry wins over the "*" wildcard
+    for coding in GZIP_CODINGS:
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
+def gunzip_file(fileobj, read_bytes=GUNZIP_READ_BYTES):
+    """Yield the decompressed contents of an open gzip file in chunks, then close it."""
+    with fileobj, gzip.open(fileobj, "rb") as f:
+        while chunk := f.read(read_bytes):
+            yield chunk
+
+
+def gzip_chunks(chunks, flush_bytes=GZIP_FLUSH_BYTES):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    pending = 0
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        pending += len(chunk)
+        if pending >= flush_bytes:
+            out += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def stream_cursor(request, col, query, projection, batch_size=STREAM_BATCH_SIZE):
+    """Stream a query as NDJSON, gzip-compressed when the client accepts it."""
+    cursor = col.find(query, projection, batch_size=batch_size)
+    body = ndjson_lines(cursor)
+
+    gzipped = accepts_gzip(request)
+    if gzipped:
+        body = gzip_chunks(body)
+
+    response = StreamingHttpResponse(body, content_type=NDJSON_MEDIA_TYPE)
+    response["Vary"] = "Accept, Accept-Encoding"
+    if gzipped:
+        response["Content-Encoding"] = "gzip"
+    return response
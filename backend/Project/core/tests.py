@@ -1,3 +1,1529 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import SkipTest, mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from bson import ObjectId
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import CommandError, call_command
+from django.http import QueryDict
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import path, resolve
+from pymongo import MongoClient
+from pymongo.errors import AutoReconnect, DuplicateKeyError
+from rest_framework.exceptions import AuthenticationFailed, ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import db
+from .analytics import build_rollups, counters_from_facets, read_provider_analytics, record_loan_created, summarize_counters
+from .authentication import TOKEN_VERSION_CLAIM, ClaimsJWTAuthentication, ClaimsUser, revoke_tokens, tokens_for
+from .directory import RecipientsDirectory, etag_for, etag_matches, recipients_directory
+from .entity_cache import EntityCache, entity_cache
+from .fhir import build_fhir_patient, convert_shared_profile, fhir_document, refresh_patient_bundles
+from .fhir_convert import build_documents, plan_chunk, write_chunk
+from .fhir_queue import MAX_ATTEMPTS, claim_next_job, fail_exhausted_jobs, poll, reconcile_unconverted, restart_dead_workers
+from . import async_views, metrics, profiling, views
+from .fhir_export import InvalidExport, manifest, parse_since, write_export
+from .fhir_search import InvalidSearch, build_search_query, search_fields
+from .indexes import INDEXES, explain_query_shapes
+from .loans import import_loans
+from .management.commands.rebuild_loan_rollups import write_rollup
+from .models import User
+from .pagination import InvalidPage, after_cursor, decode_cursor, encode_cursor, keyset_page
+from .query_budget import QUERY_BUDGETS, Budget, assert_within_budget, budget_report, capture_queries, query_budget
+from .renderers import ORJSONParser, ORJSONRenderer
+from .risk import calculate_risk_score, score_columns, score_loans
+from .search import PrefixIndex
+from .streaming import accepts_gzip, stream_cursor
+
+
+def _scalar(data):
+    try:
+        return calculate_risk_score(data)
+    except (TypeError, ValueError, AttributeError, ZeroDivisionError):
+        return None
+
+
+class BatchRiskScoringTests(SimpleTestCase):
+    """score_loans must agree with calculate_risk_score loan for loan."""
+
+    def test_matches_scalar_on_threshold_values(self):
+        loans = []
+        for amount in [0, 1, 29999, 30000, 30001, 50000, 100000]:
+            for income in [0, 1000, 2499, 2500, 2501, 5000]:
+                for tenure in [1, 12, 23, 24, 35, 36, 60]:
+                    loans.append({
+                        "required_amount": amount,
+                        "monthly_income": income,
+                        "preferred_tenure": tenure,
+                        "existing_loans": "yes" if tenure % 2 else "no",
+                        "insurance_available": "no" if amount % 2 else "yes",
+                        "treatment_type": "Dialysis" if income % 2 else "Consultation",
+                    })
+        self.assertEqual(score_loans(loans), [_scalar(d) for d in loans])
+
+    def test_matches_scalar_on_messy_input(self):
+        rng = random.Random(2024)
+        numbers = [0, 1, 12, 24, 36, "18", " 6 ", "abc", None, -3, 2.9, 10 ** 17, rng.randint(1, 10 ** 6)]
+        flags = ["yes", "no", "No", None, 1, ["no"]]
+        treatments = ["Surgery", "KIDNEY DIALYSIS", "emErgency care", "checkup", "", None, 42]
+
+        loans = []
+        for _ in range(5000):
+            data = {}
+            for key in ["required_amount", "monthly_income", "preferred_tenure"]:
+                if rng.random() < 0.9:
+                    data[key] = rng.choice(numbers)
+            for key in ["existing_loans", "insurance_available", "existing_insurance"]:
+                if rng.random() < 0.8:
+                    data[key] = rng.choice(flags)
+            if rng.random() < 0.9:
+                data["treatment_type"] = rng.choice(treatments)
+            loans.append(data)
+
+        self.assertEqual(score_loans(loans), [_scalar(d) for d in loans])
+
+    def test_unscorable_loans_are_none(self):
+        self.assertEqual(score_loans([{"preferred_tenure": 0}, {"required_amount": "x"}]), [None, None])
+
+    def test_score_columns(self):
+        risks, scores = score_columns(
+            required_amount=[600000, 10000],
+            monthly_income=[20000, 100000],
+            preferred_tenure=[36, 12],
+            has_existing_loans=[True, False],
+            uninsured=[True, False],
+            treatment_type=["emergency surgery", "consultation"],
+        )
+        self.assertEqual(risks.tolist(), ["HIGH", "LOW"])
+        self.assertEqual(scores.tolist(), [110, 5])
+
+    def test_empty_batch(self):
+        self.assertEqual(score_loans([]), [])
+
+
+class EntityCacheTests(SimpleTestCase):
+
+    def test_lru_eviction_and_counters(self):
+        cache = EntityCache(max_size=2, ttl=60)
+        cache.set("a", {"n": 1})
+        cache.set("b", {"n": 2})
+        self.assertEqual(cache.get("a"), {"n": 1})   # "b" is now least recent
+        cache.set("c", {"n": 3})
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), {"n": 3})
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["evictions"]), (2, 1, 1))
+
+    def test_entries_expire(self):
+        cache = EntityCache(max_size=10, ttl=30)
+        with mock.patch("core.entity_cache.time.monotonic", return_value=100.0):
+            cache.set("a", {"n": 1})
+        with mock.patch("core.entity_cache.time.monotonic", return_value=129.0):
+            self.assertEqual(cache.get("a"), {"n": 1})
+        with mock.patch("core.entity_cache.time.monotonic", return_value=131.0):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_shared_backend_fills_and_invalidates(self):
+        shared = LocMemCache("entity-cache-test", {})
+        worker_a = EntityCache(max_size=10, ttl=60, shared=shared)
+        worker_b = EntityCache(max_size=10, ttl=60, shared=shared)
+
+        worker_a.set("a", {"n": 1})
+        self.assertEqual(worker_b.get("a"), {"n": 1})
+        self.assertEqual(worker_b.stats()["shared_hits"], 1)
+
+        worker_a.delete("a")
+        self.assertIsNone(shared.get("a"))
+        self.assertIsNone(worker_a.peek("a"))
+
+
+class RecipientsDirectoryTests(SimpleTestCase):
+
+    def test_rebuilds_only_when_version_moves(self):
+        builds = []
+
+        def build():
+            builds.append(1)
+            return {"doctors": [], "hospitals": [{"name": f"H{len(builds)}"}], "loan_providers": []}
+
+        directory = RecipientsDirectory(build=build)
+        self.assertEqual(directory.render(3), directory.render(3))
+        self.assertEqual(len(builds), 1)
+
+        version, body = directory.render(4)
+        self.assertEqual((version, len(builds)), (4, 2))
+        self.assertIn(b'"H2"', body)
+
+    def test_etag_matching(self):
+        etag = etag_for(7)
+        self.assertTrue(etag_matches(etag, etag))
+        self.assertTrue(etag_matches(f'"other", W/{etag}', etag))
+        self.assertTrue(etag_matches("*", etag))
+        self.assertFalse(etag_matches(etag_for(6), etag))
+        self.assertFalse(etag_matches(None, etag))
+
+
+class PrefixIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        self.index = PrefixIndex()
+        self.index.load({
+            "doctor": [
+                {"practitioner_id": "DR-1", "first_name": "Asha", "last_name": "Rao",
+                 "specialization": "Cardiology", "organization_id": "HOSP-1"},
+                {"practitioner_id": "DR-2", "first_name": "Raoul", "last_name": "Das",
+                 "specialization": "Neurology", "organization_id": "HOSP-2"},
+            ],
+            "hospital": [{"organization_id": "HOSP-1", "name": "Rao Memorial Hospital"}],
+            "loan_provider": [{"loan_provider_id": "LOANP-1", "name": "Asha Finance"}],
+        })
+
+    def ids(self, query, **filters):
+        return [r["id"] for r in self.index.search(query, **filters)]
+
+    def test_prefix_and_multi_word(self):
+        self.assertEqual(self.ids("rao"), ["DR-1", "HOSP-1", "DR-2"])
+        self.assertEqual(self.ids("asha ra"), ["DR-1"])
+        self.assertEqual(self.ids("CARD"), ["DR-1"])
+        self.assertEqual(self.ids("zz"), [])
+
+    def test_filters_and_limit(self):
+        self.assertEqual(self.ids("rao", kinds=["hospital"]), ["HOSP-1"])
+        self.assertEqual(self.ids("r", organization_id="HOSP-2"), ["DR-2"])
+        self.assertEqual(self.ids("r", limit=1), ["DR-1"])
+
+    def test_incremental_add_replaces_entity(self):
+        self.index.add("doctor", {"practitioner_id": "DR-2", "first_name": "Ravi", "last_name": "Iyer",
+                                  "organization_id": "HOSP-1"})
+        self.assertEqual(self.ids("raoul"), [])
+        self.assertEqual(self.ids("iyer", organization_id="HOSP-1"), ["DR-2"])
+        self.assertEqual(self.ids("r", organization_id="HOSP-2"), [])
+        self.assertEqual(len(self.index), 4)
+
+
+def _bundle():
+    """A shared-profile FHIR bundle plus a loan request, as the views return them."""
+    created = datetime(2025, 3, 14, 9, 26, 53, 589793, tzinfo=timezone.utc)
+    return {
+        "resourceType": "Bundle",
+        "type": "collection",
+        "id": str(uuid.UUID(int=7)),
+        "uuid": uuid.UUID(int=7),
+        "timestamp": created,
+        "total": 2,
+        "entry": [
+            {
+                "resource": {
+                    "resourceType": "Patient",
+                    "name": [{"family": "Rao", "given": ["Asha", "Kumari"]}],
+                    "birthDate": date(1984, 2, 29),
+                    "address": [{"text": "12 MG Road\nBengaluru", "state": "Karnataka", "city": "Bengaluru"}],
+                    "note": "Allergic to penicillin \u2014 \"severe\"\u2028line\u2029para \t\x00\x1f \U0001f489 \u0928\u092e\u0938\u094d\u0924\u0947",
+                    "active": True,
+                    "deceasedBoolean": False,
+                    "multipleBirthInteger": None,
+                },
+            },
+            {"resource": {"resourceType": "Observation", "valueQuantity": {"value": 72.5, "unit": "kg"}, "code": []}},
+        ],
+        "loan": {
+            "loan_request_id": "LOAN-1",
+            "required_amount": 125000,
+            "monthly_income": Decimal("48250.75"),
+            "risk_score": 0.3333333333333333,
+            "emi_ratio": 0.1,
+            "negative": -12,
+            "tenure_by_year": {1: 12, 2: 24},
+            "created_at": created.replace(tzinfo=None),
+            "reviewed_at": created + timedelta(hours=5, minutes=30),
+            "tags": ("urgent", "dialysis"),
+        },
+    }
+
+
+class ORJSONRendererTests(SimpleTestCase):
+    """ORJSONRenderer / ORJSONParser must be drop-ins for DRF's JSON pair."""
+
+    def test_byte_for_byte_with_json_renderer(self):
+        payloads = [
+            _bundle(),
+            [_bundle(), _bundle()],
+            {"detail": "Authentication credentials were not provided."},
+            [], {}, "", 0, 1.5, True,
+        ]
+        for data in payloads:
+            self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_objectid_none_and_fallbacks(self):
+        oid = ObjectId("65f2c0ffee0ddba11c0ffee0")
+        self.assertEqual(ORJSONRenderer().render({"_id": oid}), b'{"_id":"65f2c0ffee0ddba11c0ffee0"}')
+        self.assertEqual(ORJSONRenderer().render(None), b"")
+        big = {"n": 2 ** 70}
+        self.assertEqual(ORJSONRenderer().render(big), JSONRenderer().render(big))
+        context = {"indent": 2}
+        self.assertEqual(
+            ORJSONRenderer().render(_bundle(), "application/json", context),
+            JSONRenderer().render(_bundle(), "application/json", context),
+        )
+
+    def test_exponent_floats_keep_their_value(self):
+        data = {"tiny": 1e-05, "huge": 1e16}
+        parsed = ORJSONParser().parse(io.BytesIO(ORJSONRenderer().render(data)))
+        self.assertEqual(parsed, data)
+
+    def test_parser_matches_json_parser(self):
+        body = JSONRenderer().render(_bundle())
+        self.assertEqual(ORJSONParser().parse(io.BytesIO(body)), JSONParser().parse(io.BytesIO(body)))
+        latin = '{"city": "S\u00e3o Paulo"}'.encode("latin-1")
+        self.assertEqual(
+            ORJSONParser().parse(io.BytesIO(latin), parser_context={"encoding": "latin-1"}),
+            {"city": "S\u00e3o Paulo"},
+        )
+        for bad in (b"", b"{", b"{'a': 1}", b'{"a": NaN}', b"\xff"):
+            with self.assertRaises(ParseError):
+                ORJSONParser().parse(io.BytesIO(bad))
+
+
+def _matches(doc, query):
+    """The subset of Mongo query semantics keyset pages use."""
+    for field, condition in query.items():
+        if field == "$and":
+            if not all(_matches(doc, part) for part in condition):
+                return False
+        elif field == "$or":
+            if not any(_matches(doc, part) for part in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = doc.get(field)
+            if value is None or not all(value < bound for op, bound in condition.items() if op == "$lt"):
+                return False
+        elif doc.get(field) != condition:
+            return False
+    return True
+
+
+class _ListCollection:
+    """find().sort().limit() over a list, sorting descending with missing values last like Mongo."""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection=None):
+        self.found = [dict(doc) for doc in self.docs if _matches(doc, query)]
+        return self
+
+    def sort(self, keys):
+        for field, _ in reversed(keys):
+            self.found.sort(key=lambda doc: (doc.get(field) is not None, doc.get(field) or 0), reverse=True)
+        return self
+
+    def limit(self, count):
+        return iter(self.found[:count])
+
+
+class KeysetPaginationTests(SimpleTestCase):
+
+    def test_cursor_round_trip(self):
+        _id = ObjectId()
+        when = datetime(2025, 3, 1, 10, 30, 15, 123000)
+        self.assertEqual(decode_cursor(encode_cursor(when, _id)), (when, _id))
+        self.assertEqual(decode_cursor(encode_cursor(None, _id)), (None, _id))
+        self.assertNotIn("=", encode_cursor(when, _id))
+        for bad in ("", "not-a-cursor", encode_cursor("yesterday", _id), encode_cursor(when, "nope")):
+            with self.assertRaises(InvalidPage):
+                decode_cursor(bad)
+
+    def test_after_cursor_keeps_missing_values_last(self):
+        _id = ObjectId()
+        when = datetime(2025, 3, 1)
+        self.assertEqual(after_cursor("shared_at", None, _id), {"shared_at": None, "_id": {"$lt": _id}})
+        self.assertEqual(after_cursor("shared_at", when, _id), {"$or": [
+            {"shared_at": {"$lt": when}},
+            {"shared_at": when, "_id": {"$lt": _id}},
+            {"shared_at": None},
+        ]})
+
+    def test_pages_cover_every_document_once(self):
+        # Ties on the sort field and documents without one, which sort last
+        days = [datetime(2025, 3, 3), datetime(2025, 3, 1), datetime(2025, 3, 3), None, datetime(2025, 3, 2), None, None]
+        docs = [{"_id": ObjectId(), "n": n, **({"shared_at": day} if day else {})} for n, day in enumerate(days)]
+        col = _ListCollection(docs)
+        expected = [doc["n"] for doc in col.find({}).sort([("shared_at", -1), ("_id", -1)]).limit(len(docs))]
+
+        seen, cursor = [], None
+        for _ in range(len(docs)):
+            page = keyset_page(col, {}, {"_id": 0, "n": 1}, "shared_at", 2, cursor)
+            seen.extend(doc["n"] for doc in page["results"])
+            self.assertTrue(all(set(doc) == {"n"} for doc in page["results"]))
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+        self.assertEqual(expected[:3], [2, 0, 4])
+
+
+class StreamingTests(SimpleTestCase):
+
+    def test_accepts_gzip_honours_q_values(self):
+        factory = RequestFactory()
+        cases = {
+            "gzip": True,
+            "gzip, deflate, br": True,
+            "br;q=1.0, GZIP;q=0.5": True,
+            "x-gzip": True,
+            "*": True,
+            "": False,
+            "identity": False,
+            "gzip;q=0": False,
+            "gzip;q=0.000, *": False,
+            "*;q=0": False,
+            "notgzip, gzipped": False,
+            "br, *;q=0.1": True,
+        }
+        for header, expected in cases.items():
+            with self.subTest(header=header):
+                self.assertIs(accepts_gzip(factory.get("/", HTTP_ACCEPT_ENCODING=header)), expected)
+
+    def test_stream_cursor_only_compresses_when_gzip_is_acceptable(self):
+        col = mock.Mock()
+        col.find.side_effect = lambda *args, **kwargs: iter([{"n": 1}, {"n": 2}])
+        factory = RequestFactory()
+
+        response = stream_cursor(factory.get("/", HTTP_ACCEPT_ENCODING="gzip;q=0.8"), col, {}, {})
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), b'{"n":1}\n{"n":2}\n')
+
+        response = stream_cursor(factory.get("/", HTTP_ACCEPT_ENCODING="gzip;q=0, identity"), col, {}, {})
+        self.assertNotIn("Content-Encoding", response)
+        self.assertEqual(b"".join(response.streaming_content), b'{"n":1}\n{"n":2}\n')
+
+
+class FhirExportTests(SimpleTestCase):
+
+    def test_parse_since(self):
+        self.assertIsNone(parse_since(""))
+        self.assertEqual(parse_since("2025-03-01T10:00:00Z"), datetime(2025, 3, 1, 10))
+        self.assertEqual(parse_since("2025-03-01T15:30:00+05:30"), datetime(2025, 3, 1, 10))
+        self.assertEqual(parse_since("2025-03-01T15:30:00 05:30"), datetime(2025, 3, 1, 10))
+        self.assertEqual(parse_since("2025-03-01"), datetime(2025, 3, 1))
+        with self.assertRaises(InvalidExport):
+            parse_since("yesterday")
+
+    def test_writes_numbered_gzip_ndjson_files(self):
+        since, now = datetime(2025, 1, 1), datetime(2025, 2, 1)
+        job = {"export_id": "e1", "organization_id": "HOSP-1", "since": since, "transaction_time": now,
+               "worker": "w", "request": "http://testserver/api/fhir/$export"}
+        docs = [{"fhir_resource": {"resourceType": "Bundle", "n": i}} for i in range(5)]
+
+        with tempfile.TemporaryDirectory() as root, \
+                override_settings(FHIR_EXPORT_DIR=root, FHIR_EXPORT_FILE_LINES=2), \
+                mock.patch("core.fhir_export.fhir_patients_col") as fhir_col, \
+                mock.patch("core.fhir_export.fhir_exports_col") as exports_col:
+            fhir_col.find.return_value = iter(docs)
+            exports_col.update_one.return_value.matched_count = 1
+            output = write_export(job)
+
+            query = fhir_col.find.call_args[0][0]
+            window = {"$gt": since, "$lte": now}
+            self.assertEqual(query, {"organization_id": "HOSP-1", "$or": [
+                {"updated_at": window}, {"updated_at": None, "created_at": window},
+            ]})
+            self.assertEqual([(o["file"], o["count"]) for o in output],
+                             [("Bundle-1.ndjson.gz", 2), ("Bundle-2.ndjson.gz", 2), ("Bundle-3.ndjson.gz", 1)])
+            self.assertEqual(sorted(os.listdir(os.path.join(root, "e1"))), [o["file"] for o in output])
+            with gzip.open(os.path.join(root, "e1", "Bundle-3.ndjson.gz")) as f:
+                self.assertEqual(f.read(), b'{"resourceType":"Bundle","n":4}\n')
+
+        job["output"] = output
+        body = manifest(job, lambda name: f"http://testserver/api/fhir/export/e1/{name}")
+        self.assertEqual(body["transactionTime"], "2025-02-01T00:00:00Z")
+        self.assertEqual(body["output"][0]["url"], "http://testserver/api/fhir/export/e1/Bundle-1.ndjson.gz")
+
+    def test_export_file_is_only_gzip_encoded_for_clients_that_accept_it(self):
+        job = {"status": "done", "output": [{"file": "Bundle-1.ndjson.gz", "count": 1}]}
+        lines = b'{"resourceType":"Bundle","n":0}\n'
+        factory = APIRequestFactory()
+
+        def fetch(accept_encoding):
+            request = factory.get("/api/fhir/export/e1/Bundle-1.ndjson.gz", HTTP_ACCEPT_ENCODING=accept_encoding)
+            force_authenticate(request, SimpleNamespace(is_authenticated=True))
+            return views.fhir_export_file(request, "e1", "Bundle-1.ndjson.gz")
+
+        with tempfile.TemporaryDirectory() as root, override_settings(FHIR_EXPORT_DIR=root), \
+                mock.patch("core.views._own_export", return_value=(job, None)):
+            os.makedirs(os.path.join(root, "e1"))
+            with gzip.open(os.path.join(root, "e1", "Bundle-1.ndjson.gz"), "wb") as f:
+                f.write(lines)
+
+            response = fetch("gzip, deflate")
+            self.assertEqual(response["Content-Encoding"], "gzip")
+            self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), lines)
+
+            for accept_encoding in ("", "identity", "gzip;q=0, br"):
+                response = fetch(accept_encoding)
+                self.assertNotIn("Content-Encoding", response)
+                self.assertIn("Accept-Encoding", response["Vary"])
+                self.assertEqual(b"".join(response.streaming_content), lines)
+
+            # Purged between reading the job and opening the file
+            os.remove(os.path.join(root, "e1", "Bundle-1.ndjson.gz"))
+            for accept_encoding in ("gzip", ""):
+                response = fetch(accept_encoding)
+                self.assertEqual(response.status_code, 404)
+
+
+class FhirSearchTests(SimpleTestCase):
+
+    def test_search_fields_from_built_bundle(self):
+        bundle = build_fhir_patient(
+            {"first_name": "Asha  Kumari", "last_name": "Rao", "gender": "female", "dob": "1984-02-29",
+             "city": "Bengaluru", "blood_group": "O+", "allergies": "dust"},
+            None, None, "Chest pain"
+        )
+        self.assertEqual(search_fields(bundle), {
+            "v": 1, "name": ["asha", "kumari", "rao"], "gender": "female", "birthdate": "1984-02-29",
+            "city": ["bengaluru"], "code": ["blood group", "visit reason"],
+        })
+        self.assertIsNone(search_fields(build_fhir_patient({"dob": None}, None, None, None))["birthdate"])
+
+    def test_build_search_query(self):
+        def query(qs):
+            return build_search_query(QueryDict(qs))
+
+        self.assertEqual(query("name=Asha R&_count=5"), {"$and": [
+            {"search.name": {"$regex": "^asha"}}, {"search.name": {"$regex": "^r"}},
+        ]})
+        self.assertEqual(query("address-city=S.*"), {"search.city": {"$regex": "^s\\.\\*"}})
+        self.assertEqual(query("birthdate=1984-12"), {"search.birthdate": {"$gte": "1984-12", "$lt": "1985-01"}})
+        self.assertEqual(query("birthdate=gt1984-02-29"), {"search.birthdate": {"$gte": "1984-03-01"}})
+        self.assertEqual(query("birthdate=ge1980&birthdate=lt1990"), {"$and": [
+            {"search.birthdate": {"$gte": "1980"}}, {"search.birthdate": {"$lt": "1990"}},
+        ]})
+        for bad in ("", "_count=5", "gender=x", "birthdate=84", "birthdate=2023-02-30", "family=rao", "name="):
+            with self.assertRaises(InvalidSearch, msg=bad):
+                query(bad)
+
+
+class FhirRecipientListingTests(SimpleTestCase):
+
+    def test_documents_carry_the_share_recipients(self):
+        share = {"shared_id": "S1", "patient_id": "PAT-1", "practitioner_id": "DR-1", "organization_id": "HOSP-1"}
+        doc = fhir_document(share, {"resourceType": "Bundle", "entry": []})
+        self.assertEqual((doc["practitioner_id"], doc["organization_id"]), ("DR-1", "HOSP-1"))
+
+    def test_doctor_and_hospital_listings_are_one_query(self):
+        factory = APIRequestFactory()
+        for role, field, value in (("doctor", "practitioner_id", "DR-1"), ("hospital", "organization_id", "HOSP-1")):
+            request = factory.get("/api/patient/fhir-profiles/")
+            force_authenticate(request, SimpleNamespace(is_authenticated=True, role=role, email="x@example.com",
+                                                        **{field: value}))
+            with self.subTest(role=role), \
+                    mock.patch("core.views.fhir_patients_col") as fhir_col, \
+                    mock.patch("core.views.shared_profiles_col") as shares:
+                fhir_col.find.return_value = [{"shared_id": "S1"}]
+                response = views.patient_fhir_profiles(request)
+
+                self.assertEqual(response.data, [{"shared_id": "S1"}])
+                fhir_col.find.assert_called_once_with({field: value}, {"_id": 0})
+                self.assertEqual(shares.method_calls, [])
+
+    def test_backfill_copies_recipients_from_shares(self):
+        with mock.patch("core.management.commands.backfill_fhir_recipients.fhir_patients_col") as fhir_col, \
+                mock.patch("core.management.commands.backfill_fhir_recipients.shared_profiles_col") as shares:
+            fhir_col.find.return_value = [{"shared_id": "S1"}, {"shared_id": "S2"}, {"shared_id": "S3"}]
+            shares.find.side_effect = [
+                [{"shared_id": "S1", "practitioner_id": "DR-1", "organization_id": None}],
+                [{"shared_id": "S3", "organization_id": "HOSP-1"}],
+            ]
+            out = io.StringIO()
+            call_command("backfill_fhir_recipients", batch_size=2, stdout=out)
+
+        ops = [op for c in fhir_col.bulk_write.call_args_list for op in c.args[0]]
+        self.assertEqual([(op._filter["shared_id"], op._doc["$set"]) for op in ops], [
+            ("S1", {"practitioner_id": "DR-1", "organization_id": None}),
+            ("S3", {"practitioner_id": None, "organization_id": "HOSP-1"}),
+        ])
+        # Only documents still missing recipients are touched, so reruns are no-ops
+        self.assertEqual(ops[0]._filter["practitioner_id"], {"$exists": False})
+        self.assertIn("Updated 2 FHIR document(s); 1 had no shared profile", out.getvalue())
+
+
+class RefreshPatientBundlesTests(SimpleTestCase):
+
+    patient = {"patient_id": "PAT-1", "first_name": "Asha", "last_name": "Rao", "phone": "900",
+               "dob": "1984-02-29", "city": "Bengaluru"}
+    share = {"shared_id": "S1", "patient_id": "PAT-1", "illness_reason": "Fever", "organization_id": "HOSP-1"}
+
+    def refresh(self, patient):
+        stored = fhir_document(self.share, build_fhir_patient(self.patient, None, None, "Fever"))
+        with mock.patch("core.fhir.fhir_patients_col") as fhir_col, \
+                mock.patch("core.fhir.shared_profiles_col") as shares_col, \
+                mock.patch("core.fhir.get_many_by_id", return_value={}):
+            fhir_col.find.return_value = [stored]
+            shares_col.find.return_value = [self.share]
+            rewritten = refresh_patient_bundles(patient)
+        return stored, rewritten, fhir_col.bulk_write.call_args
+
+    def test_unchanged_profile_writes_nothing(self):
+        _, rewritten, bulk = self.refresh(dict(self.patient))
+        self.assertEqual(rewritten, 0)
+        self.assertIsNone(bulk)
+
+    def test_changed_profile_bumps_version_and_keeps_ids(self):
+        stored, rewritten, bulk = self.refresh({**self.patient, "phone": "911"})
+        self.assertEqual(rewritten, 1)
+        (op,) = bulk.args[0]
+        self.assertEqual(op._filter, {"shared_id": "S1", "fhir_resource.meta.versionId": "1"})
+        bundle = op._doc["$set"]["fhir_resource"]
+        self.assertEqual(bundle["meta"]["versionId"], "2")
+        patient_resource = bundle["entry"][0]["resource"]
+        self.assertEqual(patient_resource["id"], stored["fhir_resource"]["entry"][0]["resource"]["id"])
+        self.assertEqual(patient_resource["telecom"], [{"system": "phone", "value": "911"}])
+        self.assertNotEqual(op._doc["$set"]["content_hash"], stored["content_hash"])
+
+
+class FhirQueueTests(SimpleTestCase):
+
+    def test_poll_outlives_errors(self):
+        stop = threading.Event()
+        claim = mock.Mock(side_effect=[AutoReconnect("primary stepped down"), {"shared_id": "S1"}])
+        run = mock.Mock(side_effect=lambda job: stop.set())
+        with self.assertLogs("backend", "ERROR"):
+            poll(claim, run, "w", stop, poll_interval=0.001)
+        run.assert_called_once_with({"shared_id": "S1"})
+
+    def test_dead_workers_are_restarted(self):
+        stop = threading.Event()
+        dead = threading.Thread(target=lambda: None, name="fhir-worker-0")
+        dead.start()
+        dead.join()
+        threads = [dead]
+        with self.assertLogs("backend", "ERROR"):
+            self.assertEqual(restart_dead_workers(threads, stop, target=lambda *args: stop.wait()), 1)
+        self.assertIsNot(threads[0], dead)
+        self.assertEqual(threads[0].name, "fhir-worker-0")
+        self.assertTrue(threads[0].is_alive())
+        stop.set()
+        threads[0].join()
+
+    def test_expired_leases_are_reclaimed_only_until_attempts_run_out(self):
+        with mock.patch("core.fhir_queue.fhir_jobs_col") as jobs:
+            claim_next_job("w")
+            jobs.update_many.return_value.modified_count = 1
+            with self.assertLogs("backend", "ERROR"):
+                self.assertEqual(fail_exhausted_jobs(), 1)
+
+        expired = jobs.find_one_and_update.call_args.args[0]["$or"][1]
+        self.assertEqual(expired["attempts"], {"$lt": MAX_ATTEMPTS})
+        query, update = jobs.update_many.call_args.args
+        self.assertEqual((query["status"], query["attempts"]), ("running", {"$gte": MAX_ATTEMPTS}))
+        self.assertIn("$lt", query["lease_expires_at"])
+        self.assertEqual(update["$set"]["status"], "failed")
+
+    def test_bundle_of_a_share_deleted_mid_conversion_is_removed(self):
+        share = {"shared_id": "S1", "patient_id": "PAT-1", "patient_email": "p@x.com"}
+        patient = {"email": "p@x.com", "patient_id": "PAT-1", "first_name": "Asha"}
+        with mock.patch("core.fhir.get_by_id", return_value=None), \
+                mock.patch("core.fhir.fhir_patients_col") as bundles, \
+                mock.patch("core.fhir.shared_profiles_col") as shares:
+            shares.update_one.return_value.matched_count = 1
+            convert_shared_profile(share, patient)
+            bundles.delete_one.assert_not_called()
+
+            shares.update_one.return_value.matched_count = 0
+            convert_shared_profile(share, patient)
+            bundles.delete_one.assert_called_once_with({"shared_id": "S1"})
+
+    def test_reconcile_walks_past_tracked_shares(self):
+        pages = [
+            [{"_id": 1, "shared_id": "S1"}, {"_id": 2, "shared_id": "S2"}],
+            [{"_id": 3, "shared_id": "S3"}],
+        ]
+        with mock.patch("core.fhir_queue.shared_profiles_col") as shares, \
+                mock.patch("core.fhir_queue.fhir_jobs_col") as jobs, \
+                mock.patch("core.fhir_queue.enqueue_conversions") as enqueue:
+            shares.find.return_value.sort.return_value.limit.side_effect = pages
+            jobs.find.side_effect = [[{"shared_id": "S1"}, {"shared_id": "S2"}], []]
+            self.assertEqual(reconcile_unconverted(batch=2), 1)
+        self.assertEqual(shares.find.call_args_list[1].args[0], {"fhir_converted": False, "_id": {"$gt": 2}})
+        enqueue.assert_called_with(["S3"])
+
+
+class FhirConvertTests(SimpleTestCase):
+
+    def test_chunk_creates_updates_and_skips(self):
+        patient = {"email": "p@x.com", "patient_id": "PAT-1", "first_name": "Asha", "phone": "900"}
+        shares = [
+            {"shared_id": f"S{i}", "patient_id": "PAT-1", "patient_email": "p@x.com", "fhir_converted": i == 1}
+            for i in range(3)
+        ] + [{"shared_id": "S3", "patient_id": "PAT-9", "patient_email": "gone@x.com", "fhir_converted": False}]
+        current = fhir_document(shares[1], build_fhir_patient(patient, None, None, None))
+        stale = fhir_document(shares[2], build_fhir_patient({**patient, "phone": "111"}, None, None, None))
+        refs = {"patients": {"p@x.com": patient}, "practitioners": {}, "organizations": {},
+                "stored": {"S1": current, "S2": stale}}
+
+        items, orphaned = plan_chunk(shares, refs)
+        self.assertEqual(orphaned, ["S3"])
+        self.assertEqual(items[1][4], current["fhir_resource"]["entry"][0]["resource"]["id"])
+
+        totals = Counter()
+        with mock.patch("core.fhir_convert.fhir_patients_col") as fhir_col, \
+                mock.patch("core.fhir_convert.shared_profiles_col") as shares_col:
+            write_chunk(shares, refs, build_documents(items), totals)
+        self.assertEqual(dict(totals), {"created": 1, "unchanged": 1, "updated": 1})
+        ops = fhir_col.bulk_write.call_args.args[0]
+        self.assertEqual([type(op).__name__ for op in ops], ["ReplaceOne", "UpdateOne"])
+        shares_col.update_many.assert_called_once_with(
+            {"shared_id": {"$in": ["S0", "S2"]}}, {"$set": {"fhir_converted": True}}
+        )
+
+
+class MongoClientFactoryTests(SimpleTestCase):
+
+    def setUp(self):
+        for name, value in (("_client", None), ("_client_pid", None)):
+            patcher = mock.patch.object(db, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(db, "MongoClient", side_effect=lambda *args, **kwargs: mock.MagicMock())
+        self.client_class = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(MONGO_CLIENT_OPTIONS={"maxPoolSize": 7, "appname": "test"})
+    def test_client_is_built_on_first_use_with_settings(self):
+        col = db.LazyCollection("patients")
+        self.client_class.assert_not_called()
+
+        col.find_one({})
+        col.find_one({})
+        db.get_client()
+        self.client_class.assert_called_once()
+        kwargs = self.client_class.call_args.kwargs
+        self.assertEqual((kwargs["maxPoolSize"], kwargs["appname"]), (7, "test"))
+        self.assertIn(db.pool_stats, kwargs["event_listeners"])
+
+    def test_forked_process_gets_its_own_client(self):
+        col = db.LazyCollection("patients")
+        parent = db.get_client()
+        col.find_one({})
+        db.pool_stats.checked_out = 3
+
+        with mock.patch("core.db.os.getpid", return_value=os.getpid() + 1):
+            child = db.get_client()
+            self.assertIsNot(child, parent)
+            self.assertEqual(db.pool_stats.checked_out, 0)
+            col.find_one({})
+            child.__getitem__.return_value.__getitem__.assert_called_with("patients")
+            # The parent's sockets are left alone
+            db.close_client()
+        parent.close.assert_not_called()
+        self.assertIsNone(db._client)
+
+    def test_close_client_closes_the_current_client(self):
+        client = db.get_client()
+        db.close_client()
+        client.close.assert_called_once()
+        self.assertIsNot(db.get_client(), client)
+
+
+class FreshIdTests(SimpleTestCase):
+
+    def collision(self, field):
+        return DuplicateKeyError("E11000", 11000, {"keyPattern": {field: 1}})
+
+    def test_colliding_id_is_regenerated(self):
+        col = mock.Mock()
+        col.insert_one.side_effect = [self.collision("patient_id"), mock.sentinel.result]
+        doc = {"email": "p@x.com", "patient_id": "PAT-1"}
+        self.assertIs(db.insert_with_fresh_id(col, doc, "patient_id", lambda: "PAT-2"), mock.sentinel.result)
+        self.assertEqual(doc["patient_id"], "PAT-2")
+
+    def test_other_duplicates_and_exhausted_attempts_raise(self):
+        col = mock.Mock()
+        col.insert_one.side_effect = self.collision("email")
+        with self.assertRaises(DuplicateKeyError):
+            db.insert_with_fresh_id(col, {"patient_id": "PAT-1"}, "patient_id", lambda: "PAT-2")
+        self.assertEqual(col.insert_one.call_count, 1)
+
+        col = mock.Mock()
+        col.insert_one.side_effect = self.collision("loan_id")
+        with self.assertRaises(DuplicateKeyError):
+            db.insert_with_fresh_id(col, {"loan_id": "L"}, "loan_id", lambda: "L", attempts=3)
+        self.assertEqual(col.insert_one.call_count, 3)
+
+    def test_bulk_shares_redraw_colliding_shared_ids(self):
+        request = APIRequestFactory().post("/api/bulk-share-profile/", {"targets": [
+            {"practitioner_id": "DR-1"}, {"practitioner_id": "DR-404"}, {"organization_id": "HOSP-1"},
+        ]}, format="json")
+        force_authenticate(request, SimpleNamespace(is_authenticated=True, email="p@x.com"))
+        ids = iter(["SHARE-1", "SHARE-2", "SHARE-3"])
+
+        with override_settings(FHIR_ASYNC_CONVERSION=True), \
+                mock.patch("core.views.generate_shared_id", lambda: next(ids)), \
+                mock.patch("core.views.get_by_email", return_value={"patient_id": "PAT-1", "first_name": "Asha"}), \
+                mock.patch("core.views.get_many_by_id", side_effect=lambda kind, ids: {i: {} for i in ids if "404" not in i}), \
+                mock.patch("core.views.enqueue_conversions") as enqueue, \
+                mock.patch("core.views.shared_profiles_col") as shares:
+            # SHARE-1 is already taken by another patient's share
+            shares.insert_one.side_effect = [self.collision("shared_id"), None, None]
+            response = views.bulk_share_profile(request)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(shares.insert_one.call_count, 3)
+        self.assertEqual([r.get("shared_id") for r in response.data["results"]], ["SHARE-3", None, "SHARE-2"])
+        enqueue.assert_called_once_with(["SHARE-3", "SHARE-2"])
+
+    def test_id_indexes_are_unique_only_where_the_id_is_set(self):
+        # update_profile upserts organizations for other roles with no organization_id
+        for collection, field in [("patients", "patient_id"), ("practitioners", "practitioner_id"),
+                                  ("organizations", "organization_id"), ("loan_providers", "loan_provider_id"),
+                                  ("shared_profiles", "shared_id")]:
+            with self.subTest(collection=collection):
+                index = next(i.document for i in INDEXES[collection] if i.document["name"] == f"{field}_unique")
+                self.assertTrue(index["unique"])
+                self.assertEqual(index["partialFilterExpression"], {field: {"$exists": True}})
+
+
+class BulkShareTests(SimpleTestCase):
+    patient = {"patient_id": "PAT-1", "first_name": "Asha"}
+
+    def share(self, targets, **fields):
+        request = APIRequestFactory().post("/api/bulk-share-profile/", {"targets": targets, **fields}, format="json")
+        force_authenticate(request, SimpleNamespace(is_authenticated=True, email="p@x.com"))
+        ids = (f"SHARE-{n}" for n in range(1, 100))
+        with mock.patch("core.views.generate_shared_id", lambda: next(ids)), \
+                mock.patch("core.views.get_by_email", return_value=self.patient), \
+                mock.patch("core.views.get_many_by_id",
+                           side_effect=lambda kind, ids: {i: {kind: i} for i in ids if "404" not in i}) as lookup, \
+                mock.patch("core.views.convert_shared_profiles") as convert, \
+                mock.patch("core.views.shared_profiles_col") as shares, \
+                override_settings(FHIR_ASYNC_CONVERSION=False):
+            response = views.bulk_share_profile(request)
+        return response, [c.args[0] for c in shares.insert_one.call_args_list], convert, lookup
+
+    def test_valid_targets_are_shared_and_invalid_ones_reported(self):
+        response, inserted, convert, lookup = self.share(
+            [{"practitioner_id": "DR-1", "illness_reason": "Fever"}, "DR-2", {}, {"organization_id": "HOSP-404"},
+             {"organization_id": "HOSP-1"}, {"practitioner_id": "DR-1"}],
+            illness_reason="Checkup",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data["created"], response.data["failed"]), (3, 3))
+        self.assertEqual([r.get("shared_id") or r["error"] for r in response.data["results"]], [
+            "SHARE-1", "target must be an object", "practitioner_id or organization_id required",
+            "Invalid hospital selected", "SHARE-2", "SHARE-3",
+        ])
+        # Per-target fields override the request-wide ones
+        self.assertEqual([doc["illness_reason"] for doc in inserted], ["Fever", "Checkup", "Checkup"])
+        # Recipients are looked up once per kind, not once per target
+        self.assertEqual(sorted((c.args[0], sorted(c.args[1])) for c in lookup.call_args_list),
+                         [("doctor", ["DR-1"]), ("hospital", ["HOSP-1", "HOSP-404"])])
+        convert.assert_called_once()
+        self.assertEqual({r["fhir_status"] for r in response.data["results"] if "shared_id" in r}, {"converted"})
+
+    def test_no_valid_target_shares_nothing(self):
+        response, inserted, convert, _ = self.share([{"practitioner_id": "DR-404"}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["created"], 0)
+        self.assertEqual(inserted, [])
+        convert.assert_not_called()
+
+    def test_target_list_is_validated(self):
+        self.assertEqual(self.share([])[0].status_code, 400)
+        self.assertEqual(self.share({"practitioner_id": "DR-1"})[0].status_code, 400)
+        response, inserted, _, _ = self.share([{"practitioner_id": "DR-1"}] * (views.MAX_BULK_SHARE_TARGETS + 1))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(inserted, [])
+
+
+class IndexRegistryTests(SimpleTestCase):
+
+    def test_index_check_fails_on_a_collection_scan(self):
+        plans = {
+            "patients": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}},
+            "shared_profiles": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}},
+        }
+
+        def collection(name):
+            cursor = mock.Mock()
+            cursor.sort.return_value = cursor
+            cursor.explain.return_value = {"queryPlanner": {"winningPlan": plans.get(name, {"stage": "IXSCAN"})}}
+            return mock.Mock(**{"find.return_value": cursor})
+
+        database = mock.MagicMock()
+        database.__getitem__.side_effect = collection
+        shapes = {(view, col): stages for view, col, _, stages in explain_query_shapes(database)}
+        self.assertEqual(shapes[("login/get_profile", "patients")], ["FETCH", "IXSCAN"])
+        self.assertEqual(shapes[("patient_shared_profiles", "shared_profiles")], ["SORT", "COLLSCAN"])
+
+        with mock.patch("core.management.commands.ensure_indexes.explain_query_shapes",
+                        lambda: explain_query_shapes(database)):
+            with self.assertRaisesMessage(CommandError, "patient_shared_profiles (shared_profiles)"):
+                call_command("ensure_indexes", no_create=True, stdout=io.StringIO())
+            plans.pop("shared_profiles")
+            out = io.StringIO()
+            call_command("ensure_indexes", no_create=True, stdout=out)
+        self.assertIn("All view query shapes use an index", out.getvalue())
+
+
+class LoanImportTests(SimpleTestCase):
+
+    def test_hospital_can_only_file_for_patients_who_shared_with_it(self):
+        rows = (
+            "patient_id,loan_provider_id,required_amount,preferred_tenure,monthly_income\n"
+            "PAT-1,LP-1,50000,12,40000\n"
+            "PAT-2,LP-1,50000,12,40000\n"
+        )
+        with mock.patch("core.loans.shared_profiles_col") as shares, \
+                mock.patch("core.loans.patients_col") as patients, \
+                mock.patch("core.loans.loan_providers_col") as providers:
+            shares.distinct.return_value = ["PAT-1"]
+            patients.find.return_value = [{"patient_id": "PAT-1", "first_name": "Asha", "last_name": "Rao"}]
+            providers.find.return_value = [{"loan_provider_id": "LP-1"}]
+            report = import_loans(io.BytesIO(rows.encode()), "csv", dry_run=True, organization_id="HOSP-1")
+
+        self.assertEqual(shares.distinct.call_args.args[1]["organization_id"], "HOSP-1")
+        self.assertEqual(patients.find.call_args.args[0], {"patient_id": {"$in": ["PAT-1"]}})
+        self.assertEqual(report["inserted"], 1)
+        self.assertEqual(report["errors"], [{"line": 3, "error": "Patient not found"}])
+
+    def test_malformed_rows_fail_alone(self):
+        rows = [
+            {"patient_id": "PAT-1", "loan_provider_id": "LP-1", "required_amount": 50000, "preferred_tenure": 12},
+            {"patient_id": ["PAT-1"], "loan_provider_id": "LP-1", "required_amount": 50000, "preferred_tenure": 12},
+            {"patient_id": "PAT-1", "loan_provider_id": {"id": "LP-1"}, "required_amount": 50000, "preferred_tenure": 12},
+            {"patient_id": "PAT-1", "loan_provider_id": "LP-1", "required_amount": 1e400, "preferred_tenure": 12},
+            {"patient_id": "PAT-1", "loan_provider_id": "LP-1", "required_amount": 1e300, "preferred_tenure": 12},
+            {"patient_id": "PAT-1", "loan_provider_id": "LP-1", "required_amount": 60000, "preferred_tenure": 24},
+        ]
+        body = "".join(json.dumps(row) + "\n" for row in rows)  # 1e400 is written as Infinity
+        with mock.patch("core.loans.patients_col") as patients, \
+                mock.patch("core.loans.loan_providers_col") as providers:
+            patients.find.return_value = [{"patient_id": "PAT-1", "first_name": "Asha", "last_name": "Rao"}]
+            providers.find.return_value = [{"loan_provider_id": "LP-1"}]
+            report = import_loans(io.BytesIO(body.encode()), "ndjson", chunk_size=1, dry_run=True)
+
+        self.assertEqual(report["rows"], 6)
+        self.assertEqual(report["inserted"], 2)
+        self.assertEqual(report["errors"], [
+            {"line": 2, "error": "patient_id must be a string"},
+            {"line": 3, "error": "loan_provider_id must be a string"},
+            {"line": 4, "error": "required_amount must be an integer"},
+            {"line": 5, "error": "required_amount is out of range"},
+        ])
+
+
+def _legacy_analytics(loans):
+    """The dashboard response as loan_provider_analytics built it, one count_documents per bucket."""
+    def count(**query):
+        def matches(loan):
+            for field, expected in query.items():
+                value = loan.get(field)
+                if isinstance(expected, dict):
+                    if not isinstance(value, int) or not all(
+                            {"$gt": value > bound, "$gte": value >= bound, "$lte": value <= bound}[op]
+                            for op, bound in expected.items()):
+                        return False
+                elif value != expected:
+                    return False
+            return True
+        return sum(1 for loan in loans if matches(loan))
+
+    total = count()
+    approved = count(status="Approved")
+    tenures = Counter(loan["preferred_tenure"] for loan in loans)
+    days = Counter(loan["created_at"].strftime("%Y-%m-%d") for loan in loans)
+    return {
+        "total": total,
+        "approved": approved,
+        "rejected": count(status="Rejected"),
+        "pending": count(status="Pending"),
+        "approval_rate": round((approved / total * 100) if total > 0 else 0, 1),
+        "risk_dist": {"low": count(risk="LOW"), "medium": count(risk="MEDIUM"), "high": count(risk="HIGH")},
+        "residence_dist": {"urban": count(hospital_location="Urban"), "rural": count(hospital_location="Rural")},
+        "portfolio_health": [
+            {"_id": risk.capitalize(), "approved": count(risk=risk, status="Approved"),
+             "pending": count(risk=risk, status="Pending"), "rejected": count(risk=risk, status="Rejected")}
+            for risk in ["LOW", "MEDIUM", "HIGH"]
+        ],
+        "tenure_dist": [{"tenure": f"{t} M", "count": tenures[t]} for t in sorted(tenures)],
+        "submission_trend": [{"date": d, "count": days[d]} for d in sorted(days)[:7]],
+        "demographics": [
+            {"range": "18-30", "count": count(age={"$gte": 18, "$lte": 30})},
+            {"range": "31-45", "count": count(age={"$gte": 31, "$lte": 45})},
+            {"range": "46-60", "count": count(age={"$gte": 46, "$lte": 60})},
+            {"range": "60+", "count": count(age={"$gt": 60})},
+        ],
+    }
+
+
+class LoanAnalyticsTests(SimpleTestCase):
+    loans = [
+        {"risk": "LOW", "status": "Approved", "hospital_location": "Urban", "preferred_tenure": 12, "age": 25,
+         "created_at": datetime(2025, 3, 1, 9)},
+        {"risk": "LOW", "status": "Pending", "hospital_location": "Rural", "preferred_tenure": 12, "age": 40,
+         "created_at": datetime(2025, 3, 1, 17)},
+        {"risk": "MEDIUM", "status": "Approved", "hospital_location": "Urban", "preferred_tenure": 24, "age": 50,
+         "created_at": datetime(2025, 3, 2)},
+        {"risk": "HIGH", "status": "Rejected", "hospital_location": "Urban", "preferred_tenure": 36, "age": 65,
+         "created_at": datetime(2025, 3, 3)},
+        {"risk": "HIGH", "status": "Rejected", "hospital_location": "Rural", "preferred_tenure": 6, "age": 17,
+         "created_at": datetime(2025, 3, 3)},
+    ]
+    # What the $facet stage returns for those loans; $group output is in no particular order
+    facets = {
+        "risk_status": [
+            {"_id": {"risk": "HIGH", "status": "Rejected"}, "count": 2},
+            {"_id": {"risk": "LOW", "status": "Approved"}, "count": 1},
+            {"_id": {"risk": "MEDIUM", "status": "Approved"}, "count": 1},
+            {"_id": {"risk": "LOW", "status": "Pending"}, "count": 1},
+        ],
+        "location": [{"_id": "Rural", "count": 2}, {"_id": "Urban", "count": 3}],
+        "tenure": [{"_id": 24, "count": 1}, {"_id": 6, "count": 1}, {"_id": 36, "count": 1}, {"_id": 12, "count": 2}],
+        "trend": [{"_id": "2025-03-01", "count": 2}, {"_id": "2025-03-02", "count": 1}, {"_id": "2025-03-03", "count": 2}],
+        "age": [{"_id": None, "count": 1}, {"_id": "60+", "count": 1}, {"_id": "18-30", "count": 1},
+                {"_id": "31-45", "count": 1}, {"_id": "46-60", "count": 1}],
+    }
+
+    def test_facet_summary_matches_the_legacy_counts(self):
+        summary = summarize_counters(counters_from_facets(self.facets))
+        self.assertEqual(summary, _legacy_analytics(self.loans))
+        self.assertEqual(summary["approval_rate"], 40.0)
+        self.assertEqual([t["tenure"] for t in summary["tenure_dist"]], ["6 M", "12 M", "24 M", "36 M"])
+
+    def test_rollup_counters_summarize_like_the_facets(self):
+        counters = build_rollups([{**loan, "loan_provider_id": "LP-1"} for loan in self.loans])["LP-1"]
+        self.assertEqual(summarize_counters(counters), summarize_counters(counters_from_facets(self.facets)))
+
+    def test_no_loans(self):
+        self.assertEqual(summarize_counters(counters_from_facets({})), _legacy_analytics([]))
+
+
+class LoanRollupTests(SimpleTestCase):
+    loan = {"loan_provider_id": "LP-1", "risk": "LOW", "status": "Pending", "age": 30}
+
+    def test_new_loan_never_creates_a_rollup(self):
+        col = mock.Mock()
+        record_loan_created(self.loan, col)
+        args, kwargs = col.update_one.call_args
+        self.assertFalse(kwargs.get("upsert"))
+        self.assertEqual(args[1]["$inc"]["total"], 1)
+        self.assertEqual(args[1]["$inc"]["version"], 1)
+
+    def test_rebuild_does_not_overwrite_a_rollup_that_moved(self):
+        counters = build_rollups([self.loan])["LP-1"]
+        with mock.patch("core.management.commands.rebuild_loan_rollups.loan_analytics_col") as col:
+            col.replace_one.return_value.matched_count = 0
+            self.assertFalse(write_rollup("LP-1", counters, {"total": 3, "version": 7}))
+            selector, doc = col.replace_one.call_args.args
+            self.assertEqual(selector, {"loan_provider_id": "LP-1", "version": 7})
+            self.assertEqual(doc["version"], 8)
+
+    def test_rebuild_of_a_new_provider_starts_from_a_placeholder(self):
+        counters = build_rollups([self.loan])["LP-1"]
+        with mock.patch("core.management.commands.rebuild_loan_rollups.loan_analytics_col") as col:
+            # Counters scanned before a rollup existed may miss loans created meanwhile
+            self.assertFalse(write_rollup("LP-1", counters, None))
+            placeholder = col.insert_one.call_args.args[0]
+            self.assertEqual((placeholder["version"], placeholder["placeholder"]), (0, True))
+            col.replace_one.assert_not_called()
+
+            col.insert_one.side_effect = DuplicateKeyError("exists")
+            self.assertFalse(write_rollup("LP-1", counters, None))
+
+    def test_placeholder_rollups_are_read_as_missing(self):
+        with mock.patch("core.analytics.loan_analytics_col") as col, \
+                mock.patch("core.analytics.compute_provider_analytics", return_value={"total": 2}) as fallback:
+            col.find_one.return_value = {"loan_provider_id": "LP-1", "version": 1, "placeholder": True, "total": 1}
+            self.assertEqual(read_provider_analytics("LP-1"), {"total": 2})
+        fallback.assert_called_once_with("LP-1")
+
+
+class LoanRoutingTests(SimpleTestCase):
+    def test_update_is_not_taken_for_a_loan_id(self):
+        self.assertEqual(resolve("/api/loan/provider/update/").route, "api/loan/provider/update/")
+        self.assertEqual(resolve("/api/loan/provider/LOAN-1/").route, "api/loan/provider/<str:loan_id>/")
+
+
+def _command(name, documents=0):
+    return SimpleNamespace(command_name=name, duration_micros=2000, reply={"cursor": {"firstBatch": [{}] * documents}})
+
+
+class MetricsTests(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(metrics, "registry", metrics.MetricsRegistry())
+        self.registry = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_view(self, view):
+        def get_response(request):
+            request.resolver_match = SimpleNamespace(route="api/things/<str:thing_id>/")
+            return view()
+
+        response = metrics.MetricsMiddleware(get_response)(RequestFactory().get("/api/things/1/"))
+        return response
+
+    def render(self):
+        return "\n".join(self.registry.render())
+
+    def test_commands_are_attributed_to_the_route(self):
+        def view():
+            for _ in range(25):
+                metrics.command_metrics.succeeded(_command("find", documents=2))
+            return HttpResponse(b"x" * 300)
+
+        self.run_view(view)
+        metrics.command_metrics.succeeded(_command("insert"))
+        text = self.render()
+        route = 'route="/api/things/<str:thing_id>/"'
+        self.assertIn(f'http_requests_total{{{route},method="GET",status="200"}} 1', text)
+        self.assertIn(f'mongo_commands_total{{{route},command="find"}} 25', text)
+        self.assertIn(f'mongo_commands_per_request_bucket{{{route},le="10"}} 0', text)
+        self.assertIn(f'mongo_commands_per_request_bucket{{{route},le="25"}} 1', text)
+        self.assertIn(f'mongo_documents_returned_total{{{route}}} 50', text)
+        self.assertIn(f'http_response_size_bytes_bucket{{{route},le="256"}} 0', text)
+        self.assertIn('mongo_commands_total{route="(none)",command="insert"} 1', text)
+
+    def test_streamed_responses_are_recorded_when_consumed(self):
+        def chunks():
+            yield b"a" * 10
+            metrics.command_metrics.succeeded(_command("getMore", documents=3))
+            yield b"b" * 10
+
+        response = self.run_view(lambda: StreamingHttpResponse(chunks()))
+        self.assertNotIn("http_requests_total{", self.render())
+        self.assertEqual(b"".join(response.streaming_content), b"a" * 10 + b"b" * 10)
+        text = self.render()
+        self.assertIn('mongo_commands_total{route="/api/things/<str:thing_id>/",command="getMore"} 1', text)
+        self.assertIn('http_response_size_bytes_sum{route="/api/things/<str:thing_id>/"} 20.0', text)
+
+    @override_settings(METRICS_ALLOWED_NETWORKS=["10.0.0.0/8"])
+    def test_scrape_is_limited_to_allowed_networks(self):
+        factory = RequestFactory()
+        with self.assertRaises(metrics.Http404):
+            metrics.metrics_view(factory.get("/api/metrics", REMOTE_ADDR="8.8.8.8"))
+        response = metrics.metrics_view(factory.get("/api/metrics", REMOTE_ADDR="10.1.2.3"))
+        self.assertIn(b"# TYPE mongo_pool_open gauge", response.content)
+
+
+def _started(command):
+    return SimpleNamespace(command_name=next(iter(command)), command=command, request_id=id(command), connection_id=None)
+
+
+class ClaimsAuthenticationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = User.objects.create_user("dr@example.com", "secret", role="doctor")
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def authenticate(self, token):
+        request = self.factory.get("/api/profile/", HTTP_AUTHORIZATION=f"Bearer {token}")
+        return ClaimsJWTAuthentication().authenticate(request)
+
+    def test_tokens_carry_the_principal_claims(self):
+        access = tokens_for(self.doctor, {"practitioner_id": "DR-1", "patient_id": "PAT-1"}).access_token
+        self.assertEqual(access["email"], "dr@example.com")
+        self.assertEqual(access["role"], "doctor")
+        self.assertEqual(access[TOKEN_VERSION_CLAIM], 0)
+        self.assertEqual(access["practitioner_id"], "DR-1")
+        # Only the role's own domain ID is carried
+        self.assertNotIn("patient_id", access)
+        self.assertNotIn("is_staff", access)
+        self.assertNotIn("practitioner_id", tokens_for(self.doctor, {}).access_token)
+
+    def test_claims_authenticate_without_loading_the_user(self):
+        token = tokens_for(self.doctor, {"practitioner_id": "DR-1"}).access_token
+        with self.assertNumQueries(1):
+            user, _ = self.authenticate(token)
+        self.assertIsInstance(user, ClaimsUser)
+        self.assertEqual((user.email, user.role, user.domain_id), ("dr@example.com", "doctor", "DR-1"))
+        # The token version is cached
+        with self.assertNumQueries(0):
+            self.authenticate(token)
+
+    def test_revoked_tokens_are_rejected(self):
+        old = tokens_for(self.doctor, {}).access_token
+        self.authenticate(old)
+        revoke_tokens(self.doctor.pk)
+        with self.assertRaisesMessage(AuthenticationFailed, "Token has been revoked"):
+            self.authenticate(old)
+
+        self.doctor.refresh_from_db()
+        self.assertEqual(self.doctor.token_version, 1)
+        user, _ = self.authenticate(tokens_for(self.doctor, {}).access_token)
+        self.assertEqual(user.email, "dr@example.com")
+
+    def test_inactive_users_tokens_are_rejected(self):
+        token = tokens_for(self.doctor, {}).access_token
+        User.objects.filter(pk=self.doctor.pk).update(is_active=False)
+        with self.assertRaisesMessage(AuthenticationFailed, "Token has been revoked"):
+            self.authenticate(token)
+
+    def test_tokens_without_claims_resolve_the_user_row(self):
+        user, _ = self.authenticate(RefreshToken.for_user(self.doctor).access_token)
+        self.assertEqual(user.pk, self.doctor.pk)
+        self.assertIsInstance(user, User)
+
+
+class QueryBudgetTests(TestCase):
+
+    def test_capture_records_sql_and_masked_mongo_commands(self):
+        with capture_queries() as captured:
+            User.objects.filter(email="a@example.com").first()
+            metrics.command_metrics.started(_started({"find": "patients", "filter": {"email": "a@example.com"}}))
+            metrics.command_metrics.started(_started({
+                "update": "shared_profiles",
+                "updates": [{"q": {"shared_id": {"$in": ["S-1", "S-2"]}}, "u": {}}],
+            }))
+        metrics.command_metrics.started(_started({"find": "patients", "filter": {}}))
+
+        self.assertEqual(len(captured.sql), 1)
+        self.assertEqual(captured.mongo, [
+            'find patients {"email":"?"}',
+            'update shared_profiles [{"shared_id":{"$in":["?"]}}]',
+        ])
+        self.assertEqual(captured.mongo_keys, ["find patients", "update shared_profiles"])
+
+    def test_report_diffs_the_commands_over_budget(self):
+        with capture_queries() as captured:
+            metrics.command_metrics.started(_started({"find": "loan_provider_analytics", "filter": {"loan_provider_id": "LP-1"}}))
+            metrics.command_metrics.started(_started({
+                "aggregate": "loan_requests",
+                "pipeline": [{"$match": {"loan_provider_id": "LP-1"}}, {"$facet": {}}],
+            }))
+        route = "/api/loan/provider/analytics/"
+
+        report = budget_report(route, captured, QUERY_BUDGETS[route])
+        self.assertIn("2 Mongo (budget 1)", report)
+        self.assertIn("\n find loan_provider_analytics\n+aggregate loan_requests\n", report)
+        self.assertIn('  2. aggregate loan_requests ["$match","$facet"]', report)
+        with self.assertRaises(AssertionError):
+            assert_within_budget(route, captured, QUERY_BUDGETS[route])
+        self.assertIsNone(budget_report(route, captured, Budget(mongo=[
+            "find loan_provider_analytics", "aggregate loan_requests", "find loan_requests",
+        ])))
+
+    def test_different_commands_at_the_same_count_are_over_budget(self):
+        with capture_queries() as captured:
+            metrics.command_metrics.started(_started({
+                "aggregate": "loan_requests",
+                "pipeline": [{"$match": {"loan_provider_id": "LP-1"}}, {"$facet": {}}],
+            }))
+        route = "/api/loan/provider/analytics/"
+
+        report = budget_report(route, captured, QUERY_BUDGETS[route])
+        self.assertIn("1 Mongo (budget 1)", report)
+        self.assertIn("-find loan_provider_analytics\n+aggregate loan_requests", report)
+        self.assertIsNotNone(budget_report(route, captured, Budget(mongo=["find a", "find b"])))
+
+    def test_sql_over_budget_lists_the_statements(self):
+        with capture_queries() as captured:
+            User.objects.count()
+            User.objects.exists()
+        report = budget_report("/api/auth/login/", captured, Budget(sql=1, mongo=["find patients"]))
+        self.assertIn("2 SQL (budget 1)", report)
+        self.assertIn("  2. SELECT", report)
+        self.assertNotIn("+++ issued", report)
+
+
+def _succeeded(started):
+    return SimpleNamespace(command_name=started.command_name, request_id=started.request_id,
+                           connection_id=None, duration_micros=4000, reply={"cursor": {"firstBatch": [{}]}})
+
+
+# Each async view next to the sync view it replaces under ASYNC_VIEWS
+PARITY_ROUTES = [
+    ("recipients/", "get_recipients"),
+    ("loan/provider/analytics/", "loan_provider_analytics"),
+    ("loan/provider/requests/", "loan_provider_requests"),
+    ("patient/fhir-profiles/", "patient_fhir_profiles"),
+    ("share-profile/<str:shared_id>/status/", "shared_profile_status"),
+    ("share-profile/<str:shared_id>/", "delete_shared_profile"),
+]
+
+
+class ParityURLs:
+    urlpatterns = [
+        path(f"{side}/{route}", getattr(module, name))
+        for side, module in (("sync", views), ("async", async_views))
+        for route, name in PARITY_ROUTES
+    ]
+
+
+@override_settings(ROOT_URLCONF=ParityURLs)
+class AsyncViewParityTests(TestCase):
+    """The async views answer like the sync ones, through the full ASGI stack."""
+
+    paths = ["recipients/", "loan/provider/analytics/", "loan/provider/requests/",
+             "patient/fhir-profiles/", "share-profile/S1/status/"]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.provider = User.objects.create_user("lp@example.com", "secret", role="loan_provider")
+
+    def setUp(self):
+        cache.clear()
+        self.auth = {"Authorization": f"Bearer {tokens_for(self.provider, {'loan_provider_id': 'LP-1'}).access_token}"}
+
+    async def assertSame(self, method, path, **extra):
+        sync, async_ = [
+            await getattr(self.async_client, method)(f"/{side}/{path}", **extra) for side in ("sync", "async")
+        ]
+        label = f"{method.upper()} {path}"
+        self.assertEqual(async_.status_code, sync.status_code, label)
+        self.assertEqual(json.loads(async_.content or "null"), json.loads(sync.content or "null"), label)
+        for header in ("Allow", "Vary", "WWW-Authenticate", "ETag"):
+            self.assertEqual(async_.get(header), sync.get(header), f"{label} {header}")
+        return async_
+
+    async def test_unsupported_methods(self):
+        for path in self.paths:
+            for method in ("post", "put", "patch", "delete"):
+                response = await self.assertSame(method, path, headers=self.auth)
+                self.assertEqual(response.status_code, 405)
+        response = await self.assertSame("get", "share-profile/S1/", headers=self.auth)
+        self.assertEqual(response.status_code, 405)
+        await self.assertSame("options", "loan/provider/analytics/", headers=self.auth)
+
+    async def test_authentication_failures(self):
+        for path in self.paths[1:]:
+            response = await self.assertSame("get", path)
+            self.assertEqual(response.status_code, 401)
+            await self.assertSame("post", path)
+        for path in self.paths:
+            response = await self.assertSame("get", path, headers={"Authorization": "Bearer not-a-token"})
+            self.assertEqual(response.status_code, 401)
+
+        await sync_to_async(revoke_tokens)(self.provider.pk)
+        response = await self.assertSame("get", "loan/provider/analytics/", headers=self.auth)
+        self.assertEqual(response.json()["detail"], "Token has been revoked")
+
+    async def test_analytics(self):
+        payload = {"total": 3, "approved": 1, "pending": 2, "approval_rate": 33.3}
+        with mock.patch("core.views.read_provider_analytics", return_value=payload), \
+                mock.patch("core.async_views.async_read_provider_analytics", mock.AsyncMock(return_value=payload)):
+            response = await self.assertSame("get", "loan/provider/analytics/", headers=self.auth)
+        self.assertEqual(response.json(), payload)
+
+    async def test_recipients_and_revalidation(self):
+        body = b'{"doctors":[],"hospitals":[{"organization_id":"HOSP-1","name":"City"}],"loan_providers":[]}'
+        with mock.patch("core.views.directory_version", return_value=3), \
+                mock.patch("core.async_views.async_directory_version", mock.AsyncMock(return_value=3)), \
+                mock.patch.object(recipients_directory, "render", return_value=(3, body)), \
+                mock.patch.object(recipients_directory, "arender", mock.AsyncMock(return_value=(3, body))):
+            response = await self.assertSame("get", "recipients/")
+            self.assertEqual(response.content, body)
+            response = await self.assertSame("get", "recipients/", headers={"If-None-Match": etag_for(3)})
+            self.assertEqual(response.status_code, 304)
+
+
+class ProfilingTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overrides = override_settings(PROFILING_REPORT_DIR=directory.name, PROFILING_SAMPLE_INTERVAL=0.001)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.factory = RequestFactory()
+
+    def run_view(self, request):
+        def view():
+            find = _started({"find": "loan_requests", "filter": {"loan_provider_id": "LP-1"}})
+            metrics.command_metrics.started(find)
+            metrics.command_metrics.succeeded(_succeeded(find))
+            self.kept = [bytes(1000) for _ in range(200)]
+            time.sleep(0.02)
+            return HttpResponse(b"{}")
+
+        def get_response(request):
+            self.seen = request
+            request.resolver_match = SimpleNamespace(route="api/loan/provider/analytics/")
+            return view()
+
+        return profiling.ProfilingMiddleware(get_response)(request)
+
+    def test_unflagged_requests_are_not_profiled(self):
+        response = self.run_view(self.factory.get("/api/loan/provider/analytics/"))
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(profiling.list_reports(), [])
+
+    def test_signed_header_stores_a_sampled_report(self):
+        request = self.factory.get("/api/loan/provider/analytics/", HTTP_X_PROFILE=profiling.profile_token())
+        response = self.run_view(request)
+
+        report = profiling.load_report(response["X-Profile-Id"])
+        self.assertEqual(report["route"], "/api/loan/provider/analytics/")
+        self.assertEqual(report["mode"], "sample")
+        self.assertGreater(report["samples"], 0)
+        self.assertTrue(any("view (core/tests.py" in stack for stack in report["stacks"]))
+        self.assertEqual(report["mongo"][0]["command"], 'find loan_requests {"loan_provider_id":"?"}')
+        self.assertEqual(report["mongo"][0]["ms"], 4.0)
+        self.assertTrue(any(a["size"] >= 200000 and "core/tests.py" in a["traceback"][0] for a in report["allocations"]))
+        self.assertEqual(profiling.list_reports()[0]["id"], report["id"])
+
+    def test_reports_count_requests_that_overlap_the_profiled_one(self):
+        request = self.factory.get("/api/x/", HTTP_X_PROFILE=profiling.profile_token())
+        report = profiling.load_report(self.run_view(request)["X-Profile-Id"])
+        self.assertEqual(report["memory_scope"], "process")
+        self.assertEqual(report["overlapping_requests"], 0)
+
+        other = profiling.ProfilingMiddleware(lambda request: HttpResponse(b"{}"))
+        with mock.patch.object(time, "sleep", lambda seconds: other(self.factory.get("/api/other/"))):
+            report = profiling.load_report(self.run_view(request)["X-Profile-Id"])
+        self.assertEqual(report["overlapping_requests"], 1)
+        self.assertEqual(sorted(r["overlapping_requests"] for r in profiling.list_reports()), [0, 1])
+        self.assertEqual(profiling.in_flight.snapshot()[1], 0)
+
+    def test_trace_mode_keeps_functions_with_callers(self):
+        request = self.factory.get("/api/x/", HTTP_X_PROFILE=profiling.profile_token("trace"))
+        report = profiling.load_report(self.run_view(request)["X-Profile-Id"])
+        view = next(f for f in report["functions"] if f["function"].startswith("view (core/tests.py"))
+        self.assertEqual(view["calls"], 1)
+        self.assertTrue(view["callers"][0]["function"].startswith("get_response"))
+        self.assertNotIn("stacks", report)
+
+    def test_forged_or_expired_headers_are_ignored(self):
+        forged = self.factory.get("/api/x/", HTTP_X_PROFILE="trace:1xIPkR:forged")
+        self.assertNotIn("X-Profile-Id", self.run_view(forged))
+        with override_settings(PROFILING_TOKEN_MAX_AGE=-1):
+            expired = self.factory.get("/api/x/", HTTP_X_PROFILE=profiling.profile_token())
+            self.assertNotIn("X-Profile-Id", self.run_view(expired))
+
+    def test_query_flag_is_for_staff_only_and_hidden_from_views(self):
+        staff = (SimpleNamespace(is_staff=True), None)
+        with mock.patch.object(profiling, "_authenticate", return_value=None):
+            response = self.run_view(self.factory.get("/api/x/", {"_profile": "trace", "limit": "5"}))
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(dict(self.seen.GET), {"limit": ["5"]})
+        with mock.patch.object(profiling, "_authenticate", return_value=staff):
+            response = self.run_view(self.factory.get("/api/x/", {"_profile": "trace"}))
+        self.assertEqual(profiling.load_report(response["X-Profile-Id"])["mode"], "trace")
+
+    def test_staff_tokens_carry_is_staff(self):
+        staff = User(id=7, email="ops@example.com", role="doctor", is_staff=True)
+        patient = User(id=8, email="pat@example.com", role="patient")
+        self.assertTrue(ClaimsUser(tokens_for(staff, {}).access_token).is_staff)
+        self.assertFalse(ClaimsUser(tokens_for(patient, {}).access_token).is_staff)
+
+    def test_oldest_reports_are_dropped(self):
+        with override_settings(PROFILING_MAX_REPORTS=2):
+            for second in range(3):
+                profiling.save_report({"id": f"20260101T00000{second}-0000000{second}", "path": "/api/x/"})
+        self.assertEqual([r["id"] for r in profiling.list_reports()],
+                         ["20260101T000002-00000002", "20260101T000001-00000001"])
+        self.assertIsNone(profiling.load_report("../settings"))
+
+
+class EndpointQueryBudgetTests(TestCase):
+    """QUERY_BUDGETS against the real views; needs a reachable MongoDB (MONGO_URI).
+
+    Skipped locally without one; CI sets MONGO_TESTS_REQUIRED so they fail instead.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            MongoClient(os.getenv("MONGO_URI"), serverSelectionTimeoutMS=1000).admin.command("ping")
+        except Exception:
+            if os.getenv("MONGO_TESTS_REQUIRED", "false").lower() == "true":
+                raise
+            raise SkipTest("MongoDB is not reachable")
+        super().setUpClass()
+        cls.env = mock.patch.dict(os.environ, {"MONGO_DB_NAME": f"test_{os.getenv('MONGO_DB_NAME') or 'healthcare'}"})
+        cls.env.start()
+        db.close_client()
+        db.get_client().drop_database(os.environ["MONGO_DB_NAME"])
+
+        now = datetime.utcnow()
+        cls.patient = {"email": "pat@example.com", "password": make_password("secret"),
+                       "patient_id": "PAT-1", "first_name": "Ada", "last_name": "Lovelace"}
+        cls.provider = {"email": "lp@example.com", "password": make_password("secret"), "loan_provider_id": "LP-1"}
+        db.patients_col.insert_one(dict(cls.patient))
+        db.loan_providers_col.insert_one(dict(cls.provider))
+        db.shared_profiles_col.insert_many([
+            {"shared_id": f"SHARE-{i}", "patient_id": "PAT-1", "shared_at": now} for i in range(5)
+        ])
+        db.fhir_patients_col.insert_many([
+            {"shared_id": f"SHARE-{i}", "patient_id": "PAT-1", "created_at": now,
+             "fhir_resource": {"resourceType": "Bundle", "type": "collection", "entry": []}}
+            for i in range(5)
+        ])
+        db.loan_requests_col.insert_many([
+            {"loan_id": f"LOAN-{i}", "loan_provider_id": "LP-1", "required_amount": 50000, "risk": "Low",
+             "status": "Pending", "created_at": now}
+            for i in range(5)
+        ])
+        db.loan_analytics_col.insert_one({"loan_provider_id": "LP-1", "total": 5, "status": {"Pending": 5}})
+
+    @classmethod
+    def tearDownClass(cls):
+        db.get_client().drop_database(os.environ["MONGO_DB_NAME"])
+        db.close_client()
+        cls.env.stop()
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient_user = User.objects.create_user("pat@example.com", "secret", role="patient")
+        cls.provider_user = User.objects.create_user("lp@example.com", "secret", role="loan_provider")
+
+    def setUp(self):
+        # Budgets are for cold requests
+        cache.clear()
+        entity_cache.clear()
+
+    def get(self, route, path, user, profile):
+        token = tokens_for(user, profile).access_token
+        with query_budget(route, f"GET {path}"):
+            response = self.client.get(path, HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_login(self):
+        with query_budget("/api/auth/login/"):
+            response = self.client.post(
+                "/api/auth/login/", {"email": "pat@example.com", "password": "secret"}, content_type="application/json"
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_patient_endpoints(self):
+        self.get("/api/profile/", "/api/profile/", self.patient_user, self.patient)
+        page = self.get("/api/patient/shared-profiles/", "/api/patient/shared-profiles/?limit=3",
+                        self.patient_user, self.patient)
+        self.assertEqual(len(page.json()["results"]), 3)
+        self.get("/api/patient/fhir-profiles/", "/api/patient/fhir-profiles/?limit=3", self.patient_user, self.patient)
+
+    def test_loan_provider_endpoints(self):
+        analytics = self.get("/api/loan/provider/analytics/", "/api/loan/provider/analytics/",
+                             self.provider_user, self.provider)
+        self.assertEqual(analytics.json()["total"], 5)
+        self.get("/api/loan/provider/requests/", "/api/loan/provider/requests/?limit=3",
+                 self.provider_user, self.provider)
+        self.get("/api/loan/provider/<str:loan_id>/", "/api/loan/provider/LOAN-1/", self.provider_user, self.provider)
@@ -1,28 +1,54 @@
+from django.conf import settings
 from django.urls import path
-from .views import apply_for_loan, get_profile,build_fhir_patient, delete_shared_profile, loan_detail, loan_provider_requests, login, patient_fhir_profiles, patient_loans, patient_shared_profiles, register, get_profile, share_profile, update_loan_status,  update_profile , get_recipients, doctor_shared_profiles, hospital_shared_profiles, respond_to_loan_plan, loan_provider_analytics
+from .metrics import metrics_view
+from .profiling import profile_flamegraph, profile_report, profile_reports
+from .views import apply_for_loan, import_loan_applications, get_profile,build_fhir_patient, fhir_export, fhir_export_file, fhir_export_status, fhir_search, delete_shared_profile, loan_detail, loan_provider_requests, login, revoke_sessions, patient_fhir_profiles, patient_loans, patient_shared_profiles, register, get_profile, share_profile, bulk_share_profile, shared_profile_status, update_loan_status,  update_profile , get_recipients, search_recipients, doctor_shared_profiles, hospital_shared_profiles, respond_to_loan_plan, loan_provider_analytics
 
 
+if settings.ASYNC_VIEWS:
+    # Under ASGI the hot read paths use their async versions (core/async_views.py)
+    from .async_views import (  # noqa: F811
+        delete_shared_profile,
+        get_recipients,
+        loan_provider_analytics,
+        loan_provider_requests,
+        patient_fhir_profiles,
+        shared_profile_status,
+    )
 
 
 urlpatterns = [
     path("auth/register/", register),
     path("auth/login/", login),
+    path("auth/revoke/", revoke_sessions),
     path("profile/", get_profile),
     path("profile/update/", update_profile),
     path("share-profile/", share_profile),
+    path("share-profile/bulk/", bulk_share_profile),
     path("recipients/", get_recipients),
+    path("recipients/search/", search_recipients),
     path("doctor/shared-profiles/", doctor_shared_profiles),
     path("hospital/shared-profiles/", hospital_shared_profiles),
     path("patient/shared-profiles/", patient_shared_profiles),
     path("share-profile/<str:shared_id>/", delete_shared_profile),
+    path("share-profile/<str:shared_id>/status/", shared_profile_status),
     path("patient/fhir-profiles/", patient_fhir_profiles),
+    path("fhir/Patient/", fhir_search),
+    path("fhir/$export", fhir_export),
+    path("fhir/export/<str:export_id>/", fhir_export_status),
+    path("fhir/export/<str:export_id>/<str:file_name>", fhir_export_file),
     path("loan/apply/", apply_for_loan),
+    path("loan/import/", import_loan_applications),
     path("loan/provider/analytics/", loan_provider_analytics),
     path("loan/provider/requests/", loan_provider_requests),
-    path("loan/provider/<str:loan_id>/", loan_detail),
     path("loan/provider/update/", update_loan_status),
+    path("loan/provider/<str:loan_id>/", loan_detail),
     path("loan/patient/", patient_loans),
     path("loan/patient/respond/", respond_to_loan_plan),
+    path("metrics", metrics_view),
+    path("profiles/", profile_reports),
+    path("profiles/<str:report_id>/", profile_report),
+    path("profiles/<str:report_id>/flamegraph", profile_flamegraph),
 
     
 
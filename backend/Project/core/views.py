@@ -1,13 +1,28 @@
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, renderer_classes, parser_classes
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
+from pymongo import ReturnDocument
 from django.contrib.auth import get_user_model
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.permissions import IsAuthenticated
-from .db import patients_col, practitioners_col, organizations_col, shared_profiles_col, fhir_patients_col, loan_providers_col
+from .db import patients_col, practitioners_col, organizations_col, shared_profiles_col, fhir_patients_col, fhir_jobs_col, loan_providers_col, insert_with_fresh_id
 from datetime import datetime
+import os
 import random
 from django.contrib.auth.hashers import make_password, check_password
 import uuid
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from .fhir import build_fhir_patient, convert_shared_profile, convert_shared_profiles, refresh_patient_bundles
+from .fhir_queue import DONE, FAILED, conversion_status, enqueue_conversion, enqueue_conversions
+from .fhir_export import EXPORT_TYPE, OUTPUT_FORMATS, InvalidExport, active_export, delete_export, export_dir, get_export, manifest, parse_since, start_export
+from .authentication import revoke_tokens, tokens_for
+from .directory import bump_directory_version, directory_version, etag_for, etag_matches, recipients_directory
+from .entity_cache import get_by_email, get_by_id, get_many_by_id, invalidate
+from .fhir_search import InvalidSearch, build_search_query, parse_count, searchset
+from .pagination import InvalidPage, keyset_page, list_or_page
+from .search import DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT, SEARCH_KINDS, recipient_search
+from .streaming import STREAMING_RENDERERS, accepts_gzip, gunzip_file
 
 
 
@@ -27,8 +42,46 @@ def generate_organization_id():
 def generate_loan_provider_id():
     return f"LOANP-{random.randint(100000,999999)}"
 
-def generate_loan_id():
-    return f"LOAN-{random.randint(100000,999999)}"
+def caller_id(user, field, col):
+    """The caller's domain ID (patient_id, practitioner_id, ...).
+
+    Read from the token claims when present, otherwise looked up by email.
+    """
+    value = getattr(user, field, None)
+    if value:
+        return value
+    doc = col.find_one({"email": user.email}, {"_id": 0, field: 1})
+    return doc.get(field) if doc else None
+
+
+def generate_shared_id():
+    return f"SHARE-{random.randint(100000,999999)}"
+
+
+def build_shared_doc(patient, email, data, shared_id):
+    return {
+        "shared_id": shared_id,
+        "patient_email": email,
+        "patient_id": patient["patient_id"],
+        "patient_name": patient["first_name"],
+        "gender": patient.get("gender"),
+        "dob": patient.get("dob"),
+        "phone": patient.get("phone"),
+        "address": patient.get("address"),
+        "city": patient.get("city"),
+
+        "blood_group": data.get("blood_group"),
+        "allergies": data.get("allergies"),
+        "illness_reason": data.get("illness_reason"),
+
+        "organization_id": data.get("organization_id"),
+        "practitioner_id": data.get("practitioner_id"),
+
+        # 🔑 NEW FLAG
+        "fhir_converted": False,
+
+        "shared_at": datetime.utcnow()
+    }
 
 
 @api_view(["POST"])
@@ -67,7 +120,7 @@ def register(request):
             "created_at": datetime.utcnow(),
         }
 
-        organizations_col.insert_one(base_doc)
+        insert_with_fresh_id(organizations_col, base_doc, "organization_id", generate_organization_id)
 
     # ---------- DOCTOR ----------
     elif role == "doctor":
@@ -80,7 +133,7 @@ def register(request):
             return Response({"error": "first_name, last_name, specialization, hospital_id required"}, status=400)
 
         # Validate hospital exists
-        hospital = organizations_col.find_one({"organization_id": hospital_id})
+        hospital = get_by_id("hospital", hospital_id)
         if not hospital:
             return Response({"error": "Invalid hospital selected"}, status=400)
 
@@ -105,7 +158,7 @@ def register(request):
             "created_at": datetime.utcnow(),
         }
 
-        practitioners_col.insert_one(base_doc)
+        insert_with_fresh_id(practitioners_col, base_doc, "practitioner_id", generate_practitioner_id)
 
     # ---------- PATIENT ----------
     elif role == "patient":
@@ -135,7 +188,7 @@ def register(request):
             "created_at": datetime.utcnow(),
         }
 
-        patients_col.insert_one(base_doc)
+        insert_with_fresh_id(patients_col, base_doc, "patient_id", generate_patient_id)
     elif role == "loan_provider":
         name = data.get("name")
 
@@ -143,18 +196,24 @@ def register(request):
         user.set_unusable_password()
         user.save()
 
-        loan_providers_col.insert_one({
+        base_doc = {
             "email": email,
             "name": name,
             "role": role,
             "password": make_password(password),
             "loan_provider_id": generate_loan_provider_id(),
             "created_at": datetime.utcnow()
-        })
+        }
+
+        insert_with_fresh_id(loan_providers_col, base_doc, "loan_provider_id", generate_loan_provider_id)
 
     else:
         return Response({"error": "Invalid role"}, status=400)
 
+    invalidate(role, email=email)
+    if role != "patient":
+        recipient_search.add(role, base_doc)
+        bump_directory_version()
     return Response({"message": "Registered successfully", "role": role}, status=201)
 
 @api_view(["POST"])
@@ -186,7 +245,7 @@ def login(request):
     if not doc or not check_password(password, doc["password"]):
         return Response({"error": "Invalid credentials"}, status=401)
 
-    refresh = RefreshToken.for_user(user)
+    refresh = tokens_for(user, doc)
 
     return Response({
         "access": str(refresh.access_token),
@@ -198,14 +257,22 @@ def login(request):
     })
 
 
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def revoke_sessions(request):
+    # Every token issued so far stops working once cached versions expire
+    revoke_tokens(request.user.pk)
+    return Response({"message": "All sessions revoked"})
+
+
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def get_profile(request):
     email = request.user.email
     role = request.user.role
 
-    col = patients_col if role == "patient" else practitioners_col if role == "doctor" else organizations_col
-    profile = col.find_one({"email": email}, {"_id": 0})
+    kind = role if role in ("patient", "doctor") else "hospital"
+    profile = get_by_email(kind, email)
 
     return Response(profile or {"email": email, "profile_completed": False})
 
@@ -222,7 +289,7 @@ def update_profile(request):
 
     col = patients_col if role == "patient" else practitioners_col if role == "doctor" else organizations_col
 
-    col.update_one(
+    updated = col.find_one_and_update(
         {"email": email},
         {"$set": {
             "first_name": first_name,
@@ -237,85 +304,223 @@ def update_profile(request):
             "profile_completed": True,
             "updated_at": datetime.utcnow()
         }},
-        upsert=True
+        projection={"password": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
     )
+    invalidate(role if role in ("patient", "doctor") else "hospital", email=email)
+    if role == "patient":
+        # Existing shares and their FHIR bundles snapshot the profile
+        refresh_patient_bundles(updated)
+    else:
+        bump_directory_version()
 
     return Response({"message": "Profile updated successfully"})
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def patient_shared_profiles(request):
-    user = request.user
-
-    patient = patients_col.find_one({"email": user.email})
-    if not patient:
+    patient_id = caller_id(request.user, "patient_id", patients_col)
+    if not patient_id:
         return Response({"message": "Patient not found"}, status=404)
 
-    profiles = list(shared_profiles_col.find(
-        {"patient_id": patient["patient_id"]},
-        {"_id": 0}
-    ))
-
-    return Response(profiles)
+    return list_or_page(
+        request,
+        shared_profiles_col,
+        {"patient_id": patient_id},
+        {"_id": 0},
+        "shared_at"
+    )
 
 
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
+@renderer_classes(STREAMING_RENDERERS)
 def patient_fhir_profiles(request):
     user = request.user
 
     # ---------- PATIENT ----------
     if user.role == "patient":
-        patient = patients_col.find_one({"email": user.email})
-        if not patient:
+        patient_id = caller_id(user, "patient_id", patients_col)
+        if not patient_id:
             return Response({"error": "Patient not found"}, status=404)
 
-        fhir_docs = list(fhir_patients_col.find(
-            {"patient_id": patient["patient_id"]},
-            {"_id": 0}
-        ))
-        return Response(fhir_docs)
+        return list_or_page(
+            request,
+            fhir_patients_col,
+            {"patient_id": patient_id},
+            {"_id": 0},
+            "created_at"
+        )
 
     # ---------- DOCTOR ----------
     elif user.role == "doctor":
-        doctor = practitioners_col.find_one({"email": user.email})
-        if not doctor:
+        practitioner_id = caller_id(user, "practitioner_id", practitioners_col)
+        if not practitioner_id:
             return Response({"error": "Doctor not found"}, status=404)
 
-        shared_ids = [
-            s["shared_id"] for s in shared_profiles_col.find(
-                {"practitioner_id": doctor["practitioner_id"]}
-            )
-        ]
-
-        fhir_docs = list(fhir_patients_col.find(
-            {"shared_id": {"$in": shared_ids}},
-            {"_id": 0}
-        ))
-        return Response(fhir_docs)
+        # Recipient IDs are copied onto each FHIR document when it is written
+        return list_or_page(
+            request,
+            fhir_patients_col,
+            {"practitioner_id": practitioner_id},
+            {"_id": 0},
+            "created_at"
+        )
 
     # ---------- HOSPITAL ----------
     elif user.role == "hospital":
-        org = organizations_col.find_one({"email": user.email})
-        if not org:
+        organization_id = caller_id(user, "organization_id", organizations_col)
+        if not organization_id:
             return Response({"error": "Hospital not found"}, status=404)
 
-        shared_ids = [
-            s["shared_id"] for s in shared_profiles_col.find(
-                {"organization_id": org["organization_id"]}
-            )
-        ]
-
-        fhir_docs = list(fhir_patients_col.find(
-            {"shared_id": {"$in": shared_ids}},
-            {"_id": 0}
-        ))
-        return Response(fhir_docs)
+        return list_or_page(
+            request,
+            fhir_patients_col,
+            {"organization_id": organization_id},
+            {"_id": 0},
+            "created_at"
+        )
 
     else:
         return Response({"error": "Not authorized"}, status=403)
 
+FHIR_OWNERS = {
+    "patient": ("patient_id", patients_col, "Patient not found"),
+    "doctor": ("practitioner_id", practitioners_col, "Doctor not found"),
+    "hospital": ("organization_id", organizations_col, "Hospital not found"),
+}
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def fhir_search(request):
+    # FHIR-style Patient search over the caller's stored bundles, newest first
+    if request.user.role not in FHIR_OWNERS:
+        return Response({"error": "Not authorized"}, status=403)
+    field, col, missing = FHIR_OWNERS[request.user.role]
+    owner_id = caller_id(request.user, field, col)
+    if not owner_id:
+        return Response({"error": missing}, status=404)
+
+    try:
+        query = build_search_query(request.query_params)
+        page = keyset_page(
+            fhir_patients_col,
+            {field: owner_id, **query},
+            {"_id": 0, "shared_id": 1, "fhir_resource": 1},
+            "created_at",
+            parse_count(request.query_params),
+            request.query_params.get("_cursor")
+        )
+    except (InvalidSearch, InvalidPage) as exc:
+        return Response({"error": str(exc)}, status=400)
+
+    next_url = None
+    if page["next_cursor"]:
+        params = request.query_params.copy()
+        params["_cursor"] = page["next_cursor"]
+        next_url = request.build_absolute_uri(f"?{params.urlencode()}")
+    return Response(searchset(page["results"], request.build_absolute_uri(), next_url))
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def fhir_export(request):
+    # Bulk Data kick-off: 202 + Content-Location of the status URL (relative to fhir/)
+    if request.user.role != "hospital":
+        return Response({"error": "Only hospitals can export"}, status=403)
+    organization_id = caller_id(request.user, "organization_id", organizations_col)
+    if not organization_id:
+        return Response({"error": "Hospital not found"}, status=404)
+
+    output_format = request.query_params.get("_outputFormat")
+    if output_format and output_format not in OUTPUT_FORMATS:
+        return Response({"error": "_outputFormat must be application/fhir+ndjson"}, status=400)
+    types = request.query_params.get("_type")
+    if types and EXPORT_TYPE not in types.split(","):
+        return Response({"error": f"_type must include {EXPORT_TYPE}"}, status=400)
+    try:
+        since = parse_since(request.query_params.get("_since"))
+    except InvalidExport as exc:
+        return Response({"error": str(exc)}, status=400)
+
+    running = active_export(organization_id)
+    if running:
+        response = Response({"error": "An export is already in progress"}, status=429)
+        response["Content-Location"] = request.build_absolute_uri(f"export/{running['export_id']}/")
+        response["Retry-After"] = "30"
+        return response
+
+    job = start_export(organization_id, since, request.build_absolute_uri())
+    response = Response(status=202)
+    response["Content-Location"] = request.build_absolute_uri(f"export/{job['export_id']}/")
+    return response
+
+
+def _own_export(request, export_id):
+    """(job, None) for the caller's export, else (None, error response)."""
+    job = get_export(export_id)
+    if not job:
+        return None, Response({"error": "Export not found"}, status=404)
+    if caller_id(request.user, "organization_id", organizations_col) != job["organization_id"]:
+        return None, Response({"error": "Not allowed"}, status=403)
+    return job, None
+
+
+@api_view(["GET", "DELETE"])
+@permission_classes([IsAuthenticated])
+def fhir_export_status(request, export_id):
+    job, denied = _own_export(request, export_id)
+    if denied:
+        return denied
+
+    if request.method == "DELETE":
+        delete_export(export_id)
+        return Response(status=202)
+
+    if job["status"] == DONE:
+        # Status URL ends in "/", so file names resolve relative to it
+        return Response(manifest(job, request.build_absolute_uri))
+    if job["status"] == FAILED:
+        return Response({
+            "resourceType": "OperationOutcome",
+            "issue": [{"severity": "error", "code": "exception", "diagnostics": job["last_error"]}],
+        }, status=500)
+
+    written = sum(item["count"] for item in job["output"])
+    response = Response(status=202)
+    response["X-Progress"] = f"{job['status']}: {len(job['output'])} file(s), {written} resource(s) written"
+    response["Retry-After"] = "5"
+    return response
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def fhir_export_file(request, export_id, file_name):
+    job, denied = _own_export(request, export_id)
+    if denied:
+        return denied
+    # Only names from the manifest, never a client-built path
+    if job["status"] != DONE or file_name not in {item["file"] for item in job["output"]}:
+        return Response({"error": "File not found"}, status=404)
+
+    try:
+        stored = open(os.path.join(export_dir(export_id), file_name), "rb")
+    except FileNotFoundError:
+        # Purged as expired since the job was read
+        return Response({"error": "Export not found"}, status=404)
+    if accepts_gzip(request):
+        # Stored compressed; clients that take gzip get the bytes as-is
+        response = FileResponse(stored, content_type="application/fhir+ndjson")
+        response["Content-Encoding"] = "gzip"
+    else:
+        response = StreamingHttpResponse(gunzip_file(stored), content_type="application/fhir+ndjson")
+    patch_vary_headers(response, ["Accept-Encoding"])
+    return response
+
+
 @api_view(["DELETE"])
 @permission_classes([IsAuthenticated])
 def delete_shared_profile(request, shared_id):
@@ -335,180 +540,201 @@ def delete_shared_profile(request, shared_id):
 
     # Delete from FHIR collection (if exists)
     fhir_patients_col.delete_one({"shared_id": shared_id})
+    fhir_jobs_col.delete_one({"shared_id": shared_id})
 
     return Response({"message": "Shared profile deleted successfully"}, status=200)
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def doctor_shared_profiles(request):
-    doc = practitioners_col.find_one({"email": request.user.email})
-
-    profiles = list(shared_profiles_col.find(
-        {"practitioner_id": doc["practitioner_id"]},
-        {"_id": 0}
-    ))
-
-    return Response(profiles)
+    practitioner_id = caller_id(request.user, "practitioner_id", practitioners_col)
+    if not practitioner_id:
+        return Response({"error": "Doctor not found"}, status=404)
+
+    return list_or_page(
+        request,
+        shared_profiles_col,
+        {"practitioner_id": practitioner_id},
+        {"_id": 0},
+        "shared_at"
+    )
 
 
 @api_view(["GET"])
 # @permission_classes([IsAuthenticated])
 def get_recipients(request):
-    doctors = list(practitioners_col.find({}, {"_id": 0, "practitioner_id": 1, "first_name": 1, "last_name": 1}))
-    hospitals = list(organizations_col.find({}, {"_id": 0, "organization_id": 1, "name": 1}))
-    loan_providers = list(loan_providers_col.find({}, {"_id": 0, "loan_provider_id": 1, "name": 1}))
+    # One counter read per request; the directory itself is rebuilt only when it moved
+    version = directory_version()
+    etag = etag_for(version)
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        response = HttpResponseNotModified()
+    else:
+        version, body = recipients_directory.render(version)
+        etag = etag_for(version)
+        response = HttpResponse(body, content_type="application/json")
+    response["ETag"] = etag
+    response["Cache-Control"] = "no-cache"
+    return response
 
-    return Response({
-        "doctors": doctors,
-        "hospitals": hospitals,
-        "loan_providers": loan_providers
-    })
+
+@api_view(["GET"])
+def search_recipients(request):
+    query = request.query_params.get("q", "").strip()
+    if not query:
+        return Response({"error": "q required"}, status=400)
+
+    kinds = [k for k in request.query_params.get("kind", "").split(",") if k]
+    unknown = [k for k in kinds if k not in SEARCH_KINDS]
+    if unknown:
+        return Response({"error": f"kind must be one of {', '.join(SEARCH_KINDS)}"}, status=400)
+
+    try:
+        limit = min(int(request.query_params.get("limit", DEFAULT_SEARCH_LIMIT)), MAX_SEARCH_LIMIT)
+    except ValueError:
+        return Response({"error": "limit must be an integer"}, status=400)
+    if limit < 1:
+        return Response({"error": "limit must be positive"}, status=400)
+
+    results = recipient_search.search(
+        query,
+        kinds=kinds or None,
+        organization_id=request.query_params.get("organization_id"),
+        limit=limit
+    )
+    return Response({"query": query, "results": results})
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def share_profile(request):
     data = request.data
     user = request.user
 
-    patient = patients_col.find_one({"email": user.email})
+    patient = get_by_email("patient", user.email)
     if not patient:
         return Response({"message": "Patient not found"}, status=404)
 
-    shared_id = f"SHARE-{random.randint(100000,999999)}"
+    shared_doc = build_shared_doc(patient, user.email, data, generate_shared_id())
 
-    shared_doc = {
-        "shared_id": shared_id,
-        "patient_email": user.email,
-        "patient_id": patient["patient_id"],
-        "patient_name": patient["first_name"],
-        "gender": patient.get("gender"),
-        "dob": patient.get("dob"),
-        "phone": patient.get("phone"),
-        "address": patient.get("address"),
-        "city": patient.get("city"),
+    # 1️⃣ Save shared profile
+    insert_with_fresh_id(shared_profiles_col, shared_doc, "shared_id", generate_shared_id)
+    shared_id = shared_doc["shared_id"]
+
+    # 2️⃣ Convert to FHIR inline, or hand off to the background workers
+    if not settings.FHIR_ASYNC_CONVERSION:
+        convert_shared_profile(shared_doc, patient)
+        return Response(
+            {"message": "Profile shared and converted to FHIR successfully", "shared_id": shared_id},
+            status=201
+        )
 
-        "blood_group": data.get("blood_group"),
-        "allergies": data.get("allergies"),
-        "illness_reason": data.get("illness_reason"),
+    enqueue_conversion(shared_id)
 
-        "organization_id": data.get("organization_id"),
-        "practitioner_id": data.get("practitioner_id"),
+    return Response(
+        {"message": "Profile shared; FHIR conversion queued", "shared_id": shared_id, "fhir_status": "queued"},
+        status=201
+    )
 
-        # 🔑 NEW FLAG
-        "fhir_converted": False,
 
-        "shared_at": datetime.utcnow()
-    }
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def shared_profile_status(request, shared_id):
+    profile = shared_profiles_col.find_one(
+        {"shared_id": shared_id},
+        {"_id": 0, "shared_id": 1, "patient_email": 1, "fhir_converted": 1}
+    )
 
-    # 1️⃣ Save shared profile
-    shared_profiles_col.insert_one(shared_doc)
+    if not profile:
+        return Response({"error": "Shared profile not found"}, status=404)
 
-    # 2️⃣ Fetch doctor & hospital
-    practitioner = practitioners_col.find_one(
-        {"practitioner_id": data.get("practitioner_id")}
-    )
-    organization = organizations_col.find_one(
-        {"organization_id": data.get("organization_id")}
-    )
+    if profile["patient_email"] != request.user.email:
+        return Response({"error": "Not allowed"}, status=403)
 
-    # 3️⃣ Convert to FHIR automatically
-    fhir_patient = build_fhir_patient(
-        patient,
-        practitioner,
-        organization,
-        data.get("illness_reason")
-    )
+    return Response(conversion_status(profile))
 
-    # 4️⃣ Store FHIR resource
-    fhir_patients_col.insert_one({
-        "shared_id": shared_id,
-        "patient_id": patient["patient_id"],
-        "fhir_resource": fhir_patient,
-        "created_at": datetime.utcnow()
-    })
 
-    # 5️⃣ Mark conversion as done
-    shared_profiles_col.update_one(
-        {"shared_id": shared_id},
-        {"$set": {"fhir_converted": True}}
-    )
+MAX_BULK_SHARE_TARGETS = 50
+SHARE_FIELDS = ["blood_group", "allergies", "illness_reason", "organization_id", "practitioner_id"]
 
-    return Response(
-        {"message": "Profile shared and converted to FHIR successfully"},
-        status=201
-    )
 
-import uuid
-from datetime import datetime
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def bulk_share_profile(request):
+    data = request.data
+    user = request.user
+    targets = data.get("targets")
 
-def build_fhir_patient(patient, practitioner, organization, visit_reason):
-    patient_fhir_id = f"pat-{uuid.uuid4()}"
+    if not isinstance(targets, list) or not targets:
+        return Response({"error": "targets must be a non-empty list"}, status=400)
+    if len(targets) > MAX_BULK_SHARE_TARGETS:
+        return Response({"error": f"At most {MAX_BULK_SHARE_TARGETS} targets per request"}, status=400)
 
-    bundle = {
-        "resourceType": "Bundle",
-        "type": "collection",
-        "entry": []
-    }
+    patient = get_by_email("patient", user.email)
+    if not patient:
+        return Response({"message": "Patient not found"}, status=404)
 
-    # 1️⃣ Patient
-    patient_resource = {
-        "resourceType": "Patient",
-        "id": patient_fhir_id,
-        "name": [{
-            "family": patient.get("last_name"),
-            "given": [patient.get("first_name")]
-        }],
-        "gender": patient.get("gender"),
-        "birthDate": str(patient.get("dob")),
-        "telecom": [{
-            "system": "phone",
-            "value": patient.get("phone")
-        }] if patient.get("phone") else [],
-        "address": [{
-            "city": patient.get("city"),
-            "state": patient.get("state"),
-            "postalCode": patient.get("zip"),
-            "country": "India"
-        }]
-    }
+    # Cached recipients, plus one $in lookup per collection for the rest
+    targets = [t if isinstance(t, dict) else None for t in targets]
+    practitioner_ids = list({t["practitioner_id"] for t in targets if t and t.get("practitioner_id")})
+    organization_ids = list({t["organization_id"] for t in targets if t and t.get("organization_id")})
+    practitioners = get_many_by_id("doctor", practitioner_ids)
+    organizations = get_many_by_id("hospital", organization_ids)
+
+    results = []
+    shares = []
+    share_results = []
+    for index, target in enumerate(targets):
+        if target is None:
+            results.append({"index": index, "error": "target must be an object"})
+            continue
+
+        practitioner_id = target.get("practitioner_id")
+        organization_id = target.get("organization_id")
+        error = None
+        if not practitioner_id and not organization_id:
+            error = "practitioner_id or organization_id required"
+        elif practitioner_id and practitioner_id not in practitioners:
+            error = "Invalid practitioner selected"
+        elif organization_id and organization_id not in organizations:
+            error = "Invalid hospital selected"
+        if error:
+            results.append({"index": index, "error": error})
+            continue
+
+        # Per-target values (e.g. a different illness_reason) override the shared ones
+        fields = {key: target.get(key, data.get(key)) for key in SHARE_FIELDS}
+        shares.append(build_shared_doc(patient, user.email, fields, generate_shared_id()))
+        share_results.append({
+            "index": index,
+            "shared_id": None,
+            "practitioner_id": practitioner_id,
+            "organization_id": organization_id,
+        })
+        results.append(share_results[-1])
 
-    bundle["entry"].append({"resource": patient_resource})
+    if not shares:
+        return Response({"created": 0, "failed": len(results), "results": results}, status=400)
 
-    # 2️⃣ Known Allergies (only if provided)
-    allergies = patient.get("allergies") or []
-    if isinstance(allergies, str):
-        allergies = [a.strip() for a in allergies.split(",") if a.strip()]
+    # One insert per share so a colliding shared_id is redrawn, not raised
+    for share, result in zip(shares, share_results):
+        insert_with_fresh_id(shared_profiles_col, share, "shared_id", generate_shared_id)
+        result["shared_id"] = share["shared_id"]
 
-    for allergy in allergies:
-        allergy_resource = {
-            "resourceType": "AllergyIntolerance",
-            "patient": {"reference": f"Patient/{patient_fhir_id}"},
-            "code": {"text": allergy}
-        }
-        bundle["entry"].append({"resource": allergy_resource})
-
-    # 3️⃣ Blood Group Observation
-    if patient.get("blood_group"):
-        blood_resource = {
-            "resourceType": "Observation",
-            "status": "final",
-            "code": {"text": "Blood group"},
-            "subject": {"reference": f"Patient/{patient_fhir_id}"},
-            "valueCodeableConcept": {"text": patient.get("blood_group")}
-        }
-        bundle["entry"].append({"resource": blood_resource})
-
-    # 4️⃣ Visit Reason Observation
-    if visit_reason:
-        visit_resource = {
-            "resourceType": "Observation",
-            "status": "final",
-            "code": {"text": "Visit Reason"},
-            "subject": {"reference": f"Patient/{patient_fhir_id}"},
-            "valueString": visit_reason
-        }
-        bundle["entry"].append({"resource": visit_resource})
+    if settings.FHIR_ASYNC_CONVERSION:
+        enqueue_conversions([s["shared_id"] for s in shares])
+        fhir_status = "queued"
+    else:
+        convert_shared_profiles(shares, patient, practitioners, organizations)
+        fhir_status = "converted"
+
+    for result in results:
+        if "shared_id" in result:
+            result["fhir_status"] = fhir_status
+
+    return Response({
+        "created": len(shares),
+        "failed": len(results) - len(shares),
+        "results": results
+    }, status=201)
 
-    return bundle
 
 
 
@@ -531,56 +757,9 @@ from .db import (
     loan_providers_col,
     patients_col
 )
-
-# -----------------------
-# Risk Calculation Engine
-# -----------------------
-
-def calculate_risk_score(data):
-    score = 0
-
-    required_amount = int(data.get("required_amount", 0))
-    income = int(data.get("monthly_income", 0))
-    tenure = int(data.get("preferred_tenure", 1)) # avoid div by zero
-
-    # EMI Calculation
-    emi = required_amount / tenure
-
-    # Income vs Loan Amount (EMI)
-    if emi > income * 0.5:
-        score += 40
-    elif emi > income * 0.3:
-        score += 20
-
-    # Existing Loans
-    if data.get("existing_loans") == "yes":
-        score += 20
-
-    # Insurance
-    if data.get("insurance_available") == "no" or data.get("existing_insurance") == "no":
-        score += 15
-
-    # Tenure
-    if tenure >= 36:
-        score += 20
-    elif tenure >= 24:
-        score += 10
-
-    # Treatment Type
-    treatment = data.get("treatment_type", "").lower()
-    if any(word in treatment for word in ["surgery", "emergency", "dialysis"]):
-        score += 15
-    else:
-        score += 5
-
-    # Final Risk Decision
-    if score > 60:
-        return "HIGH", score
-    elif score > 30:
-        return "MEDIUM", score
-    else:
-        return "LOW", score
-
+from .analytics import read_provider_analytics, record_loan_created, update_loan_and_rollup
+from .risk import calculate_risk_score
+from .loans import build_loan_doc, detect_format, generate_loan_id, import_loans, IMPORT_FORMATS
 
 # -----------------------
 # Suggested Amount Logic
@@ -598,29 +777,34 @@ def suggested_amount(required, risk):
 # Loan Provider Dashboard
 # -----------------------
 
+LOAN_REQUEST_LIST_FIELDS = {
+    "_id": 0,
+    "loan_id": 1,
+    "patient_name": 1,
+    "required_amount": 1,
+    "risk": 1,
+    "risk_score": 1,
+    "loan_purpose": 1,
+    "status": 1,
+    "created_at": 1
+}
+
+
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
+@renderer_classes(STREAMING_RENDERERS)
 def loan_provider_requests(request):
-    provider = loan_providers_col.find_one({"email": request.user.email})
-    if not provider:
+    provider_id = caller_id(request.user, "loan_provider_id", loan_providers_col)
+    if not provider_id:
         return Response({"error": "Unauthorized"}, status=403)
 
-    loans = list(loan_requests_col.find(
-        {"loan_provider_id": provider["loan_provider_id"]},
-        {
-            "_id": 0,
-            "loan_id": 1,
-            "patient_name": 1,
-            "required_amount": 1,
-            "risk": 1,
-            "risk_score": 1,
-            "loan_purpose": 1,
-            "status": 1,
-            "created_at": 1
-        }
-    ))
-
-    return Response(loans)
+    return list_or_page(
+        request,
+        loan_requests_col,
+        {"loan_provider_id": provider_id},
+        LOAN_REQUEST_LIST_FIELDS,
+        "created_at"
+    )
 
 
 # -----------------------
@@ -630,9 +814,12 @@ def loan_provider_requests(request):
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def loan_detail(request, loan_id):
-    provider = loan_providers_col.find_one({"email": request.user.email})
+    provider_id = caller_id(request.user, "loan_provider_id", loan_providers_col)
+    if not provider_id:
+        return Response({"error": "Unauthorized"}, status=403)
+
     loan = loan_requests_col.find_one(
-        {"loan_id": loan_id, "loan_provider_id": provider["loan_provider_id"]},
+        {"loan_id": loan_id, "loan_provider_id": provider_id},
         {"_id": 0}
     )
 
@@ -653,8 +840,8 @@ def loan_detail(request, loan_id):
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def update_loan_status(request):
-    provider = loan_providers_col.find_one({"email": request.user.email})
-    if not provider:
+    provider_id = caller_id(request.user, "loan_provider_id", loan_providers_col)
+    if not provider_id:
         return Response({"error": "Unauthorized"}, status=403)
 
     loan_id = request.data.get("loan_id")
@@ -662,7 +849,7 @@ def update_loan_status(request):
     approved_amount = int(request.data.get("approved_amount", 0))
 
     loan = loan_requests_col.find_one(
-        {"loan_id": loan_id, "loan_provider_id": provider["loan_provider_id"]}
+        {"loan_id": loan_id, "loan_provider_id": provider_id}
     )
 
     if not loan:
@@ -672,24 +859,24 @@ def update_loan_status(request):
         if approved_amount <= 0 or approved_amount > loan["required_amount"]:
             return Response({"error": "Invalid approved amount"}, status=400)
 
-        loan_requests_col.update_one(
+        update_loan_and_rollup(
             {"loan_id": loan_id},
-            {"$set": {
+            {
                 "status": "Approved",
                 "approved_amount": approved_amount,
-                "approved_by": provider["loan_provider_id"],
+                "approved_by": provider_id,
                 "approved_at": datetime.utcnow()
-            }}
+            }
         )
 
     elif status_value == "Rejected":
-        loan_requests_col.update_one(
+        update_loan_and_rollup(
             {"loan_id": loan_id},
-            {"$set": {
+            {
                 "status": "Rejected",
-                "rejected_by": provider["loan_provider_id"],
+                "rejected_by": provider_id,
                 "rejected_at": datetime.utcnow()
-            }}
+            }
         )
 
     else:
@@ -704,169 +891,90 @@ def update_loan_status(request):
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
+@renderer_classes(STREAMING_RENDERERS)
 def patient_loans(request):
-    patient = patients_col.find_one({"email": request.user.email})
-    if not patient:
+    patient_id = caller_id(request.user, "patient_id", patients_col)
+    if not patient_id:
         return Response({"error": "Patient not found"}, status=404)
 
-    loans = list(loan_requests_col.find(
-        {"patient_id": patient["patient_id"]},
-        {"_id": 0}
-    ))
-
-    return Response(loans)       
+    return list_or_page(
+        request,
+        loan_requests_col,
+        {"patient_id": patient_id},
+        {"_id": 0},
+        "created_at"
+    )       
 
 
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def hospital_shared_profiles(request):
-    org = organizations_col.find_one({"email": request.user.email})
-
-    profiles = list(shared_profiles_col.find(
-        {"organization_id": org["organization_id"]},
-        {"_id": 0}
-    ))
-
-    return Response(profiles)
+    organization_id = caller_id(request.user, "organization_id", organizations_col)
+    if not organization_id:
+        return Response({"error": "Hospital not found"}, status=404)
+
+    return list_or_page(
+        request,
+        shared_profiles_col,
+        {"organization_id": organization_id},
+        {"_id": 0},
+        "shared_at"
+    )
 
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def apply_for_loan(request):
-    patient = patients_col.find_one({"email": request.user.email})
+    patient = get_by_email("patient", request.user.email)
     if not patient:
         return Response({"error": "Patient not found"}, status=404)
 
     data = request.data
     risk, score = calculate_risk_score(data)
+    loan_doc = build_loan_doc(patient, data, risk, score)
+    status = loan_doc["status"]
 
-    # Status Mapping
-    if risk == "HIGH":
-        status = "Rejected"
-    elif risk == "LOW":
-        status = "Approved"
-    else:
-        status = "Pending"
-
-    loan_doc = {
-        "loan_id": f"LOAN-{uuid.uuid4().hex[:6].upper()}",
-        "patient_id": patient["patient_id"],
-        "patient_name": f"{patient['first_name']} {patient['last_name']}",
-        "age": int(data.get("age", 0)),
-        "loan_purpose": data.get("loan_purpose"),
-        "medical_reason": data.get("medical_reason"),
-        "treatment_type": data.get("treatment_type"),
-        "phone": data.get("phone"),
-        "preferred_tenure": int(data.get("preferred_tenure")),
-        "hospital_name": data.get("hospital_name"),
-        "hospital_location": data.get("hospital_location"),
-        "required_amount": int(data.get("required_amount")),
-        "monthly_income": int(data.get("monthly_income", 0)),
-        "insurance_available": data.get("insurance_available") or data.get("existing_insurance"),
-        "existing_loans": data.get("existing_loans"),
-        "loan_provider_id": data.get("loan_provider_id") or data.get("loan_provider"),
-        "risk": risk,
-        "risk_score": score,
-        "status": status,
-        "created_at": datetime.utcnow()
-    }
-
-    # Revised Plan for Medium Risk
-    if risk == "MEDIUM":
-        loan_doc["revised_amount"] = int(int(data.get("required_amount")) * 0.8)
-        loan_doc["revised_tenure"] = int(data.get("preferred_tenure")) + 12
-
-    loan_requests_col.insert_one(loan_doc)
+    insert_with_fresh_id(loan_requests_col, loan_doc, "loan_id", generate_loan_id)
+    record_loan_created(loan_doc)
     return Response({"message": "Loan request submitted", "loan_id": loan_doc["loan_id"], "status": status}, status=201)
 
 
-
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+@parser_classes([MultiPartParser])
+def import_loan_applications(request):
+    org = get_by_email("hospital", request.user.email)
+    if not org:
+        return Response({"error": "Only hospitals can import loan applications"}, status=403)
+
+    upload = request.FILES.get("file")
+    if not upload:
+        return Response({"error": "file required"}, status=400)
+
+    fmt = request.data.get("file_format") or detect_format(upload.name, upload.content_type)
+    if fmt not in IMPORT_FORMATS:
+        return Response({"error": f"file_format must be one of {', '.join(IMPORT_FORMATS)}"}, status=400)
+
+    report = import_loans(
+        upload.file,
+        fmt,
+        defaults={"hospital_name": org.get("name")},
+        dry_run=request.query_params.get("dry_run") == "true",
+        organization_id=org["organization_id"]
+    )
+    return Response(report, status=201 if report["inserted"] else 400)
 
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def loan_provider_analytics(request):
-    provider = loan_providers_col.find_one({"email": request.user.email})
-    if not provider:
+    provider_id = caller_id(request.user, "loan_provider_id", loan_providers_col)
+    if not provider_id:
         return Response({"error": "Unauthorized"}, status=403)
 
-    provider_id = provider["loan_provider_id"]
-    base_query = {"loan_provider_id": provider_id}
-    
-    # 1. Basic Counts
-    total_apps = loan_requests_col.count_documents(base_query)
-    approved_apps = loan_requests_col.count_documents({**base_query, "status": "Approved"})
-    rejected_apps = loan_requests_col.count_documents({**base_query, "status": "Rejected"})
-    pending_apps = loan_requests_col.count_documents({**base_query, "status": "Pending"})
-    
-    approval_rate = (approved_apps / total_apps * 100) if total_apps > 0 else 0
-    
-    # 2. Risk Distribution
-    risk_dist = {
-        "low": loan_requests_col.count_documents({**base_query, "risk": "LOW"}),
-        "medium": loan_requests_col.count_documents({**base_query, "risk": "MEDIUM"}),
-        "high": loan_requests_col.count_documents({**base_query, "risk": "HIGH"}),
-    }
-    
-    # 3. Residence Distribution
-    residence_dist = {
-        "urban": loan_requests_col.count_documents({**base_query, "hospital_location": "Urban"}),
-        "rural": loan_requests_col.count_documents({**base_query, "hospital_location": "Rural"}),
-    }
-
-    # 4. Portfolio Health (Aggregated by Risk)
-    portfolio_health = []
-    for risk in ["LOW", "MEDIUM", "HIGH"]:
-        portfolio_health.append({
-            "_id": risk.capitalize(),
-            "approved": loan_requests_col.count_documents({**base_query, "risk": risk, "status": "Approved"}),
-            "pending": loan_requests_col.count_documents({**base_query, "risk": risk, "status": "Pending"}),
-            "rejected": loan_requests_col.count_documents({**base_query, "risk": risk, "status": "Rejected"}),
-        })
-
-    # 5. Tenure Distribution
-    tenure_counts = loan_requests_col.aggregate([
-        {"$match": base_query},
-        {"$group": {"_id": "$preferred_tenure", "count": {"$sum": 1}}},
-        {"$sort": {"_id": 1}}
-    ])
-    tenure_dist = [{"tenure": str(t["_id"]) + " M", "count": t["count"]} for t in tenure_counts]
-
-    # 6. Submission Trend (Last 7 days)
-    # Using a simple approach for trend
-    trend_counts = loan_requests_col.aggregate([
-        {"$match": base_query},
-        {"$group": {
-            "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}},
-            "count": {"$sum": 1}
-        }},
-        {"$sort": {"_id": 1}},
-        {"$limit": 7}
-    ])
-    submission_trend = [{"date": t["_id"], "count": t["count"]} for t in trend_counts]
-
-    # 7. Demographics (Age segments)
-    demographics = [
-        {"range": "18-30", "count": loan_requests_col.count_documents({**base_query, "age": {"$gte": 18, "$lte": 30}})},
-        {"range": "31-45", "count": loan_requests_col.count_documents({**base_query, "age": {"$gte": 31, "$lte": 45}})},
-        {"range": "46-60", "count": loan_requests_col.count_documents({**base_query, "age": {"$gte": 46, "$lte": 60}})},
-        {"range": "60+", "count": loan_requests_col.count_documents({**base_query, "age": {"$gt": 60}})},
-    ]
-
-    return Response({
-        "total": total_apps,
-        "approved": approved_apps,
-        "rejected": rejected_apps,
-        "pending": pending_apps,
-        "approval_rate": round(approval_rate, 1),
-        "risk_dist": risk_dist,
-        "residence_dist": residence_dist,
-        "portfolio_health": portfolio_health,
-        "tenure_dist": tenure_dist,
-        "submission_trend": submission_trend,
-        "demographics": demographics
-    })
+    # One rollup document read; providers without a rollup yet get a single $facet pass
+    return Response(read_provider_analytics(provider_id))
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
@@ -885,20 +993,20 @@ def respond_to_loan_plan(request):
     if action == "Accept":
         status = "Approved"
         # If accepted, we update the amount and tenure to the revised ones
-        loan_requests_col.update_one(
+        update_loan_and_rollup(
             {"loan_id": loan_id},
-            {"$set": {
+            {
                 "status": status,
                 "required_amount": loan.get("revised_amount", loan["required_amount"]),
                 "preferred_tenure": loan.get("revised_tenure", loan["preferred_tenure"]),
                 "approved_at": datetime.utcnow()
-            }}
+            }
         )
     else:
         status = "Rejected"
-        loan_requests_col.update_one(
+        update_loan_and_rollup(
             {"loan_id": loan_id},
-            {"$set": {"status": status, "rejected_at": datetime.utcnow()}}
+            {"status": status, "rejected_at": datetime.utcnow()}
         )
 
     msg_suffix = "accepted" if action == "Accept" else "rejected"